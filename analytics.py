@@ -0,0 +1,124 @@
+"""
+Progress analytics over the columnar history of a user, computed with NumPy.
+
+Each statistic is computed on all the results of an exercise template at once. The results are grouped by session
+(the results of a session are contiguous in the history, whose session column tells apart the sessions of a same
+date) with reduceat.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+import history
+
+FORMULAS = ("epley", "brzycki")
+
+DAY_SECONDS = 24 * 3600
+WEEK_SECONDS = 7 * DAY_SECONDS
+# The epoch is a Thursday, the weeks start on Monday
+_WEEK_OFFSET = 3 * DAY_SECONDS
+
+
+def estimate_1rm(weights: np.ndarray, reps: np.ndarray, formula: str = "epley") -> np.ndarray:
+    """
+    Estimated one repetition maximum of each set. A single repetition is its own maximum. Brzycki is not defined from
+    37 repetitions on (infinite, then negative): Epley is used for those sets.
+    """
+    epley = weights * (1 + reps / 30)
+    if formula == "epley":
+        estimate = epley
+    elif formula == "brzycki":
+        # np.where computes both branches, the division by zero at 37 repetitions is not used
+        with np.errstate(divide="ignore", invalid="ignore"):
+            estimate = np.where(reps < 37, weights * 36 / (37 - reps), epley)
+    else:
+        raise ValueError(f"Unknown 1RM formula: {formula}")
+    return np.where(reps == 1, weights, estimate)
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the `window` values ending at each position (fewer at the start), the NaN values left out."""
+    valid = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sums[ends] - sums[starts]) / (counts[ends] - counts[starts])
+
+
+class SessionSeries(NamedTuple):
+    """One value per session, in date order."""
+    timestamps: np.ndarray
+    max_weight: np.ndarray
+    reps: np.ndarray
+    volume: np.ndarray
+    best_e1rm: np.ndarray
+    rolling_e1rm: np.ndarray
+
+
+class ExerciseStats(NamedTuple):
+    sessions: SessionSeries
+    # Start (Monday 00:00 UTC) of each week with sessions, and the weight lifted during it
+    weeks: np.ndarray
+    weekly_tonnage: np.ndarray
+    # Sessions whose best e1RM beats the best of every session before them
+    record_timestamps: np.ndarray
+    best_weight: float
+    best_e1rm: float
+    best_e1rm_timestamp: int
+
+
+def exercise_stats(exercise_history: history.ExerciseHistory, formula: str = "epley",
+                   window: int = 5) -> ExerciseStats | None:
+    """
+    The statistics of the results of one exercise, None without results. The arrays are read without copy: the history
+    must not change while they are used, give a copy of the history of the store.
+    """
+    if not len(exercise_history):
+        return None
+
+    timestamps = np.frombuffer(exercise_history.timestamps, dtype=np.int64)
+    sessions = np.frombuffer(exercise_history.sessions, dtype=np.int64)
+    weights = np.frombuffer(exercise_history.weights, dtype=np.float64)
+    reps = np.frombuffer(exercise_history.reps, dtype=np.int64)
+
+    e1rm = estimate_1rm(weights, reps, formula)
+    volume = weights * reps
+
+    # First result of each session
+    starts = np.flatnonzero(np.diff(sessions, prepend=sessions[0] - 1))
+    session_timestamps = timestamps[starts]
+    session_volume = np.add.reduceat(volume, starts)
+    session_best = np.maximum.reduceat(e1rm, starts)
+
+    best_before = np.maximum.accumulate(session_best)
+    is_record = np.zeros(len(starts), dtype=bool)
+    is_record[1:] = session_best[1:] > best_before[:-1]
+
+    week_starts = (session_timestamps + _WEEK_OFFSET) // WEEK_SECONDS * WEEK_SECONDS - _WEEK_OFFSET
+    weeks, week_index = np.unique(week_starts, return_inverse=True)
+    weekly_tonnage = np.bincount(week_index, weights=session_volume)
+
+    best_session = int(np.argmax(session_best))
+    return ExerciseStats(
+        sessions=SessionSeries(session_timestamps, np.maximum.reduceat(weights, starts), np.add.reduceat(reps, starts),
+                               session_volume, session_best, rolling_mean(session_best, window)),
+        weeks=weeks,
+        weekly_tonnage=weekly_tonnage,
+        record_timestamps=session_timestamps[is_record],
+        best_weight=float(weights.max()),
+        best_e1rm=float(session_best[best_session]),
+        best_e1rm_timestamp=int(session_timestamps[best_session]),
+    )
+
+
+def user_stats(histories: dict[str, history.ExerciseHistory], formula: str = "epley",
+               window: int = 5) -> dict[str, ExerciseStats]:
+    """The statistics of each exercise of a user, by exercise template id."""
+    stats = {}
+    for exercise_template_id, exercise_history in histories.items():
+        exercise = exercise_stats(exercise_history, formula, window)
+        if exercise is not None:
+            stats[exercise_template_id] = exercise
+    return stats
@@ -0,0 +1,183 @@
+"""
+Streaming NDJSON export and import of user data.
+
+A file has one record per line, {"key": <collection>, "object": <dump by reference>}, like the JsonStorage journal.
+Each user starts with its own record (without its lists), followed by the exercise types, the programs and the
+sessions it owns. An entity only references entities of earlier lines, so a file is imported in a single pass.
+
+    python backup.py export alice.ndjson --user 123456789 --since 2025-01-01
+    python backup.py export everyone.ndjson
+    python backup.py import alice.ndjson
+"""
+import argparse
+import copy
+import json
+from collections import ChainMap
+from datetime import datetime
+from typing import IO, Iterable, Iterator
+
+import datamodel
+import storage
+from storage import JsonStorage
+
+
+def _record(key: str, model_object: datamodel.JsonSerializable) -> str:
+    return json.dumps({"key": key, "object": model_object.dump(by_reference=True)}, separators=(",", ":")) + "\n"
+
+
+def _in_range(date: int | None, since: int | None, until: int | None) -> bool:
+    if since is None and until is None:
+        return True
+    # An undated session is in no date range
+    return date is not None and (since is None or date >= since) and (until is None or date < until)
+
+
+def iter_user_records(user: datamodel.User, since: int = None, until: int = None) -> Iterator[str]:
+    """
+    The NDJSON lines of a user. Only the sessions dated from `since` (included) to `until` (excluded) are exported,
+    with the programs and exercise types they need. The undated sessions are only exported without since and until.
+    """
+    sessions = [session for session in user.sessions if _in_range(session.date, since, until)]
+
+    programs = {program.id: program for program in user.programTypes}
+    for session in sessions:
+        programs.setdefault(session.template.id, session.template)
+
+    exercise_templates = {exercise_template.id: exercise_template for exercise_template in user.exerciseTypes}
+    for program in programs.values():
+        for exercise_program in program.exercisePrograms:
+            exercise_templates.setdefault(exercise_program.exerciseTemplate.id, exercise_program.exerciseTemplate)
+
+    # The user is written without its lists, the records that follow it are its objects
+    user_header = copy.copy(user)
+    user_header.exerciseTypes = []
+    user_header.programTypes = []
+    user_header.sessions = []
+    yield _record(JsonStorage.DB_KEY_USERS, user_header)
+
+    for exercise_template in exercise_templates.values():
+        yield _record(JsonStorage.DB_KEY_EXERCISE_TYPES, exercise_template)
+    for program in programs.values():
+        yield _record(JsonStorage.DB_KEY_PROGRAMS, program)
+    for session in sessions:
+        yield _record(JsonStorage.DB_KEY_SESSIONS, session)
+
+
+def export_users(storage_interface: storage.StorageInterface, user_ids: Iterable[int], file: IO[str],
+                 since: int = None, until: int = None) -> int:
+    """Write the NDJSON lines of the given users in file, one user in memory at a time. Return the lines written."""
+    lines = 0
+    for user_id in user_ids:
+        user = storage_interface.get_user_from_user_id(user_id)
+        if user is None:
+            continue
+        for line in iter_user_records(user, since, until):
+            file.write(line)
+            lines += 1
+    return lines
+
+
+def _unresolved_reference(model_object: datamodel.JsonSerializable) -> str | None:
+    """The first id referenced by an imported object that no earlier line defined, the id is then left as is."""
+    if isinstance(model_object, datamodel.Session):
+        references = [model_object.template] + [exercise.exerciseProgram for exercise in model_object.results]
+    elif isinstance(model_object, datamodel.Program):
+        references = [exercise_program.exerciseTemplate for exercise_program in model_object.exercisePrograms]
+    else:
+        references = []
+    return next((reference for reference in references if isinstance(reference, str)), None)
+
+
+def import_records(storage_interface: storage.StorageInterface, lines: Iterable[str], batch_size: int = 500) -> int:
+    """
+    Upsert the objects of NDJSON lines, batch_size objects per upcreate_batch_and_add_to_user call. The exercise
+    types and programs read are kept to link the next lines, a session is dropped once written. Return the objects
+    imported.
+
+    A ValueError is raised on an object referencing an id defined on no earlier line (a program missing from the
+    file), the batches before it are already imported.
+    """
+    catalog: dict[str, datamodel.JsonSerializable] = {}
+    user: datamodel.User | None = None
+    batch = {JsonStorage.DB_KEY_EXERCISE_TYPES: [], JsonStorage.DB_KEY_PROGRAMS: [], JsonStorage.DB_KEY_SESSIONS: []}
+    imported = 0
+
+    def write_batch():
+        nonlocal imported
+        if user is not None and any(batch.values()):
+            storage_interface.upcreate_batch_and_add_to_user(
+                user, batch[JsonStorage.DB_KEY_EXERCISE_TYPES], batch[JsonStorage.DB_KEY_PROGRAMS],
+                batch[JsonStorage.DB_KEY_SESSIONS])
+            imported += sum(len(model_objects) for model_objects in batch.values())
+        for model_objects in batch.values():
+            model_objects.clear()
+
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        key = record["key"]
+
+        if key == JsonStorage.DB_KEY_USERS:
+            write_batch()
+            user = datamodel.JsonSerializable.load(record["object"])
+            continue
+        if user is None or key not in batch:
+            raise ValueError(f"Unexpected {key} record: {line[:80]}")
+
+        if key == JsonStorage.DB_KEY_SESSIONS:
+            # A session and its exercises go in a map of their own, forgotten with it
+            model_object = datamodel.JsonSerializable.load_linked(record["object"], ChainMap({}, catalog))
+        else:
+            # Exported again with each of its users, the same instance is updated so they all share it
+            model_object = datamodel.JsonSerializable.load_linked(record["object"], catalog,
+                                                                  into=catalog.get(record["object"]["id"]))
+
+        unresolved = _unresolved_reference(model_object)
+        if unresolved is not None:
+            raise ValueError(f"The {key} record {model_object.id} references {unresolved}, which is not in the file "
+                             "before it")
+        batch[key].append(model_object)
+        if sum(len(model_objects) for model_objects in batch.values()) >= batch_size:
+            write_batch()
+
+    write_batch()
+    return imported
+
+
+def _timestamp(date: str | None) -> int | None:
+    return datamodel.to_timestamp(datetime.fromisoformat(date)) if date else None
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Export or import user data as NDJSON")
+    parser.add_argument("--storage", choices=["json", "sharded", "sqlite", "mongo"], default=storage.STORAGE_BACKEND,
+                        help="Storage backend")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write the data of users in an NDJSON file")
+    export_parser.add_argument("path", help="NDJSON file to write")
+    export_parser.add_argument("--user", type=int, action="append",
+                               help="Discord id of a user, all the users if not given")
+    export_parser.add_argument("--since", help="First session date exported, e.g. 2025-01-01")
+    export_parser.add_argument("--until", help="Sessions from this date on are not exported")
+
+    import_parser = subparsers.add_parser("import", help="Upsert the data of an NDJSON file")
+    import_parser.add_argument("path", help="NDJSON file to read")
+    import_parser.add_argument("--batch-size", type=int, default=500, help="Objects per batched upsert")
+
+    args = parser.parse_args()
+
+    storage.STORAGE_BACKEND = args.storage
+    target = storage.get_storage()
+
+    if args.action == "export":
+        with open(args.path, "w", encoding="utf-8") as f:
+            count = export_users(target, args.user or target.iter_user_ids(), f, _timestamp(args.since), _timestamp(args.until))
+        print(f"Exported {count} records to {args.path}")
+    else:
+        with open(args.path, "r", encoding="utf-8") as f:
+            count = import_records(target, f, args.batch_size)
+        target.flush()
+        print(f"Imported {count} objects from {args.path}")
@@ -0,0 +1,393 @@
+"""
+Benchmarks of the storage and the data model on synthetic databases.
+
+    python benchmark.py reads --sessions 2000
+    python benchmark.py startup --users 50 --sessions 500
+    python benchmark.py serialization --sessions 1000
+    python benchmark.py codecs --sessions 100 --totals 1000 10000 100000
+    python benchmark.py memory --sessions 10000
+    python benchmark.py migrations --users 50 --sessions 1000
+    python benchmark.py analytics --sessions 2000
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import analytics
+import datamodel
+import history
+import migrations
+import storage
+import storage_codecs
+
+EXERCISE_NAMES = ["Développé couché", "Squat", "Soulevé de terre", "Tractions", "Développé militaire"]
+
+
+def build_user(user_id: int, sessions_count: int, exercise_types: list[datamodel.ExerciseType],
+               program: datamodel.Program) -> datamodel.User:
+    user = datamodel.User(user_id, f"<@{user_id}>")
+    user.exerciseTypes = list(exercise_types)
+    user.programTypes = [program]
+
+    date = datetime(2020, 1, 1)
+    for _ in range(sessions_count):
+        date += timedelta(days=random.randint(1, 3))
+        session = datamodel.Session(program, date)
+        for exercise_program in program.exercisePrograms:
+            session.add_exercise_result(
+                datamodel.Exercise(exercise_program, random.randint(20, 160) / 2, random.randint(3, 12)))
+        user.sessions.append(session)
+    return user
+
+
+def open_json_storage(path: str, **kwargs) -> storage.JsonStorage:
+    # JsonStorage is a singleton, the benchmarks need a fresh instance per file
+    storage.JsonStorage._instance = None
+    return storage.JsonStorage(path, **kwargs)
+
+
+def write_synthetic_json_storage(path: str, users_count: int, sessions_per_user: int) -> None:
+    exercise_types = [datamodel.ExerciseType(name) for name in EXERCISE_NAMES]
+    program = datamodel.Program("Full body")
+    for exercise_type in exercise_types:
+        program.add_exercise_program(datamodel.ExerciseProgram(exercise_type, 90))
+
+    json_storage = open_json_storage(path, flush_delay=0)
+    for exercise_type in exercise_types:
+        json_storage._replace(exercise_type, storage.JsonStorage.DB_KEY_EXERCISE_TYPES)
+    json_storage._replace(program, storage.JsonStorage.DB_KEY_PROGRAMS)
+    for user_id in range(users_count):
+        user = build_user(user_id, sessions_per_user, exercise_types, program)
+        for session in user.sessions:
+            json_storage._replace(session, storage.JsonStorage.DB_KEY_SESSIONS)
+        json_storage._replace(user, storage.JsonStorage.DB_KEY_USERS)
+    json_storage.compact()
+
+
+def write_legacy_data_file(path: str, users_count: int, sessions_per_user: int) -> None:
+    """A data file of schema version 0: one line per object, linked objects embedded and dates as ISO strings."""
+    exercise_types = [datamodel.ExerciseType(name) for name in EXERCISE_NAMES]
+    program = datamodel.Program("Full body")
+    for exercise_type in exercise_types:
+        program.add_exercise_program(datamodel.ExerciseProgram(exercise_type, 90))
+
+    def legacy_dump(model_object: datamodel.JsonSerializable) -> str:
+        raw = model_object.dump()
+        for session in raw.get("sessions", [raw]):
+            if session["_class"] == "Session":
+                session["date"] = datamodel.from_timestamp(session["date"]).isoformat()
+        return json.dumps(raw, separators=(",", ":"))
+
+    users = [build_user(user_id, sessions_per_user, exercise_types, program) for user_id in range(users_count)]
+    # In the order of the collections of JsonStorage.data at that version: the users, with their sessions embedded,
+    # before the sessions
+    collections = {
+        storage.JsonStorage.DB_KEY_EXERCISE_TYPES: exercise_types,
+        storage.JsonStorage.DB_KEY_PROGRAMS: [program],
+        storage.JsonStorage.DB_KEY_USERS: users,
+        storage.JsonStorage.DB_KEY_SESSIONS: [session for user in users for session in user.sessions],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        f.write(",\n".join(
+            json.dumps(key) + ": [\n" + ",\n".join(legacy_dump(model_object) for model_object in model_objects) + "\n]"
+            for key, model_objects in collections.items()
+        ))
+        f.write("\n}\n")
+
+
+def baseline_dump(model_object: datamodel.JsonSerializable) -> dict:
+    """The generic dump the per-class dumpers replaced: the type of every field is checked at each call."""
+    data = {"_class": model_object.__class__.__name__, "_module": model_object.__class__.__module__}
+    for key, value in model_object.fields().items():
+        if isinstance(value, datamodel.JsonSerializable):
+            data[key] = baseline_dump(value)
+        elif isinstance(value, list):
+            data[key] = [baseline_dump(v) if isinstance(v, datamodel.JsonSerializable) else v for v in value]
+        else:
+            data[key] = value
+    return data
+
+
+def baseline_load(raw: dict) -> datamodel.JsonSerializable:
+    """
+    The generic load the per-class loaders replaced: the class is imported by name for every object, and each nested
+    object goes through a JSON round trip.
+    """
+    raw = dict(raw)
+    class_name = raw.pop("_class")
+    target_cls = getattr(importlib.import_module(raw.pop("_module")), class_name)
+    instance = target_cls.__new__(target_cls)
+    for key, value in raw.items():
+        if isinstance(value, dict) and "_class" in value:
+            value = baseline_load(json.loads(json.dumps(value)))
+        elif isinstance(value, list):
+            value = [baseline_load(json.loads(json.dumps(v))) if isinstance(v, dict) and "_class" in v else v
+                     for v in value]
+        setattr(instance, key, value)
+    return instance
+
+
+class UnslottedObject:
+    """A model object as before __slots__ and integer dates: its fields in a __dict__, a session date in ISO."""
+
+    def __init__(self, **fields):
+        self.id = datamodel.generate_id()
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+
+# One class per model class, so the instances of each share the keys of their __dict__ as the model objects did
+UNSLOTTED_CLASSES = {
+    name: type(name, (UnslottedObject,), {})
+    for name in ("ExerciseType", "ExerciseProgram", "Exercise", "Program", "Session", "User")
+}
+
+
+def build_unslotted_user(user_id: int, sessions_count: int, exercise_types: list[UnslottedObject],
+                         program: UnslottedObject) -> UnslottedObject:
+    """The same user as build_user, with the same random generator state."""
+    user = UNSLOTTED_CLASSES["User"](userId=user_id, mention=f"<@{user_id}>", exerciseTypes=list(exercise_types),
+                                     programTypes=[program], sessions=[])
+
+    date = datetime(2020, 1, 1)
+    for _ in range(sessions_count):
+        date += timedelta(days=random.randint(1, 3))
+        session = UNSLOTTED_CLASSES["Session"](template=program, date=date.isoformat(), results=[])
+        for exercise_program in program.exercisePrograms:
+            session.results.append(UNSLOTTED_CLASSES["Exercise"](
+                exerciseProgram=exercise_program, weight=random.randint(20, 160) / 2, reps=random.randint(3, 12)))
+        user.sessions.append(session)
+    return user
+
+
+def unslotted_dump(model_object: UnslottedObject) -> dict:
+    """Dumped with its linked objects embedded, as before the references."""
+    data = {"_class": type(model_object).__name__}
+    for key, value in model_object.__dict__.items():
+        if isinstance(value, UnslottedObject):
+            data[key] = unslotted_dump(value)
+        elif isinstance(value, list):
+            data[key] = [unslotted_dump(v) if isinstance(v, UnslottedObject) else v for v in value]
+        else:
+            data[key] = value
+    return data
+
+
+def unslotted_load(raw: dict) -> UnslottedObject:
+    """Every embedded object becomes its own copy, as before the identity map."""
+    raw = dict(raw)
+    target_cls = UNSLOTTED_CLASSES[raw.pop("_class")]
+    model_object = target_cls.__new__(target_cls)
+    for key, value in raw.items():
+        if isinstance(value, dict):
+            value = unslotted_load(value)
+        elif isinstance(value, list):
+            value = [unslotted_load(v) if isinstance(v, dict) else v for v in value]
+        setattr(model_object, key, value)
+    return model_object
+
+
+def timed(function, repeat: int) -> float:
+    """Average duration of one call, in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def bench_reads(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.json")
+        write_synthetic_json_storage(path, 1, args.sessions)
+        json_storage = open_json_storage(path)
+
+        def deep_copy_read():
+            user = json_storage.get_user_from_user_id(0)
+            return datamodel.User.load(user.dump())
+
+        copied = timed(deep_copy_read, args.repeat)
+        zero_copy = timed(lambda: json_storage.get_user_from_user_id(0), args.repeat)
+
+    print(f"get_user_from_user_id, {args.sessions} sessions")
+    print(f"  dump/load copy : {copied:10.3f} ms")
+    print(f"  zero copy      : {zero_copy:10.3f} ms")
+
+
+def bench_serialization(args):
+    exercise_types = [datamodel.ExerciseType(name) for name in EXERCISE_NAMES]
+    program = datamodel.Program("Full body")
+    for exercise_type in exercise_types:
+        program.add_exercise_program(datamodel.ExerciseProgram(exercise_type, 90))
+    user = build_user(0, args.sessions, exercise_types, program)
+
+    print(f"dump / load, user of {args.sessions} sessions, baseline -> current")
+    for name, model_object in (("Program", program), ("Session", user.sessions[0]), ("User", user)):
+        dumped = model_object.dump()
+        baseline_dump_duration = timed(lambda: baseline_dump(model_object), args.repeat)
+        dump = timed(model_object.dump, args.repeat)
+        baseline_load_duration = timed(lambda: baseline_load(dumped), args.repeat)
+        load = timed(lambda: datamodel.JsonSerializable.load(dumped), args.repeat)
+        print(f"  {name:8} : dump {baseline_dump_duration:10.3f} -> {dump:10.3f} ms, "
+              f"load {baseline_load_duration:10.3f} -> {load:10.3f} ms")
+
+
+def bench_startup(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.json")
+        write_synthetic_json_storage(path, args.users, args.sessions)
+
+        print(f"JsonStorage startup, {args.users} users x {args.sessions} sessions")
+        for lazy in (False, True):
+            tracemalloc.start()
+            start = time.perf_counter()
+            json_storage = open_json_storage(path, lazy=lazy)
+            startup = (time.perf_counter() - start) * 1000
+            startup_memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+
+            start = time.perf_counter()
+            json_storage.get_user_from_user_id(0)
+            first_read = (time.perf_counter() - start) * 1000
+            tracemalloc.stop()
+
+            mode = "lazy " if lazy else "eager"
+            print(f"  {mode} : startup {startup:10.1f} ms, {startup_memory:8.1f} MiB, first user read {first_read:8.1f} ms")
+
+
+def bench_codecs(args):
+    with tempfile.TemporaryDirectory() as directory:
+        for total in args.totals:
+            users = max(1, total // args.sessions)
+            source = os.path.join(directory, f"source-{total}.json")
+            write_synthetic_json_storage(source, users, total // users)
+            loaded = open_json_storage(source, lazy=False, flush_delay=0)
+
+            print(f"Data file codecs, {users} users x {total // users} sessions")
+            for codec in storage_codecs.CODECS.values():
+                if codec.name == storage_codecs.ZstdJsonCodec.name and storage_codecs.zstandard is None:
+                    print(f"  {codec.name:5} : zstandard is not installed")
+                    continue
+
+                path = os.path.join(directory, f"{total}{codec.extension}")
+                loaded.codec = codec
+                save = timed(lambda: loaded._write_data_file(path, loaded.data), 1)
+                size = os.path.getsize(path) / 1024 / 1024
+                load = timed(lambda: open_json_storage(path, lazy=False, journal=False), 1)
+                line = f"  {codec.name:5} : load {load:10.1f} ms, save {save:10.1f} ms, {size:8.2f} MiB"
+                if codec.line_per_object:
+                    line += f", lazy load {timed(lambda: open_json_storage(path, journal=False), 1):10.1f} ms"
+                print(line)
+
+
+def bench_memory(args):
+    exercise_types = [datamodel.ExerciseType(name) for name in EXERCISE_NAMES]
+    program = datamodel.Program("Full body")
+    for exercise_type in exercise_types:
+        program.add_exercise_program(datamodel.ExerciseProgram(exercise_type, 90))
+
+    unslotted_exercise_types = [UNSLOTTED_CLASSES["ExerciseType"](name=name) for name in EXERCISE_NAMES]
+    unslotted_program = UNSLOTTED_CLASSES["Program"](name="Full body", exercisePrograms=[
+        UNSLOTTED_CLASSES["ExerciseProgram"](exerciseTemplate=exercise_type, restTimeSeconds=90)
+        for exercise_type in unslotted_exercise_types
+    ])
+
+    def traced(function) -> tuple[object, int]:
+        tracemalloc.start()
+        result = function()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return result, memory
+
+    random.seed(0)
+    user, built = traced(lambda: build_user(0, args.sessions, exercise_types, program))
+    random.seed(0)
+    unslotted_user, baseline_built = traced(
+        lambda: build_unslotted_user(0, args.sessions, unslotted_exercise_types, unslotted_program))
+
+    dumped = user.dump()
+    loaded, loaded_memory = traced(lambda: datamodel.JsonSerializable.load(dumped))
+    unslotted_dumped = unslotted_dump(unslotted_user)
+    _, baseline_loaded = traced(lambda: unslotted_load(unslotted_dumped))
+
+    def mib(memory: int) -> str:
+        return f"{memory / 1024 / 1024:8.2f} MiB ({memory / args.sessions:6.0f} bytes per session)"
+
+    exercises = sum(len(session.results) for session in loaded.sessions)
+    print(f"Memory of a user of {args.sessions} sessions, {exercises} exercises, baseline -> current")
+    print(f"  built  : {mib(baseline_built)} -> {mib(built)}")
+    print(f"  loaded : {mib(baseline_loaded)} -> {mib(loaded_memory)}")
+
+
+def bench_migrations(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "legacy.json")
+        write_legacy_data_file(path, args.users, args.sessions)
+        size = os.path.getsize(path) / 1024 / 1024
+        records = args.users * (args.sessions + 1) + len(EXERCISE_NAMES) + 1
+
+        print(f"Migrations of a data file of version 0, {args.users} users x {args.sessions} sessions, "
+              f"{records} records, {size:.2f} MiB")
+        traced_path = os.path.join(directory, "traced.json")
+        shutil.copyfile(path, traced_path)
+
+        dry_run = timed(lambda: migrations.migrate(path, dry_run=True, progress=None), 1)
+        print(f"  dry run : {dry_run:10.1f} ms")
+        duration = timed(lambda: migrations.migrate(path, progress=None), 1)
+        print(f"  migrate : {duration:10.1f} ms, {records / duration * 1000:10.0f} records/s, "
+              f"{size / duration * 1000:8.2f} MiB/s, {os.path.getsize(path) / 1024 / 1024:.2f} MiB after")
+
+        # Measured on a copy, tracing slows the migration down
+        tracemalloc.start()
+        migrations.migrate(traced_path, progress=None)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  peak    : {peak / 1024 / 1024:10.1f} MiB")
+
+
+def bench_analytics(args):
+    exercise_types = [datamodel.ExerciseType(name) for name in EXERCISE_NAMES]
+    program = datamodel.Program("Full body")
+    for exercise_type in exercise_types:
+        program.add_exercise_program(datamodel.ExerciseProgram(exercise_type, 90))
+    user = build_user(0, args.sessions, exercise_types, program)
+
+    histories = history.HistoryStore(lambda user_id: user).copy_user_histories(0)
+    results = sum(len(exercise_history) for exercise_history in histories.values())
+    years = (user.sessions[-1].date - user.sessions[0].date) / (365 * analytics.DAY_SECONDS)
+
+    print(f"Analytics of a user of {args.sessions} sessions over {years:.1f} years, {results} results")
+    for formula in analytics.FORMULAS:
+        duration = timed(lambda: analytics.user_stats(histories, formula), args.repeat)
+        print(f"  {formula:7} : {duration:8.2f} ms")
+
+
+BENCHMARKS = {
+    "analytics": bench_analytics,
+    "codecs": bench_codecs,
+    "memory": bench_memory,
+    "migrations": bench_migrations,
+    "reads": bench_reads,
+    "serialization": bench_serialization,
+    "startup": bench_startup,
+}
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Storage and data model benchmarks")
+    parser.add_argument("benchmark", choices=list(BENCHMARKS))
+    parser.add_argument("--users", type=int, default=20, help="Synthetic users")
+    parser.add_argument("--sessions", type=int, default=1000, help="Sessions per synthetic user")
+    parser.add_argument("--repeat", type=int, default=20, help="Calls per measure")
+    parser.add_argument("--totals", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Total sessions of the synthetic databases of the codecs benchmark")
+    args = parser.parse_args()
+
+    random.seed(0)
+    BENCHMARKS[args.benchmark](args)
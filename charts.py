@@ -0,0 +1,102 @@
+"""
+Progress charts of an exercise, rendered with matplotlib in a process pool and cached on disk.
+
+A chart is a PNG file named after (user, exercise template, last session, results, formula): a new session gives a new
+name, so a cached file is never stale. The older charts of the same user, exercise and formula are removed when a new
+one is rendered.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import analytics
+import datamodel
+import history
+
+# Directory of the rendered charts
+CHART_DIRECTORY = os.environ.get("TRAININGBOOK_CHART_DIRECTORY", "charts")
+RENDER_PROCESSES = int(os.environ.get("TRAININGBOOK_CHART_PROCESSES", "1"))
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn rather than fork: the bot process runs threads (discord.py, the storage executor)
+        _pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def chart_path(user_id: int, exercise_template_id: str, last_session_id: str, results: int, formula: str) -> str:
+    return os.path.join(CHART_DIRECTORY,
+                        f"{user_id}-{exercise_template_id}-{last_session_id}-{results}-{formula}.png")
+
+
+def render_chart(path: str, title: str, timestamps: np.ndarray, max_weight: np.ndarray, reps: np.ndarray,
+                 best_e1rm: np.ndarray, rolling_e1rm: np.ndarray):
+    """Write the chart of the sessions of an exercise in path. Run in a worker process."""
+    # Imported in the worker only, the bot process does not need matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    dates = [datamodel.from_timestamp(int(timestamp)) for timestamp in timestamps]
+
+    figure, weight_axes = plt.subplots(figsize=(10, 5), dpi=100)
+    weight_axes.plot(dates, max_weight, marker="o", markersize=3, label="Charge max (kg)")
+    weight_axes.plot(dates, best_e1rm, marker=".", linestyle="none", alpha=0.5, label="1RM estimé (kg)")
+    weight_axes.plot(dates, rolling_e1rm, label="1RM estimé, moyenne glissante (kg)")
+    weight_axes.set_ylabel("kg")
+    weight_axes.grid(alpha=0.3)
+
+    reps_axes = weight_axes.twinx()
+    reps_axes.bar(dates, reps, width=1, alpha=0.25, color="grey", label="Répétitions")
+    reps_axes.set_ylabel("Répétitions")
+
+    lines, labels = weight_axes.get_legend_handles_labels()
+    bars, bar_labels = reps_axes.get_legend_handles_labels()
+    weight_axes.legend(lines + bars, labels + bar_labels, loc="upper left", fontsize="small")
+    weight_axes.set_title(title)
+    figure.autofmt_xdate()
+    figure.tight_layout()
+
+    # Written next to its final path then renamed, a chart being written is never served
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    figure.savefig(tmp_path, format="png")
+    plt.close(figure)
+    os.replace(tmp_path, path)
+
+
+def _remove_older_charts(path: str, user_id: int, exercise_template_id: str, formula: str):
+    # The charts of the other formulas are kept, they are still current
+    prefix = f"{user_id}-{exercise_template_id}-"
+    suffix = f"-{formula}.png"
+    for name in os.listdir(CHART_DIRECTORY):
+        other_path = os.path.join(CHART_DIRECTORY, name)
+        if name.startswith(prefix) and name.endswith(suffix) and other_path != path:
+            try:
+                os.remove(other_path)
+            except FileNotFoundError:
+                pass
+
+
+async def get_chart(user_id: int, exercise_template_id: str, title: str, exercise_history: history.ExerciseHistory,
+                    last_session_id: str, formula: str = "epley") -> str:
+    """Path of the chart of an exercise of a user, rendered in the process pool if it is not cached yet."""
+    path = chart_path(user_id, exercise_template_id, last_session_id, len(exercise_history), formula)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(CHART_DIRECTORY, exist_ok=True)
+    sessions = analytics.exercise_stats(exercise_history, formula).sessions
+    # The arrays are pickled to the worker, np.frombuffer views of the history included
+    await asyncio.get_running_loop().run_in_executor(
+        get_pool(), render_chart, path, title, sessions.timestamps, sessions.max_weight, sessions.reps,
+        sessions.best_e1rm, sessions.rolling_e1rm
+    )
+    _remove_older_charts(path, user_id, exercise_template_id, formula)
+    return path
@@ -1,58 +1,45 @@
-from typing import NamedTuple
+from typing import Literal
 
 import discord
 from discord import app_commands
 
+import charts
 import command
+import storage
 
 
-class Point(NamedTuple):
-    x: int
-    y: int
-
-
-# The default transformer takes in a string option and you can transform
-# it into any value you'd like.
-#
-# Transformers also support various other settings such as overriding
-# properties like `choices`, `max_value`, `min_value`, `type`, or `channel_types`.
-# However, this is outside of the scope of this example so check the documentation
-# for more information.
-class PointTransformer(app_commands.Transformer):
-    async def transform(self, interaction: discord.Interaction, value: str) -> Point:
-        (x, _, y) = value.partition(',')
-        return Point(x=int(x.strip()), y=int(y.strip()))
-
-
-# For more basic transformers for your own types without too much repetition,
-# a concept known as "inline transformers" is supported. This allows you to use
-# a classmethod to have a string based transformer. It's only useful
-# if you only care about transforming a string to a class and nothing else.
-class Point3D(NamedTuple):
-    x: int
-    y: int
-    z: int
-
-    # This is the same as the above transformer except inline
-    @classmethod
-    async def transform(cls, interaction: discord.Interaction, value: str):
-        x, y, z = value.split(',')
-        return cls(x=int(x.strip()), y=int(y.strip()), z=int(z.strip()))
-
-
-async def execute(
-        interaction: discord.Interaction,
-        # In order to use the transformer, you should use Transform to tell the
-        # library to use it.
-        point: app_commands.Transform[Point, PointTransformer],
-        point3d: Point3D
-):
+@app_commands.describe(exercise="Nom de l'exercice", formula="Formule du 1RM estimé")
+async def execute(interaction: discord.Interaction, exercise: str, formula: Literal["epley", "brzycki"] = "epley"):
     response = interaction.response
     assert isinstance(response, discord.InteractionResponse)
-    await response.send_message(str(point) + " " + (str(point3d)))
+
+    bdd = storage.get_async_storage()
+    exercise_template = next(
+        (exercise_type for exercise_type in await bdd.get_exercises_template()
+         if exercise_type.name.lower() == exercise.lower()),
+        None
+    )
+    if exercise_template is None:
+        await response.send_message(f"❌ Exercice inconnu : {exercise}.")
+        return
+
+    exercise_history = await bdd.get_exercise_history(interaction.user.id, exercise_template.id)
+    if not exercise_history:
+        await response.send_message(f"Aucune donnée pour {exercise_template.name}.")
+        return
+
+    # Le rendu peut prendre plus que les 3 secondes laissées pour répondre
+    await response.defer()
+
+    last_session_id = await bdd.get_last_session_id(interaction.user.id, exercise_template.id)
+    path = await charts.get_chart(
+        interaction.user.id, exercise_template.id, f"{exercise_template.name} — {interaction.user.display_name}",
+        exercise_history, last_session_id, formula
+    )
+    await interaction.followup.send(file=discord.File(path, filename=f"{exercise_template.name}.png"))
 
 
 class CommandGraph(command.Command):
 
     def __init__(self):
-        super().__init__("graphe", "Oui", execute)
+        super().__init__("graphe", "Plot your progress on an exercise", execute)
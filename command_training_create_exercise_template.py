@@ -33,8 +33,8 @@ class AddExerciseModal(discord.ui.Modal):
         user = datamodel.User(member.id, member.mention)
         exercise = datamodel.ExerciseType(exercise_name)
 
-        bdd = storage.get_storage()
-        bdd.upcreate_exercise_template_and_add_to_user(user, exercise)
+        bdd = storage.get_async_storage()
+        await bdd.upcreate_exercise_template_and_add_to_user(user, exercise)
 
         await response.send_message(user.mention + " Exercice ajouté : **" + str(exercise) + "** !", ephemeral=False)
 
@@ -119,8 +119,8 @@ async def execute(interaction: discord.Interaction):
     assert isinstance(response, discord.InteractionResponse)
     channel = interaction.channel
 
-    bdd = storage.get_storage()
-    exercise_types = bdd.get_exercises_template()
+    bdd = storage.get_async_storage()
+    exercise_types = await bdd.get_exercises_template()
 
     if not exercise_types:
         await response.send_message("⚠️ Aucun excercice type trouvé.", ephemeral=True)
@@ -154,8 +154,8 @@ async def execute(interaction: discord.Interaction):
 
         user = datamodel.User(member.id, member.mention)
 
-        bdd = storage.get_storage()
-        bdd.upcreate_program_type_and_add_to_user(user, new_program)
+        bdd = storage.get_async_storage()
+        await bdd.upcreate_program_type_and_add_to_user(user, new_program)
     else:
         await channel.send("Création annulée ou expirée.")
 
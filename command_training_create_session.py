@@ -3,6 +3,8 @@ from discord import ui
 from datetime import datetime
 
 import command
+import history_render
+import records
 import storage
 import datamodel
 
@@ -31,7 +33,7 @@ class DateInputModal(ui.Modal):
             label="Date de la séance (JJ/MM/AAAA)", placeholder="Par ex. : 22/06/2025", required=True
         )
         self.add_item(self.date_input)
-        self.result_date: str | None = None
+        self.result_date: datetime | None = None
 
     async def on_submit(self, interaction: discord.Interaction):
         response = interaction.response
@@ -40,7 +42,7 @@ class DateInputModal(ui.Modal):
         try:
             # Validation simple du format
             date_obj = datetime.strptime(self.date_input.value, "%d/%m/%Y")
-            self.result_date = date_obj.isoformat()
+            self.result_date = date_obj
             await response.defer()  # Pas de message visible
         except ValueError:
             await response.send_message("❌ Format de date invalide. Utilisez JJ/MM/AAAA.")
@@ -48,7 +50,7 @@ class DateInputModal(ui.Modal):
         self.stop()
 
 class SessionInProgressView(ui.View):
-    def __init__(self, user: discord.User, program: datamodel.Program, session_date: str):
+    def __init__(self, user: discord.User, program: datamodel.Program, session_date: datetime):
         super().__init__(timeout=1800)
 
         self.user = user
@@ -70,57 +72,24 @@ class SessionInProgressView(ui.View):
         self.add_item(self.next_button)
         self.add_item(self.cancel_button)
 
-        self.previous_results_by_exercise_program_id: dict[str, list[datamodel.Exercise]] = {}
-        self.load_previous_results()
+        # On affiche les x dernières occurrences de chaque exercice
+        self.x = 10
+        self.previous_info_by_exercise_program_id: dict[str, str] = {}
+        self.session_records = records.SessionRecords({})
 
     def format_previous_info(self, exercise_program_id: str) -> str:
-        history = self.previous_results_by_exercise_program_id.get(exercise_program_id, [])
-        if not history:
-            return "*Aucune donnée précédente.*"
-
-        # On limite à x dernières occurrences (les plus récentes à la fin)
-        x = 10
-        history = history[-x:]  # derniers, déjà dans l’ordre croissant
-
-        res = ""
-        for i, e in enumerate(history):
-            if i == 0:
-                res +=  f"• {e.weight} kg x {e.reps}"
-            else:
-                res += "\n"
-                if history[i - 1].weight < e.weight:
-                    progress_weight = ":arrow_upper_right:"
-                elif history[i - 1].weight > e.weight:
-                    progress_weight = ":arrow_lower_right:"
-                else:
-                    progress_weight = ":arrow_right:"
-
-                if history[i - 1].reps < e.reps:
-                    progress_reps = ":arrow_upper_right:"
-                elif history[i - 1].reps > e.reps:
-                    progress_reps = ":arrow_lower_right:"
-                else:
-                    progress_reps = ":arrow_right:"
-
-                res += f"• {e.weight} kg {progress_weight} x {e.reps} {progress_reps}"
-
-        return res
-
-    def load_previous_results(self):
-        bdd = storage.get_storage()
-        user = bdd.get_user_from_user_id(self.user.id)
-
-        sessions = user.sessions
-
-        # On trie les sessions par date (de la plus ancienne à la plus récente)
-        sessions.sort(key=lambda s: datetime.fromisoformat(s.date) if isinstance(s.date, str) else s.date)
-
-
-        for session in sessions:
-            if session.template.id == self.program.id:
-                for ex in session.results:
-                    key = ex.exerciseProgram.id
-                    self.previous_results_by_exercise_program_id.setdefault(key, []).append(ex)
+        return self.previous_info_by_exercise_program_id.get(exercise_program_id, history_render.NO_HISTORY)
+
+    async def load_previous_results(self):
+        # Les x derniers résultats de chaque exercice du programme, déjà mis en forme (et mis en cache)
+        self.previous_info_by_exercise_program_id = await history_render.render_previous_results(
+            self.user.id, [ep.id for ep in self.program.exercisePrograms], self.x
+        )
+        # Les records actuels, pour annoncer ceux battus pendant la séance
+        bdd = storage.get_async_storage()
+        self.session_records = records.SessionRecords(await bdd.get_personal_records(
+            self.user.id, list({ep.exerciseTemplate.id for ep in self.program.exercisePrograms})
+        ))
 
     def get_button_label(self):
         if self.index >= len(self.program.exercisePrograms):
@@ -164,6 +133,12 @@ class SessionInProgressView(ui.View):
                 f"✅ Enregistré : {weight}kg x {reps} pour {modal.exercise_program.exerciseTemplate.name}"
             )
 
+            beaten = self.session_records.add_exercise(result)
+            if beaten:
+                await interaction.channel.send(
+                    history_render.format_records_beaten(modal.exercise_program.exerciseTemplate.name, beaten)
+                )
+
             await self.advance(interaction)
 
         except ValueError:
@@ -173,11 +148,12 @@ class SessionInProgressView(ui.View):
         self.index += 1
         if self.index >= len(self.program.exercisePrograms):
             # Sauvegarde de la séance
-            bdd = storage.get_storage()
+            bdd = storage.get_async_storage()
             user = datamodel.User(self.user.id, self.user.mention)
-            bdd.upcreate_session_and_add_to_user(user, self.session)
+            await bdd.upcreate_session_and_add_to_user(user, self.session)
 
             await interaction.followup.send("📅 Séance enregistrée avec succès !")
+            await self.announce_volume_records(interaction)
             self.clear_items()
             self.stop()
         else:
@@ -193,6 +169,11 @@ class SessionInProgressView(ui.View):
                 view=self
             )
 
+    async def announce_volume_records(self, interaction: discord.Interaction):
+        names = {ep.exerciseTemplate.id: ep.exerciseTemplate.name for ep in self.program.exercisePrograms}
+        for exercise_template_id, beaten in self.session_records.end_session(self.session).items():
+            await interaction.followup.send(history_render.format_records_beaten(names[exercise_template_id], beaten))
+
     async def cancel_session(self, interaction: discord.Interaction):
         response = interaction.response
         assert isinstance(response, discord.InteractionResponse)
@@ -216,8 +197,8 @@ async def execute(interaction: discord.Interaction):
     response = interaction.response
     assert isinstance(response, discord.InteractionResponse)
 
-    bdd = storage.get_storage()
-    programs = bdd.get_programs()
+    bdd = storage.get_async_storage()
+    programs = await bdd.get_programs()
 
     if not programs:
         await response.send_message("Aucun programme trouvé.")
@@ -242,11 +223,12 @@ async def execute(interaction: discord.Interaction):
 
         # Créer la vue de séance avec la date fournie
         session_view = SessionInProgressView(inter.user, selected_program, date_modal.result_date)
+        await session_view.load_previous_results()
 
         ep = session_view.program.exercisePrograms[0]
         history_text = session_view.format_previous_info(ep.id)
         await inter.followup.send(
-            f"📋 Programme **{selected_program.name}** sélectionné pour le {date_modal.result_date[:10]} !\n\n"
+            f"📋 Programme **{selected_program.name}** sélectionné pour le {date_modal.result_date.date().isoformat()} !\n\n"
             f"➡️ **Premier exercice** : `{ep.exerciseTemplate.name}`\n"
             f"📈 **Historique :**\n{history_text}",
             view=session_view
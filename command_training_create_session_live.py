@@ -4,6 +4,8 @@ from datetime import datetime
 import asyncio
 
 import command
+import history_render
+import records
 import storage
 import datamodel
 
@@ -29,7 +31,7 @@ class RealTimeSessionView(ui.View):
         super().__init__(timeout=1800)
         self.user = user
         self.program = program
-        self.session = datamodel.Session(template=program, date=datetime.now().isoformat())
+        self.session = datamodel.Session(template=program, date=datetime.now())
         self.index = 0
         self.message: discord.Message | None = None
         self.rest_task: asyncio.Task | None = None
@@ -57,43 +59,27 @@ class RealTimeSessionView(ui.View):
         self.add_item(self.skip_button)
         # self.add_item(self.cancel_button)
 
-        self.previous_results_by_exercise_program_id: dict[str, list[datamodel.Exercise]] = {}
-        self.load_previous_results()
+        self.previous_info_by_exercise_program_id: dict[str, str] = {}
+        self.session_records = records.SessionRecords({})
+        # Le texte de l'exercice suivant, calculé une fois par exercice : le minuteur ne refait que le décompte
+        self.next_exercise_text: tuple[int, str] | None = None
 
     def get_button_label(self):
         if self.index >= len(self.program.exercisePrograms):
             return "Terminer la séance"
         return f"Exercice terminé"
 
-    def load_previous_results(self):
-        bdd = storage.get_storage()
-        user = bdd.get_user_from_user_id(self.user.id)
-        sessions = user.sessions
-        sessions.sort(key=lambda s: datetime.fromisoformat(s.date) if isinstance(s.date, str) else s.date)
-
-        for session in sessions:
-            if session.template.id == self.program.id:
-                for ex in session.results:
-                    key = ex.exerciseProgram.id
-                    self.previous_results_by_exercise_program_id.setdefault(key, []).append(ex)
+    async def load_previous_results(self):
+        self.previous_info_by_exercise_program_id = await history_render.render_previous_results(
+            self.user.id, [ep.id for ep in self.program.exercisePrograms], self.x
+        )
+        bdd = storage.get_async_storage()
+        self.session_records = records.SessionRecords(await bdd.get_personal_records(
+            self.user.id, list({ep.exerciseTemplate.id for ep in self.program.exercisePrograms})
+        ))
 
     def format_previous_info(self, exercise_program_id: str) -> str:
-        history = self.previous_results_by_exercise_program_id.get(exercise_program_id, [])
-        if not history:
-            return "*Aucune donnée précédente.*"
-
-        history = history[-self.x:]
-        res = ""
-        for i, e in enumerate(history):
-            if i == 0:
-                res += f"\u2022 {e.weight} kg x {e.reps}"
-            else:
-                res += "\n"
-                prev = history[i - 1]
-                progress_weight = ":arrow_upper_right:" if prev.weight < e.weight else ":arrow_lower_right:" if prev.weight > e.weight else ":arrow_right:"
-                progress_reps = ":arrow_upper_right:" if prev.reps < e.reps else ":arrow_lower_right:" if prev.reps > e.reps else ":arrow_right:"
-                res += f"\u2022 {e.weight} kg {progress_weight} x {e.reps} {progress_reps}"
-        return res
+        return self.previous_info_by_exercise_program_id.get(exercise_program_id, history_render.NO_HISTORY)
 
     async def send_modal(self, interaction: discord.Interaction):
         response = interaction.response
@@ -122,6 +108,13 @@ class RealTimeSessionView(ui.View):
                 return
 
             await interaction.followup.send(f"✅ Enregistré : {weight}kg x {reps} pour {modal.exercise_program.exerciseTemplate.name}")
+
+            # Annoncé tout de suite, avant le minuteur de repos
+            beaten = self.session_records.add_exercise(result)
+            if beaten:
+                await interaction.followup.send(
+                    history_render.format_records_beaten(modal.exercise_program.exerciseTemplate.name, beaten)
+                )
             await self.start_rest_timer(interaction)
 
         except ValueError:
@@ -155,10 +148,16 @@ class RealTimeSessionView(ui.View):
         await self.message.edit(content=self.get_content_for_next_exercise(), view=self)
 
         if self.index >= len(self.program.exercisePrograms):
-            bdd = storage.get_storage()
+            bdd = storage.get_async_storage()
             user = datamodel.User(self.user.id, self.user.mention)
-            bdd.upcreate_session_and_add_to_user(user, self.session)
+            await bdd.upcreate_session_and_add_to_user(user, self.session)
             await interaction.followup.send("📅 Séance enregistrée avec succès !")
+
+            names = {ep.exerciseTemplate.id: ep.exerciseTemplate.name for ep in self.program.exercisePrograms}
+            for exercise_template_id, beaten in self.session_records.end_session(self.session).items():
+                await interaction.followup.send(
+                    history_render.format_records_beaten(names[exercise_template_id], beaten)
+                )
             self.clear_items()
             self.stop()
 
@@ -176,6 +175,13 @@ class RealTimeSessionView(ui.View):
         if self.index >= len(self.program.exercisePrograms):
             return "🎉 Séance terminée."
 
+        if self.next_exercise_text is None or self.next_exercise_text[0] != self.index:
+            self.next_exercise_text = (self.index, self.format_next_exercise())
+
+        remaining = max(self.rest_remaining, 0)
+        return self.next_exercise_text[1] + f"⏳ Temps restant : {remaining}s"
+
+    def format_next_exercise(self) -> str:
         ep_next = self.program.exercisePrograms[self.index]
         history_text = self.format_previous_info(ep_next.id)
 
@@ -187,13 +193,11 @@ class RealTimeSessionView(ui.View):
             rest_time = ep_previous.restTimeSeconds
 
         minutes, seconds = divmod(rest_time, 60)
-        remaining = max(self.rest_remaining, 0)
 
         return (
             f"➡️ **Exercice suivant** : `{ep_next.exerciseTemplate.name}`\n"
             f"📈 **Historique (" + str(self.x) + f" dernières) :**\n{history_text}\n\n"
             f"🕒 Temps de repos avant de commencer : {minutes}m {seconds}s\n"
-            f"⏳ Temps restant : {remaining}s"
         )
 
     async def cancel_session(self, interaction: discord.Interaction):
@@ -212,8 +216,8 @@ async def execute(interaction: discord.Interaction):
     response = interaction.response
     assert isinstance(response, discord.InteractionResponse)
 
-    bdd = storage.get_storage()
-    programs = bdd.get_programs()
+    bdd = storage.get_async_storage()
+    programs = await bdd.get_programs()
 
     if not programs:
         await response.send_message("Aucun programme trouvé.")
@@ -229,6 +233,7 @@ async def execute(interaction: discord.Interaction):
         selected_program = next(p for p in programs if p.name == select.values[0])
         view_callback = RealTimeSessionView(inter.user, selected_program)
         await response_callback.defer()
+        await view_callback.load_previous_results()
         await view_callback.send_next_exercise_message(inter)
 
     select.callback = select_callback
@@ -0,0 +1,62 @@
+import asyncio
+import tempfile
+from datetime import datetime
+
+import discord
+from discord import app_commands
+
+import backup
+import command
+import datamodel
+import storage
+
+
+def parse_date(value: str | None) -> int | None:
+    if not value:
+        return None
+    return datamodel.to_timestamp(datetime.strptime(value, "%d/%m/%Y"))
+
+
+def write_export(user: datamodel.User, since: int | None, until: int | None):
+    # Kept in memory while small, on disk beyond
+    export_file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    for line in backup.iter_user_records(user, since, until):
+        export_file.write(line.encode())
+    export_file.seek(0)
+    return export_file
+
+
+@app_commands.describe(since="Première date exportée (JJ/MM/AAAA)", until="Date de fin, exclue (JJ/MM/AAAA)")
+async def execute(interaction: discord.Interaction, since: str = None, until: str = None):
+    response = interaction.response
+    assert isinstance(response, discord.InteractionResponse)
+
+    try:
+        since_timestamp = parse_date(since)
+        until_timestamp = parse_date(until)
+    except ValueError:
+        await response.send_message("❌ Format de date invalide. Utilisez JJ/MM/AAAA.", ephemeral=True)
+        return
+
+    await response.defer(ephemeral=True)
+
+    user = await storage.get_async_storage().get_user_from_user_id(interaction.user.id)
+    if user is None:
+        await interaction.followup.send("Aucune donnée à exporter.", ephemeral=True)
+        return
+
+    export_file = await asyncio.to_thread(write_export, user, since_timestamp, until_timestamp)
+    try:
+        await interaction.followup.send(
+            "📦 Voici vos données d'entraînement.",
+            file=discord.File(export_file, filename=f"trainingbook-{user.userId}.ndjson"),
+            ephemeral=True
+        )
+    finally:
+        export_file.close()
+
+
+class CommandTrainingExport(command.Command):
+
+    def __init__(self):
+        super().__init__("export", "Export your training data", execute)
@@ -0,0 +1,87 @@
+from typing import Literal
+
+import discord
+from discord import app_commands
+
+import command
+import leaderboard
+import storage
+
+METRICS = {
+    "1rm": leaderboard.BEST_E1RM,
+    "volume": leaderboard.VOLUME,
+    "séances": leaderboard.SESSIONS,
+}
+PERIODS = {
+    "semaine": leaderboard.WEEK,
+    "mois": leaderboard.MONTH,
+    "total": leaderboard.ALL_TIME,
+}
+METRIC_LABELS = {
+    leaderboard.BEST_E1RM: "1RM estimé",
+    leaderboard.VOLUME: "volume total",
+    leaderboard.SESSIONS: "nombre de séances",
+}
+PERIOD_LABELS = {
+    leaderboard.WEEK: "cette semaine",
+    leaderboard.MONTH: "ce mois-ci",
+    leaderboard.ALL_TIME: "depuis toujours",
+}
+MEDALS = ["🥇", "🥈", "🥉"]
+
+RANKING_SIZE = 10
+
+
+def format_score(metric: str, score: float) -> str:
+    if metric == leaderboard.BEST_E1RM:
+        return f"{score:.1f} kg"
+    if metric == leaderboard.VOLUME:
+        return f"{score:.0f} kg"
+    return f"{score:.0f} séance" + ("s" if score > 1 else "")
+
+
+@app_commands.describe(exercise="Nom de l'exercice", period="Période du classement", metric="Critère du classement")
+async def execute(interaction: discord.Interaction, exercise: str,
+                  period: Literal["semaine", "mois", "total"] = "semaine",
+                  metric: Literal["1rm", "volume", "séances"] = "1rm"):
+    response = interaction.response
+    assert isinstance(response, discord.InteractionResponse)
+
+    guild = interaction.guild
+    if guild is None:
+        await response.send_message("❌ Le classement n'est disponible que sur un serveur.", ephemeral=True)
+        return
+
+    bdd = storage.get_async_storage()
+    exercise_template = next(
+        (exercise_type for exercise_type in await bdd.get_exercises_template()
+         if exercise_type.name.lower() == exercise.lower()),
+        None
+    )
+    if exercise_template is None:
+        await response.send_message(f"❌ Exercice inconnu : {exercise}.")
+        return
+
+    metric = METRICS[metric]
+    period = PERIODS[period]
+    ranking = await bdd.get_leaderboard(exercise_template.id, metric, period,
+                                        {member.id for member in guild.members}, RANKING_SIZE)
+
+    title = f"🏆 **{exercise_template.name}** — {METRIC_LABELS[metric]}, {PERIOD_LABELS[period]}"
+    if not ranking:
+        await response.send_message(f"{title}\n*Aucune séance enregistrée.*")
+        return
+
+    lines = [title]
+    for rank, (user_id, score) in enumerate(ranking):
+        member = guild.get_member(user_id)
+        name = member.display_name if member is not None else f"<@{user_id}>"
+        position = MEDALS[rank] if rank < len(MEDALS) else f"{rank + 1}."
+        lines.append(f"{position} {name} : {format_score(metric, score)}")
+    await response.send_message("\n".join(lines))
+
+
+class CommandTrainingLeaderboard(command.Command):
+
+    def __init__(self):
+        super().__init__("leaderboard", "Rank the server members on an exercise", execute)
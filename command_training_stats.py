@@ -0,0 +1,71 @@
+import asyncio
+from typing import Literal
+
+import discord
+from discord import app_commands
+
+import analytics
+import command
+import datamodel
+import storage
+
+# Longueur maximale d'un message Discord
+MAX_MESSAGE_LENGTH = 2000
+
+
+def format_date(timestamp: int) -> str:
+    return datamodel.from_timestamp(int(timestamp)).strftime("%d/%m/%Y")
+
+
+def format_exercise_stats(name: str, stats: analytics.ExerciseStats, window: int) -> str:
+    sessions = stats.sessions
+    lines = [
+        f"**{name}** — {len(sessions.timestamps)} séances, charge max {stats.best_weight:g} kg",
+        f"• 1RM estimé : record {stats.best_e1rm:.1f} kg le {format_date(stats.best_e1rm_timestamp)}, "
+        f"dernière séance {sessions.best_e1rm[-1]:.1f} kg, moyenne sur {window} séances {sessions.rolling_e1rm[-1]:.1f} kg",
+        f"• Volume de la dernière séance : {sessions.volume[-1]:.0f} kg, "
+        f"tonnage de la semaine du {format_date(stats.weeks[-1])} : {stats.weekly_tonnage[-1]:.0f} kg",
+    ]
+    if len(stats.record_timestamps):
+        lines.append(f"• Records battus : {len(stats.record_timestamps)}, "
+                     f"le dernier le {format_date(stats.record_timestamps[-1])}")
+    return "\n".join(lines)
+
+
+@app_commands.describe(exercise="Nom d'un exercice (tous par défaut)", formula="Formule du 1RM estimé",
+                       window="Nombre de séances de la moyenne glissante")
+async def execute(interaction: discord.Interaction, exercise: str = None,
+                  formula: Literal["epley", "brzycki"] = "epley", window: app_commands.Range[int, 1, 50] = 5):
+    response = interaction.response
+    assert isinstance(response, discord.InteractionResponse)
+
+    bdd = storage.get_async_storage()
+    histories = await bdd.get_exercise_histories(interaction.user.id)
+    names = {exercise_type.id: exercise_type.name for exercise_type in await bdd.get_exercises_template()}
+
+    if exercise is not None:
+        histories = {
+            exercise_template_id: exercise_history for exercise_template_id, exercise_history in histories.items()
+            if names.get(exercise_template_id, "").lower() == exercise.lower()
+        }
+    if not histories:
+        await response.send_message("Aucune séance enregistrée" + (f" pour {exercise}." if exercise else "."))
+        return
+
+    # Les calculs ne bloquent pas la boucle d'évènements
+    stats = await asyncio.to_thread(analytics.user_stats, histories, formula, window)
+
+    blocks = [
+        format_exercise_stats(names.get(exercise_template_id, "?"), exercise_stats, window)
+        for exercise_template_id, exercise_stats in sorted(stats.items(), key=lambda item: names.get(item[0], ""))
+    ]
+    message = f"📊 **Statistiques de {interaction.user.mention}** ({formula})\n\n" + "\n\n".join(blocks)
+    if len(message) > MAX_MESSAGE_LENGTH:
+        message = message[:MAX_MESSAGE_LENGTH - 1] + "…"
+    await response.send_message(message)
+
+
+class CommandTrainingStats(command.Command):
+
+    def __init__(self):
+        super().__init__("stats", "Show your training statistics", execute)
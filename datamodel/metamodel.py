@@ -8,116 +8,277 @@ def generate_id():
     return str(bson.ObjectId())
 
 
-class JsonSerializable:
+# Every JsonSerializable class by (module, class name), registered when the class is defined
+_classes: dict[tuple[str, str], type] = {}
 
-    def __init__(self, _id: str=None):
+_HEADER_KEYS = ("_class", "_module")
 
-        self.id: str = _id if _id is not None else generate_id()
 
-    def populate(self, hashmap: dict):
-
-        for key, value in self.__dict__.items():
-            if isinstance(value, JsonSerializable):
-                if value.id in hashmap:
-                    value = hashmap[value.id]
-                else:
-                    value.populate(hashmap)
-
-            if isinstance(value, str):
-                if value in hashmap:
-                    value = hashmap[value]
-
-            if isinstance(value, list):
-                new_list = []
-                for v in value:
-                    if isinstance(v, JsonSerializable):
-                        if v.id not in hashmap:
-                            v.populate(hashmap)
-                            new_list.append(v)
-                        else:
-                            new_list.append(hashmap[v.id])
-
-                    if isinstance(v, str):
-                        if v in hashmap:
-                            new_list.append(hashmap[v])
-                self.__setattr__(key, new_list)
-
-
-
-    def dumps(self) -> str:
-        return json.dumps(self.dump())
-
-    def dump(self) -> dict:
-        data: dict[str, str | dict | list] = {
-            "_class": self.__class__.__name__,
-            "_module": self.__class__.__module__
-        }
-
-        for key, value in self.__dict__.items():
-            if isinstance(value, JsonSerializable):
-                data[key] = value.dump()
-            elif isinstance(value, list):
-                data[key] = [
-                    v.dump() if isinstance(v, JsonSerializable) else v
-                    for v in value
-                ]
-            else:
-                data[key] = value
-        return data
+def _dump_value(value):
+    if isinstance(value, JsonSerializable):
+        return value._dumper(value)
+    if isinstance(value, list):
+        return [_dump_value(v) for v in value]
+    return value
+
+
+def _dump_value_by_reference(value):
+    if isinstance(value, JsonSerializable):
+        return value._reference_dumper(value)
+    if isinstance(value, list):
+        return [_dump_value_by_reference(v) for v in value]
+    return value
+
+
+def _dump_reference(value):
+    if isinstance(value, JsonSerializable):
+        return value.id
+    if isinstance(value, list):
+        return [_dump_reference(v) for v in value]
+    return value
 
-    @classmethod
-    def loads(cls, json_str: str) -> 'JsonSerializable':
-        raw = json.loads(json_str)
-        class_name = raw.pop("_class")
-        module_name = raw.pop("_module")
-        if not class_name or not module_name:
-            raise ValueError("Missing _class or _module in JSON")
 
+def _load_value(value):
+    if isinstance(value, dict) and "_class" in value:
+        return _load_object(value)
+    if isinstance(value, list):
+        return [_load_value(v) for v in value]
+    return value
+
+
+def _resolve_class(raw: dict) -> type:
+    class_name = raw.get("_class")
+    module_name = raw.get("_module")
+    if not class_name or not module_name:
+        raise ValueError("Missing _class or _module in JSON")
+
+    target_cls = _classes.get((module_name, class_name))
+    if target_cls is None:
+        # The module of the class is not imported yet, importing it registers the class
         module = importlib.import_module(module_name)
         target_cls = getattr(module, class_name)
+    return target_cls
+
+
+def _load_object(raw: dict) -> 'JsonSerializable':
+    return _resolve_class(raw)._loader(raw)
+
+
+def _load_linked(raw: dict, objects_by_id, into: 'JsonSerializable' = None) -> 'JsonSerializable':
+    # Objects created but not filled yet, the graph is walked with this stack instead of recursive calls
+    pending = []
+
+    def link(value, by_id: bool):
+        if isinstance(value, dict) and "_class" in value:
+            object_id = value.get("id")
+            if object_id is not None and object_id in objects_by_id:
+                # Already materialized (or materialized now by the storage), the embedded copy is dropped
+                return objects_by_id[object_id]
+            target_cls = _resolve_class(value)
+            linked = target_cls.__new__(target_cls)
+            if object_id is not None:
+                objects_by_id[object_id] = linked
+            pending.append((linked, value))
+            return linked
+        if isinstance(value, list):
+            return [link(v, by_id) for v in value]
+        if by_id and isinstance(value, str) and value in objects_by_id:
+            return objects_by_id[value]
+        return value
+
+    if into is None:
+        target_cls = _resolve_class(raw)
+        into = target_cls.__new__(target_cls)
+    if raw.get("id") is not None:
+        objects_by_id[raw["id"]] = into
+    pending.append((into, raw))
 
-        instance = target_cls.__new__(target_cls)
-
-        for key, value in raw.items():
-            if isinstance(value, dict) and "_class" in value:
-                setattr(instance, key, JsonSerializable.loads(json.dumps(value)))
-            elif isinstance(value, list):
-                deserialized = [
-                    JsonSerializable.loads(json.dumps(v)) if isinstance(v, dict) and "_class" in v else v
-                    for v in value
-                ]
-                setattr(instance, key, deserialized)
-            else:
+    while pending:
+        instance, instance_raw = pending.pop()
+        references = instance._references
+        instance._filler(instance, {
+            key: value if key == "id" else link(value, key in references)
+            for key, value in instance_raw.items()
+            if key not in _HEADER_KEYS
+        })
+    return into
+
+
+def _slot_fields(cls: type) -> tuple[str, ...]:
+    # Base classes first, so "id" is the first field of every class
+    fields = []
+    for klass in reversed(cls.__mro__):
+        slots = vars(klass).get("__slots__", ())
+        fields.extend((slots,) if isinstance(slots, str) else slots)
+    return tuple(fields)
+
+
+def _has_dict(cls: type) -> bool:
+    return any("__slots__" not in vars(klass) for klass in cls.__mro__ if klass is not object)
+
+
+def _compile_items(cls: type):
+    transient = frozenset(cls._transient)
+    slots = tuple(key for key in _slot_fields(cls) if key not in transient)
+    unset = object()
+
+    def slot_items(instance: 'JsonSerializable') -> list[tuple]:
+        items = []
+        for key in slots:
+            value = getattr(instance, key, unset)
+            if value is not unset:
+                items.append((key, value))
+        return items
+
+    if not _has_dict(cls):
+        return slot_items
+
+    if not transient:
+        def items(instance: 'JsonSerializable') -> list[tuple]:
+            fields = slot_items(instance)
+            fields.extend(instance.__dict__.items())
+            return fields
+
+        return items
+
+    def items_without_transient(instance: 'JsonSerializable') -> list[tuple]:
+        fields = slot_items(instance)
+        fields.extend(item for item in instance.__dict__.items() if item[0] not in transient)
+        return fields
+
+    return items_without_transient
+
+
+def _compile_filler(cls: type):
+    on_load = cls.on_load if cls.on_load is not JsonSerializable.on_load else None
+
+    if _has_dict(cls):
+        def set_fields(instance: 'JsonSerializable', fields: dict):
+            for key, value in fields.items():
                 setattr(instance, key, value)
+    else:
+        slots = frozenset(_slot_fields(cls)) - frozenset(cls._transient)
+
+        def set_fields(instance: 'JsonSerializable', fields: dict):
+            # A slotted class ignores the fields it does not have anymore
+            for key, value in fields.items():
+                if key in slots:
+                    setattr(instance, key, value)
+
+    if on_load is None:
+        return set_fields
+
+    def filler(instance: 'JsonSerializable', fields: dict):
+        set_fields(instance, fields)
+        on_load(instance)
 
+    return filler
+
+
+def _compile_dumper(cls: type, by_reference: bool = False):
+    header = {"_class": cls.__name__, "_module": cls.__module__}
+
+    items = cls._items
+
+    if not by_reference:
+        def dumper(instance: 'JsonSerializable') -> dict:
+            data = header.copy()
+            for key, value in items(instance):
+                data[key] = _dump_value(value)
+            return data
+
+        return dumper
+
+    references = frozenset(cls._references)
+
+    def dumper(instance: 'JsonSerializable') -> dict:
+        data = header.copy()
+        for key, value in items(instance):
+            data[key] = _dump_reference(value) if key in references else _dump_value_by_reference(value)
+        return data
+
+    return dumper
+
+
+def _compile_loader(cls: type):
+    new = cls.__new__
+    filler = cls._filler
+
+    def loader(raw: dict) -> 'JsonSerializable':
+        instance = new(cls)
+        filler(instance, {
+            key: _load_value(value)
+            for key, value in raw.items()
+            if key not in _HEADER_KEYS
+        })
         return instance
 
+    return loader
+
+
+class JsonSerializable:
+    # The entities with many instances declare their fields in __slots__ too, the others keep a __dict__. The fields
+    # are dumped in the order of the slots (base classes first) then of the __dict__.
+    __slots__ = ("id",)
+
+    # Fields linking to entities stored on their own, written as their id (or list of ids) by dump(by_reference=True)
+    _references: tuple[str, ...] = ()
+
+    # Fields derived from the others (indexes), neither dumped nor loaded
+    _transient: tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # The (de)serializers are built once per class instead of being resolved again for each object
+        _classes[(cls.__module__, cls.__name__)] = cls
+        cls._items = staticmethod(_compile_items(cls))
+        cls._filler = staticmethod(_compile_filler(cls))
+        cls._dumper = staticmethod(_compile_dumper(cls))
+        cls._reference_dumper = staticmethod(_compile_dumper(cls, by_reference=True))
+        cls._loader = staticmethod(_compile_loader(cls))
+
+    def __init__(self, _id: str=None):
+
+        self.id: str = _id if _id is not None else generate_id()
+
+    def on_load(self):
+        """Called on each object once its fields are loaded, to convert the values of an older format."""
+        pass
+
+    def fields(self) -> dict:
+        return dict(self._items(self))
+
+    def dumps(self, by_reference: bool = False) -> str:
+        return json.dumps(self.dump(by_reference))
+
+    def dump(self, by_reference: bool = False) -> dict:
+        """
+        Dump the object and its nested objects. With by_reference, the fields listed in _references only hold the id
+        of the entities they link to, these are resolved again by load_linked.
+        """
+        if by_reference:
+            return self._reference_dumper(self)
+        return self._dumper(self)
+
     @classmethod
-    def load(cls, dict_input: dict) -> 'JsonSerializable':
-        raw = dict_input.copy()
-        class_name = raw.pop("_class")
-        module_name = raw.pop("_module")
-        if not class_name or not module_name:
-            raise ValueError("Missing _class or _module in JSON")
+    def loads(cls, json_str: str) -> 'JsonSerializable':
+        return _load_object(json.loads(json_str))
 
-        module = importlib.import_module(module_name)
-        target_cls = getattr(module, class_name)
+    @classmethod
+    def load(cls, dict_input: dict) -> 'JsonSerializable':
+        return _load_object(dict_input)
 
-        instance = target_cls.__new__(target_cls)
-
-        for key, value in raw.items():
-            if isinstance(value, dict) and "_class" in value:
-                setattr(instance, key, JsonSerializable.loads(json.dumps(value)))
-            elif isinstance(value, list):
-                deserialized = [
-                    JsonSerializable.loads(json.dumps(v)) if isinstance(v, dict) and "_class" in v else v
-                    for v in value
-                ]
-                setattr(instance, key, deserialized)
-            else:
-                setattr(instance, key, value)
+    @classmethod
+    def load_linked(cls, dict_input: dict, objects_by_id, into: 'JsonSerializable' = None) -> 'JsonSerializable':
+        """
+        Load an object and link it to the objects already loaded, in one pass over its graph.
 
-        return instance
+        objects_by_id is the identity map: a nested object, or an id in a field of _references, whose id is in it is
+        replaced by the mapped object, so each id is materialized once. Every object created is added to it. `into`
+        is filled in place instead of creating a new root object, the objects already referencing it stay valid.
+        """
+        return _load_linked(dict_input, objects_by_id, into)
 
     def __repr__(self):
-        return self.__class__.__name__ + str(self.__dict__)
+        return self.__class__.__name__ + str(self.fields())
@@ -1,9 +1,62 @@
-from datetime import datetime
+from datetime import datetime, timezone
 
 from .metamodel import *
 
 
+def to_timestamp(date: int | datetime | str | None) -> int | None:
+    """Seconds since the epoch of a date time or an ISO string, a naive date time is taken as UTC."""
+    if date is None or isinstance(date, int):
+        return date
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
+
+
+def from_timestamp(timestamp: int) -> datetime:
+    """The naive date time of a timestamp given by to_timestamp."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+class _IdIndex:
+    """
+    The objects of a list by id. It is rebuilt when the list is replaced or changes length without it (a load, an
+    append made directly on the list), so it never has to be dumped.
+    """
+
+    __slots__ = ("items", "length", "by_id")
+
+    def __init__(self):
+        self.items: list | None = None
+        self.length = 0
+        self.by_id: dict[str, object] = {}
+
+    def get(self, items: list, key) -> dict[str, object]:
+        if items is not self.items or len(items) != self.length:
+            self.items = items
+            self.length = len(items)
+            self.by_id = {key(item): item for item in items}
+        return self.by_id
+
+    def appended(self, items: list, key):
+        # Kept up to date in O(1) when it was in sync before the append
+        if items is self.items and len(items) == self.length + 1:
+            self.by_id.setdefault(key(items[-1]), items[-1])
+            self.length += 1
+
+
+def _id(model_object: JsonSerializable) -> str:
+    return model_object.id
+
+
+def _exercise_program_id(exercise: 'Exercise') -> str:
+    return exercise.exerciseProgram.id
+
+
 class ExerciseType(JsonSerializable):
+    __slots__ = ("name",)
+
     def __init__(self, name: str = None):
         super().__init__()
         self.name = name
@@ -15,6 +68,8 @@ class ExerciseType(JsonSerializable):
 
 
 class ExerciseProgram(JsonSerializable):
+    __slots__ = ("exerciseTemplate", "restTimeSeconds")
+    _references = ("exerciseTemplate",)
 
     def __init__(self, exercise_template: ExerciseType, rest_time_seconds: int):
         super().__init__()
@@ -23,6 +78,9 @@ class ExerciseProgram(JsonSerializable):
 
 
 class Exercise(JsonSerializable):
+    __slots__ = ("exerciseProgram", "weight", "reps")
+    _references = ("exerciseProgram",)
+
     def __init__(self, exercise_program: ExerciseProgram = None, weight: float = None, reps: int = None):
         super().__init__()
         self.exerciseProgram = exercise_program
@@ -31,6 +89,8 @@ class Exercise(JsonSerializable):
 
 
 class Program(JsonSerializable):
+    _transient = ("_exercise_programs_index",)
+
     def __init__(self, name: str = None):
         super().__init__()
         self.name = name
@@ -38,6 +98,20 @@ class Program(JsonSerializable):
 
     def add_exercise_program(self, exercise_program: ExerciseProgram):
         self.exercisePrograms.append(exercise_program)
+        self._index().appended(self.exercisePrograms, _id)
+
+    def _index(self) -> _IdIndex:
+        index = self.__dict__.get("_exercise_programs_index")
+        if index is None:
+            index = self._exercise_programs_index = _IdIndex()
+        return index
+
+    def get_exercise_programs_by_id(self) -> dict[str, ExerciseProgram]:
+        return self._index().get(self.exercisePrograms, _id)
+
+    def has_exercise_program(self, exercise_program: ExerciseProgram) -> bool:
+        # By id: a copy of the program given by the storage still matches
+        return exercise_program.id in self.get_exercise_programs_by_id()
 
     def __lt__(self, other):
         if not isinstance(other, ExerciseType):
@@ -46,40 +120,58 @@ class Program(JsonSerializable):
 
 
 class Session(JsonSerializable):
-    def __init__(self, template: Program = None, date: str = None):
+    __slots__ = ("template", "date", "results", "_results_index")
+    _references = ("template",)
+    _transient = ("_results_index",)
+
+    def __init__(self, template: Program = None, date: int | datetime | str = None):
         super().__init__()
         self.template = template
-        self.date = date
+        self.date: int | None = to_timestamp(date)
         self.results: list[Exercise] = []
 
+    def on_load(self):
+        # Sessions saved with an ISO date
+        if isinstance(self.date, str):
+            self.date = to_timestamp(self.date)
+
+    def get_datetime(self) -> datetime:
+        return from_timestamp(self.date)
+
+    def _index(self) -> _IdIndex:
+        try:
+            return self._results_index
+        except AttributeError:
+            self._results_index = _IdIndex()
+            return self._results_index
+
+    def get_results_by_exercise_program_id(self) -> dict[str, Exercise]:
+        return self._index().get(self.results, _exercise_program_id)
+
     def add_exercise_result(self, exercise: Exercise) -> str | None:
 
         given_exercise_program = exercise.exerciseProgram
 
-        if given_exercise_program not in self.template.exercisePrograms:
+        if not self.template.has_exercise_program(given_exercise_program):
             return "Error : The exercise_program of this exercise " + str(exercise) + " is not in this program."
 
-        if given_exercise_program in [exercise_result.exerciseProgram for exercise_result in self.results]:
+        if given_exercise_program.id in self.get_results_by_exercise_program_id():
             return "Error : The exercise_program of this exercise " + str(exercise) + " is already done."
 
         self.results.append(exercise)
+        self._index().appended(self.results, _exercise_program_id)
         return None
 
     def is_program_invalid_according_exercise_programs(self) -> bool:
-        for exerciseResult in self.results:
-            if exerciseResult.exerciseProgram not in self.template.exercisePrograms:
-                return True
-
-        return False
+        return not self.get_results_by_exercise_program_id().keys() <= self.template.get_exercise_programs_by_id().keys()
 
     def is_program_completed(self) -> bool:
         if len(self.results) != len(self.template.exercisePrograms):
             return False
 
-        for exercise in self.results:
-            if exercise.exerciseProgram not in self.template.exercisePrograms:
-                if self.is_program_invalid_according_exercise_programs():
-                    print("Warning : This program is not valid.")
-                return False
+        if self.is_program_invalid_according_exercise_programs():
+            print("Warning : This program is not valid.")
+            return False
 
-        return True
+        # Every exercise program done once
+        return len(self.get_results_by_exercise_program_id()) == len(self.template.get_exercise_programs_by_id())
@@ -1,6 +1,7 @@
 from .training import *
 
 class User(JsonSerializable):
+    _references = ("exerciseTypes", "programTypes", "sessions")
 
     def __init__(self, user_id: int, mention: str):
         super().__init__()
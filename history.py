@@ -0,0 +1,159 @@
+"""
+Columnar training history, kept next to the object store.
+
+For each user, the results are stored by exercise template and by exercise program as parallel arrays (timestamp,
+session, weight, reps) sorted by date, so the history questions slice contiguous arrays instead of walking
+User.sessions -> Session.results.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable
+
+import datamodel
+
+
+class ExerciseHistory:
+    """
+    Results of one user for one exercise template, sorted by session date. The results of a session are contiguous,
+    even when other sessions have the same date.
+    """
+
+    __slots__ = ("timestamps", "sessions", "weights", "reps")
+
+    def __init__(self):
+        self.timestamps = array("q")
+        # Number of the session of each result in its UserHistory, to tell apart the sessions of a same date
+        self.sessions = array("q")
+        self.weights = array("d")
+        self.reps = array("q")
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def append(self, timestamp: int, session: int, weight: float, reps: int):
+        # A session can be saved with a past date, its results are inserted at their place: after every result of that
+        # date, so after the results of the session appended before them too
+        index = len(self.timestamps)
+        if index and self.timestamps[-1] > timestamp:
+            index = bisect_right(self.timestamps, timestamp)
+        self.timestamps.insert(index, timestamp)
+        self.sessions.insert(index, session)
+        self.weights.insert(index, weight)
+        self.reps.insert(index, reps)
+
+    def last(self, count: int) -> 'ExerciseHistory':
+        """The `count` most recent results."""
+        return self._slice(max(len(self) - count, 0), len(self))
+
+    def between(self, since: int = None, until: int = None) -> 'ExerciseHistory':
+        """The results of the sessions dated from `since` (included) to `until` (excluded)."""
+        start = 0 if since is None else bisect_left(self.timestamps, since)
+        end = len(self) if until is None else bisect_left(self.timestamps, until)
+        return self._slice(start, end)
+
+    def _slice(self, start: int, end: int) -> 'ExerciseHistory':
+        history = ExerciseHistory()
+        history.timestamps = self.timestamps[start:end]
+        history.sessions = self.sessions[start:end]
+        history.weights = self.weights[start:end]
+        history.reps = self.reps[start:end]
+        return history
+
+
+class UserHistory:
+    """The histories of one user, by exercise template id and by exercise program id."""
+
+    __slots__ = ("by_exercise_template", "by_exercise_program", "session_ids", "last_sessions")
+
+    def __init__(self):
+        self.by_exercise_template: dict[str, ExerciseHistory] = {}
+        self.by_exercise_program: dict[str, ExerciseHistory] = {}
+        # Sessions in the histories, a session saved again makes them rebuilt instead of counted twice
+        self.session_ids: set[str] = set()
+        # (date, id) of the most recent session of each exercise template
+        self.last_sessions: dict[str, tuple[int, str]] = {}
+
+    def add(self, session: datamodel.Session):
+        self.session_ids.add(session.id)
+        session_number = len(self.session_ids)
+        for exercise in session.results:
+            exercise_template_id = exercise.exerciseProgram.exerciseTemplate.id
+            last_session = self.last_sessions.get(exercise_template_id)
+            if last_session is None or last_session[0] <= (session.date or 0):
+                self.last_sessions[exercise_template_id] = (session.date or 0, session.id)
+
+            for histories, key in ((self.by_exercise_template, exercise_template_id),
+                                   (self.by_exercise_program, exercise.exerciseProgram.id)):
+                history = histories.get(key)
+                if history is None:
+                    history = histories[key] = ExerciseHistory()
+                history.append(session.date or 0, session_number, exercise.weight, exercise.reps)
+
+
+class HistoryStore:
+    """
+    Histories of the users. The histories of a user are built from the storage the first time they are asked for, then
+    the storage appends each session it saves.
+    """
+
+    def __init__(self, get_user: Callable[[int], datamodel.User | None]):
+        self.get_user = get_user
+        self._histories: dict[int, UserHistory] = {}
+        # Incremented each time the histories of a user change, for the caches of what is computed from them
+        self._versions: dict[int, int] = {}
+        self._lock = threading.RLock()
+
+    def get_user_history(self, user_id: int) -> UserHistory:
+        with self._lock:
+            user_history = self._histories.get(user_id)
+            if user_history is None:
+                user_history = self._build(user_id)
+            return user_history
+
+    def get(self, user_id: int, exercise_template_id: str) -> ExerciseHistory | None:
+        return self.get_user_history(user_id).by_exercise_template.get(exercise_template_id)
+
+    def copy_user_histories(self, user_id: int) -> dict[str, ExerciseHistory]:
+        """Copies of the histories of a user by exercise template id, that the sessions saved next do not change."""
+        with self._lock:
+            return {
+                exercise_template_id: exercise_history.between()
+                for exercise_template_id, exercise_history in self.get_user_history(user_id).by_exercise_template.items()
+            }
+
+    def get_last_session_id(self, user_id: int, exercise_template_id: str) -> str | None:
+        last_session = self.get_user_history(user_id).last_sessions.get(exercise_template_id)
+        return last_session[1] if last_session is not None else None
+
+    def get_exercise_program(self, user_id: int, exercise_program_id: str) -> ExerciseHistory | None:
+        return self.get_user_history(user_id).by_exercise_program.get(exercise_program_id)
+
+    def get_version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def add_session(self, user_id: int, session: datamodel.Session):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            user_history = self._histories.get(user_id)
+            if user_history is None:
+                # Not built yet, the session will be read from the storage
+                return
+            if session.id in user_history.session_ids:
+                self.invalidate(user_id)
+                return
+            user_history.add(session)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._histories.pop(user_id, None)
+
+    def _build(self, user_id: int) -> UserHistory:
+        user_history = UserHistory()
+        user = self.get_user(user_id)
+        if user is not None:
+            for session in sorted(user.sessions, key=lambda s: s.date or 0):
+                user_history.add(session)
+
+        self._histories[user_id] = user_history
+        return user_history
@@ -0,0 +1,93 @@
+"""
+Rendering of the previous results and of the records shown by the session views. The previous results are kept in an
+LRU cache.
+
+A rendered history is cached by (user, exercise program, window, history version). The version of a user changes each
+time one of their sessions is saved, so the entries rendered before are not read anymore and leave the cache as new
+ones come in.
+"""
+import threading
+from collections import OrderedDict
+
+import history
+import records
+import storage
+
+NO_HISTORY = "*Aucune donnée précédente.*"
+
+CACHE_SIZE = 1024
+
+RECORD_LABELS = {
+    records.HEAVIEST_WEIGHT: "charge la plus lourde",
+    records.MOST_REPS: "plus de répétitions à cette charge",
+    records.BEST_E1RM: "meilleur 1RM estimé",
+    records.BEST_VOLUME: "plus gros volume en une séance",
+}
+
+_cache: OrderedDict[tuple[int, str, int, int], str] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _progress(previous: float, current: float) -> str:
+    if previous < current:
+        return ":arrow_upper_right:"
+    if previous > current:
+        return ":arrow_lower_right:"
+    return ":arrow_right:"
+
+
+def format_history(exercise_history: history.ExerciseHistory | None) -> str:
+    """One line per result, the most recent last, with the trend of the weight and of the reps."""
+    if not exercise_history:
+        return NO_HISTORY
+
+    weights = exercise_history.weights
+    reps = exercise_history.reps
+    lines = [f"• {weights[0]:g} kg x {reps[0]}"]
+    for i in range(1, len(weights)):
+        lines.append(f"• {weights[i]:g} kg {_progress(weights[i - 1], weights[i])} "
+                     f"x {reps[i]} {_progress(reps[i - 1], reps[i])}")
+    return "\n".join(lines)
+
+
+def format_records_beaten(exercise_name: str, beaten: list[str]) -> str:
+    return f"🏆 **Nouveau record** sur {exercise_name} : " + ", ".join(RECORD_LABELS[record] for record in beaten) + " !"
+
+
+def _get_cached(key: tuple[int, str, int, int]) -> str | None:
+    with _cache_lock:
+        text = _cache.get(key)
+        if text is not None:
+            _cache.move_to_end(key)
+        return text
+
+
+def _put_cached(key: tuple[int, str, int, int], text: str):
+    with _cache_lock:
+        _cache[key] = text
+        _cache.move_to_end(key)
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+async def render_previous_results(user_id: int, exercise_program_ids: list[str], window: int) -> dict[str, str]:
+    """The `window` last results of each exercise program of a user, rendered, by exercise program id."""
+    bdd = storage.get_async_storage()
+    version = await bdd.get_history_version(user_id)
+
+    rendered = {}
+    missing = []
+    for exercise_program_id in exercise_program_ids:
+        text = _get_cached((user_id, exercise_program_id, window, version))
+        if text is None:
+            missing.append(exercise_program_id)
+        else:
+            rendered[exercise_program_id] = text
+
+    if missing:
+        histories = await bdd.get_exercise_program_histories(user_id, missing, window)
+        for exercise_program_id in missing:
+            text = format_history(histories.get(exercise_program_id))
+            _put_cached((user_id, exercise_program_id, window, version), text)
+            rendered[exercise_program_id] = text
+    return rendered
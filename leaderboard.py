@@ -0,0 +1,237 @@
+"""
+Leaderboards of the users by exercise template, metric and period, kept next to the history.
+
+A board holds the score of every user for one (exercise template, metric, period bucket) and keeps the TOP_SIZE best
+sorted: a saved session raises the scores of its user, and only moves their entry in the top. The boards are built
+from the sessions of every user the first time one is asked for (so after a restart), then updated with each session
+the storage saves.
+
+The week and month boards only exist for the current bucket (and the later ones, for sessions dated in the future).
+When a period rolls over the boards of the past bucket are dropped, the boards of the new bucket were already filled
+by the sessions saved in it: nothing is read again.
+"""
+import functools
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+from typing import Callable, Container, Iterator
+
+import datamodel
+import records
+
+BEST_E1RM = "best_e1rm"
+VOLUME = "volume"
+SESSIONS = "sessions"
+METRICS = (BEST_E1RM, VOLUME, SESSIONS)
+
+WEEK = "week"
+MONTH = "month"
+ALL_TIME = "all_time"
+PERIODS = (WEEK, MONTH, ALL_TIME)
+
+# Entries kept sorted by board, a guild with fewer members among them is ranked from all the scores of the board
+TOP_SIZE = 50
+
+
+DAY_SECONDS = 24 * 3600
+
+
+def bucket_start(period: str, timestamp: int | None) -> int:
+    """Timestamp of the start of the week (Monday) or month of a timestamp, in UTC. 0 for all time."""
+    if period == ALL_TIME or timestamp is None:
+        return 0
+    return _bucket_start_of_day(period, timestamp // DAY_SECONDS)
+
+
+@functools.lru_cache(maxsize=4096)
+def _bucket_start_of_day(period: str, day: int) -> int:
+    date = datamodel.from_timestamp(day * DAY_SECONDS)
+    if period == WEEK:
+        date -= timedelta(days=date.weekday())
+    else:
+        date = date.replace(day=1)
+    return datamodel.to_timestamp(date)
+
+
+def session_scores(session: datamodel.Session) -> dict[str, dict[str, float]]:
+    """What a session adds to each metric, by exercise template id."""
+    scores: dict[str, dict[str, float]] = {}
+    for exercise in session.results:
+        exercise_template_id = exercise.exerciseProgram.exerciseTemplate.id
+        e1rm = records.estimate_1rm(exercise.weight, exercise.reps)
+        template_scores = scores.get(exercise_template_id)
+        if template_scores is None:
+            scores[exercise_template_id] = {BEST_E1RM: e1rm, VOLUME: 0, SESSIONS: 1}
+        elif e1rm > template_scores[BEST_E1RM]:
+            template_scores[BEST_E1RM] = e1rm
+    for exercise_template_id, volume in records.session_volumes(session).items():
+        scores[exercise_template_id][VOLUME] = volume
+    return scores
+
+
+class Board:
+    """The scores of the users for one (exercise template, metric, period bucket)."""
+
+    __slots__ = ("scores", "top")
+
+    def __init__(self):
+        self.scores: dict[int, float] = {}
+        # (-score, user id) of the TOP_SIZE best scores, sorted: the best first, the smallest user id first on a tie
+        self.top: list[tuple[float, int]] = []
+
+    def _remove_from_top(self, user_id: int, score: float):
+        index = bisect_left(self.top, (-score, user_id))
+        if index < len(self.top) and self.top[index] == (-score, user_id):
+            del self.top[index]
+
+    def set_score(self, user_id: int, score: float):
+        """Set the score of a user, never lower than their previous one: the other entries keep their place."""
+        previous = self.scores.get(user_id)
+        self.scores[user_id] = score
+        if previous is not None:
+            self._remove_from_top(user_id, previous)
+        entry = (-score, user_id)
+        if len(self.top) < TOP_SIZE or entry < self.top[-1]:
+            insort(self.top, entry)
+            del self.top[TOP_SIZE:]
+
+    def remove(self, user_id: int):
+        score = self.scores.pop(user_id, None)
+        if score is None:
+            return
+        self._remove_from_top(user_id, score)
+        if len(self.top) < min(TOP_SIZE, len(self.scores)):
+            self.sort_top()
+
+    def sort_top(self):
+        self.top = heapq.nsmallest(TOP_SIZE, ((-score, user_id) for user_id, score in self.scores.items()))
+
+    def ranking(self, member_ids: Container[int] | None, count: int) -> list[tuple[int, float]]:
+        """The `count` best (user id, score) among member_ids, or among all the users if None."""
+        ranking = [
+            (user_id, -negative_score) for negative_score, user_id in self.top
+            if member_ids is None or user_id in member_ids
+        ][:count]
+        if len(ranking) < count and len(self.top) < len(self.scores):
+            # Not enough members in the top, the scores of the board are all read
+            ranking = [(user_id, -negative_score) for negative_score, user_id in heapq.nsmallest(count, (
+                (-score, user_id) for user_id, score in self.scores.items()
+                if member_ids is None or user_id in member_ids
+            ))]
+        return ranking
+
+
+class LeaderboardStore:
+    """Boards by period, bucket start and (exercise template id, metric), built from the storage when first asked for."""
+
+    def __init__(self, get_user: Callable[[int], datamodel.User | None], iter_user_ids: Callable[[], Iterator[int]]):
+        self.get_user = get_user
+        self.iter_user_ids = iter_user_ids
+        self._boards: dict[str, dict[int, dict[tuple[str, str], Board]]] | None = None
+        # Bucket start of each period when the boards were last rolled over
+        self._current_buckets: dict[str, int] = {}
+        # Sessions in the boards of each user, a session saved again makes the boards of its user rebuilt
+        self._session_ids: dict[int, set[str]] = {}
+        self._lock = threading.RLock()
+
+    def get_ranking(self, exercise_template_id: str, metric: str, period: str, member_ids: Container[int] = None,
+                    count: int = 10, now: int = None) -> list[tuple[int, float]]:
+        """The `count` best (user id, score) of the current period bucket, among member_ids if given."""
+        with self._lock:
+            if self._boards is None:
+                self._build(now)
+            else:
+                self._roll_over(now)
+            board = self._boards[period].get(self._current_buckets[period], {}).get((exercise_template_id, metric))
+            return board.ranking(member_ids, count) if board is not None else []
+
+    def add_session(self, user_id: int, session: datamodel.Session):
+        with self._lock:
+            if self._boards is None:
+                # Not built yet, the session will be read from the storage
+                return
+            self._roll_over()
+            session_ids = self._session_ids.setdefault(user_id, set())
+            if session.id in session_ids:
+                # Saved again: a score cannot be lowered in place, the scores of the user are computed again
+                self._rebuild_user(user_id)
+                return
+            session_ids.add(session.id)
+            self._add_session(user_id, session)
+
+    def invalidate(self):
+        with self._lock:
+            self._boards = None
+            self._current_buckets = {}
+            self._session_ids = {}
+
+    def invalidate_user(self, user_id: int):
+        """Compute the scores of a user again from the storage, a user not in the boards yet is added."""
+        with self._lock:
+            if self._boards is None:
+                return
+            self._roll_over()
+            self._rebuild_user(user_id)
+
+    def _add_session(self, user_id: int, session: datamodel.Session, update_top: bool = True):
+        scores = session_scores(session)
+        if not scores:
+            return
+        for period in PERIODS:
+            start = bucket_start(period, session.date)
+            if start < self._current_buckets[period]:
+                # The bucket is over, its boards are not kept
+                continue
+            boards = self._boards[period].setdefault(start, {})
+            for exercise_template_id, template_scores in scores.items():
+                for metric, score in template_scores.items():
+                    board = boards.get((exercise_template_id, metric))
+                    if board is None:
+                        board = boards[(exercise_template_id, metric)] = Board()
+                    previous = board.scores.get(user_id)
+                    if previous is not None:
+                        score = max(previous, score) if metric == BEST_E1RM else previous + score
+                    if update_top:
+                        board.set_score(user_id, score)
+                    else:
+                        board.scores[user_id] = score
+
+    def _roll_over(self, now: int = None):
+        now = int(time.time()) if now is None else now
+        for period in PERIODS:
+            start = bucket_start(period, now)
+            if start != self._current_buckets.get(period):
+                self._current_buckets[period] = start
+                buckets = self._boards[period]
+                for past_start in [bucket for bucket in buckets if bucket < start]:
+                    del buckets[past_start]
+
+    def _rebuild_user(self, user_id: int):
+        for buckets in self._boards.values():
+            for boards in buckets.values():
+                for board in boards.values():
+                    board.remove(user_id)
+        self._add_user(user_id)
+
+    def _add_user(self, user_id: int, update_top: bool = True):
+        session_ids = self._session_ids[user_id] = set()
+        user = self.get_user(user_id)
+        if user is not None:
+            for session in user.sessions:
+                session_ids.add(session.id)
+                self._add_session(user_id, session, update_top)
+
+    def _build(self, now: int = None):
+        self._boards = {period: {} for period in PERIODS}
+        self._current_buckets = {}
+        self._session_ids = {}
+        self._roll_over(now)
+        # The tops are sorted once all the scores are known
+        for user_id in self.iter_user_ids():
+            self._add_user(user_id, update_top=False)
+        for buckets in self._boards.values():
+            for boards in buckets.values():
+                for board in boards.values():
+                    board.sort_top()
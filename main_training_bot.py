@@ -16,6 +16,11 @@ from command_training_create_exercise_template import CommandTrainingCreateExerc
 from command_training_create_program_type import CommandTrainingCreateProgram
 from command_training_create_session import CommandTrainingCreateSession
 from command_training_create_session_live import CommandTrainingLiveSession
+from command_training_export import CommandTrainingExport
+from command_training_leaderboard import CommandTrainingLeaderboard
+from command_training_stats import CommandTrainingStats
+import storage
+import storage_codecs
 
 MY_GUILD = discord.Object(id=1379158112862212167)  # replace with your guild id
 
@@ -45,7 +50,10 @@ class MyClient(discord.Client):
             CommandTrainingCreateExerciseTemplate(),
             CommandTrainingCreateProgram(),
             CommandTrainingCreateSession(),
-            CommandTrainingLiveSession()
+            CommandTrainingLiveSession(),
+            CommandTrainingExport(),
+            CommandTrainingStats(),
+            CommandTrainingLeaderboard()
         }
 
         for command in commands:
@@ -59,13 +67,25 @@ class MyClient(discord.Client):
         self.tree.copy_global_to(guild=MY_GUILD)
         await self.tree.sync(guild=MY_GUILD)
 
+    async def close(self):
+        # Persist the buffered storage writes before the process stops
+        await storage.get_async_storage().flush()
+        await super().close()
+
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--token", required=True, help="Discord bot token")
+    parser.add_argument("--storage", choices=["json", "sharded", "sqlite", "mongo"], default=storage.STORAGE_BACKEND,
+                        help="Storage backend")
+    parser.add_argument("--codec", choices=list(storage_codecs.CODECS), default=storage.STORAGE_CODEC,
+                        help="Encoding of the data file of the json storage, converted at startup if it changes")
     args = parser.parse_args()
 
+    storage.STORAGE_BACKEND = args.storage
+    storage.STORAGE_CODEC = args.codec
+
     intents = discord.Intents.all()
     client = MyClient(intents=intents)
 
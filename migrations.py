@@ -0,0 +1,682 @@
+"""
+Versioned migrations of the JsonStorage data file and of the SqliteStorage database.
+
+A data file is stamped with its schema version ("schemaVersion", 0 when missing). Each migration rewrites the file of
+the previous version, record by record: a JSON text data file is streamed, never loaded as a whole, whether it has one
+line per object or is pretty printed like the data files of the first versions. JsonStorage applies the pending
+migrations when it opens a data file, they can also be run by hand:
+
+    python migrations.py data.json
+    python migrations.py data.json --dry-run
+
+A migration interrupted by a crash resumes from its last checkpoint the next time it is run. The data file as it was
+before the migrations is kept next to it, e.g. data.json.v0.bak for a data file of version 0.
+
+A SQLite database is stamped with its version in PRAGMA user_version. SqliteStorage applies its pending migrations when
+it opens the database, each one in a transaction. The same command migrates a database:
+
+    python migrations.py data.sqlite3
+"""
+import argparse
+import codecs
+import json
+import os
+import shutil
+import sqlite3
+import time
+from abc import ABC
+from typing import Callable, Iterator
+
+import datamodel
+import storage_codecs
+
+SCHEMA_VERSION_KEY = "schemaVersion"
+
+Record = tuple[str, dict]
+
+
+class Migration(ABC):
+    """
+    Rewrite the records of a data file from version `version - 1` to `version`. A migration must be deterministic:
+    a resumed migration runs again over the records already written.
+    """
+
+    version: int
+    description: str
+    # Whether scan() must see every record before the first apply()
+    needs_scan = False
+
+    def __init__(self):
+        self.changed = 0
+
+    def scan(self, key: str, raw: dict):
+        pass
+
+    def end_scan(self) -> bool:
+        """Called after each scan pass, True to scan the records once more."""
+        return False
+
+    def end_collection(self, key: str) -> list[dict]:
+        """Records to add at the end of a collection."""
+        return []
+
+    def apply(self, key: str, raw: dict) -> dict:
+        return raw
+
+    def remaining(self) -> list[Record]:
+        """Records to add at the end, for the collections the data file does not have."""
+        return []
+
+
+class EmbeddedToReferences(Migration):
+    version = 1
+    description = "links to the entities of other collections written as ids"
+    needs_scan = True
+
+    # The data model of this version, so that the migration does not change with the classes
+    REFERENCES = {
+        "ExerciseProgram": ("exerciseTemplate",),
+        "Exercise": ("exerciseProgram",),
+        "Session": ("template",),
+        "User": ("exerciseTypes", "programTypes", "sessions"),
+    }
+    COLLECTION_BY_CLASS = {
+        "ExerciseType": "exerciseTypes",
+        "Program": "programs",
+        "Session": "sessions",
+        "User": "users",
+    }
+
+    def __init__(self):
+        super().__init__()
+        # First scan pass: only ids are kept, the users of the first versions embed all their sessions and come
+        # before them in the data file
+        self.stored_ids: set[str] = set()
+        self.embedded_ids: set[str] = set()
+        # Second scan pass, only when some entities are never stored: the first embedded copy of each of them, added
+        # to its collection so that its id resolves
+        self.missing_ids: set[str] | None = None
+        self.hoisted: dict[str, dict[str, dict]] = {}
+
+    @staticmethod
+    def _iter_embedded(raw: dict) -> Iterator[tuple[str, dict]]:
+        """The (collection, raw) of the entities of a collection embedded in a record."""
+        to_visit = [raw]
+        while to_visit:
+            for value in to_visit.pop().values():
+                for nested in value if isinstance(value, list) else (value,):
+                    if isinstance(nested, dict) and "_class" in nested:
+                        collection = EmbeddedToReferences.COLLECTION_BY_CLASS.get(nested["_class"])
+                        if collection is not None:
+                            yield collection, nested
+                        to_visit.append(nested)
+
+    def scan(self, key: str, raw: dict):
+        if self.missing_ids is None:
+            self.stored_ids.add(raw.get("id"))
+            for _, nested in self._iter_embedded(raw):
+                self.embedded_ids.add(nested.get("id"))
+        elif self.missing_ids:
+            for collection, nested in self._iter_embedded(raw):
+                if nested.get("id") in self.missing_ids:
+                    self.missing_ids.discard(nested.get("id"))
+                    self.hoisted.setdefault(collection, {})[nested.get("id")] = nested
+
+    def end_scan(self) -> bool:
+        if self.missing_ids is not None:
+            return False
+        self.missing_ids = self.embedded_ids - self.stored_ids
+        self.stored_ids = set()
+        self.embedded_ids = set()
+        return bool(self.missing_ids)
+
+    def end_collection(self, key: str) -> list[dict]:
+        return [self.apply(key, raw) for raw in self.hoisted.pop(key, {}).values()]
+
+    def apply(self, key: str, raw: dict) -> dict:
+        changed = False
+        to_visit = [raw]
+        while to_visit:
+            model_object = to_visit.pop()
+            references = EmbeddedToReferences.REFERENCES.get(model_object.get("_class"), ())
+            for field, value in model_object.items():
+                if field in references:
+                    if isinstance(value, dict):
+                        model_object[field] = value.get("id")
+                        changed = True
+                    elif isinstance(value, list) and any(isinstance(v, dict) for v in value):
+                        model_object[field] = [v.get("id") if isinstance(v, dict) else v for v in value]
+                        changed = True
+                    continue
+                for nested in value if isinstance(value, list) else (value,):
+                    if isinstance(nested, dict):
+                        to_visit.append(nested)
+
+        self.changed += changed
+        return raw
+
+    def remaining(self) -> list[Record]:
+        return [
+            (key, self.apply(key, raw))
+            for key, hoisted in self.hoisted.items()
+            for raw in hoisted.values()
+        ]
+
+
+class IsoDatesToTimestamps(Migration):
+    version = 2
+    description = "session dates as seconds since the epoch instead of ISO strings"
+
+    def apply(self, key: str, raw: dict) -> dict:
+        if raw.get("_class") == "Session" and isinstance(raw.get("date"), str):
+            raw["date"] = datamodel.to_timestamp(raw["date"])
+            self.changed += 1
+        return raw
+
+
+MIGRATIONS: list[type[Migration]] = [EmbeddedToReferences, IsoDatesToTimestamps]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def _is_line_format(path: str) -> bool:
+    """Whether the file has the one line per object format of JsonStorage, as opposed to a pretty printed one."""
+    if not storage_codecs.codec_for_path(path).line_per_object:
+        return False
+    f = open(path, "rb")
+    start = f.read(3)
+    f.close()
+    return start == b'{\n"'
+
+
+class _JsonStream:
+    """
+    Incremental decoder of a JSON text document of collections, {"key": [{...}, ...], ...}, whatever its layout. The
+    values are decoded one at a time from a buffer refilled from the file, so only one record is in memory at once.
+    """
+
+    CHUNK_SIZE = 1 << 20
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, f):
+        self.f = f
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.index = 0
+        self.eof = False
+        # Bytes read from the file
+        self.position = 0
+
+    def _fill(self):
+        # A value larger than the buffer makes the next read as large, a large record is decoded in linear time
+        chunk = self.f.read(max(_JsonStream.CHUNK_SIZE, len(self.buffer) - self.index))
+        self.position += len(chunk)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.index:] + self.text_decoder.decode(chunk, final=self.eof)
+        self.index = 0
+
+    def _peek(self) -> str:
+        """The next character that is not a whitespace, "" at the end of the file."""
+        while True:
+            while self.index < len(self.buffer) and self.buffer[self.index] in " \t\r\n":
+                self.index += 1
+            if self.index < len(self.buffer) or self.eof:
+                return self.buffer[self.index:self.index + 1]
+            self._fill()
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.index)
+        self.index += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _JsonStream._decoder.raw_decode(self.buffer, self.index)
+                # A number at the end of the buffer can go on in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.index = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def _items(self) -> Iterator:
+        self._expect("[")
+        if self._peek() == "]":
+            self.index += 1
+            return
+        while True:
+            yield self._value()
+            separator = self._peek()
+            self._expect(separator if separator in ",]" else ",")
+            if separator == "]":
+                return
+
+    def members(self) -> Iterator[tuple[str, object]]:
+        """
+        The members of the document, in order. The value of an array is an iterator of its items, read as it is
+        consumed: what is left of it is skipped when the next member is read.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if self._peek() == "[":
+                items = self._items()
+                yield key, items
+                for _ in items:
+                    pass
+            else:
+                yield key, self._value()
+            separator = self._peek()
+            self._expect(separator if separator in ",}" else ",")
+            if separator == "}":
+                return
+
+
+def read_schema_version(path: str) -> int:
+    if not storage_codecs.codec_for_path(path).line_per_object:
+        # The compressed and binary codecs came after the last migration, their files are not big legacy files
+        f = open(path, "rb")
+        document = storage_codecs.codec_for_path(path).decode(f.read())
+        f.close()
+        return document.get(SCHEMA_VERSION_KEY, 0)
+
+    if not _is_line_format(path):
+        f = open(path, "rb")
+        try:
+            for key, value in _JsonStream(f).members():
+                if key == SCHEMA_VERSION_KEY:
+                    return value
+        finally:
+            f.close()
+        return 0
+
+    f = open(path, "rb")
+    f.readline()
+    header = f.readline()
+    f.close()
+    name, _, value = header.partition(b":")
+    if json.loads(name) != SCHEMA_VERSION_KEY:
+        return 0
+    return json.loads(value.strip().rstrip(b","))
+
+
+class _RecordReader:
+    """Iterate the records of a data file, streamed line by line or decoded one at a time, never loaded whole."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.position = 0
+
+    def __iter__(self) -> Iterator[Record]:
+        self.position = 0
+        if not storage_codecs.codec_for_path(self.path).line_per_object:
+            f = open(self.path, "rb")
+            document = storage_codecs.codec_for_path(self.path).decode(f.read())
+            f.close()
+            self.position = self.size
+            for key, raws in document.items():
+                if key != SCHEMA_VERSION_KEY:
+                    for raw in raws:
+                        yield key, raw
+            return
+
+        if not _is_line_format(self.path):
+            # Pretty printed, or any other layout of the JSON text
+            f = open(self.path, "rb")
+            try:
+                stream = _JsonStream(f)
+                for key, value in stream.members():
+                    if key != SCHEMA_VERSION_KEY:
+                        for raw in value:
+                            self.position = stream.position
+                            yield key, raw
+            finally:
+                f.close()
+            self.position = self.size
+            return
+
+        key = None
+        f = open(self.path, "rb")
+        try:
+            for line in f:
+                self.position += len(line)
+                line = line.rstrip(b"\r\n")
+                first_char = line[:1]
+                if first_char == b'"':
+                    # Start of a collection: "key": [ or the schema version: "schemaVersion": 1,
+                    name = json.loads(line.partition(b":")[0])
+                    if name != SCHEMA_VERSION_KEY:
+                        key = name
+                elif first_char == b"{" and len(line) > 1:
+                    yield key, json.loads(line.rstrip(b","))
+        finally:
+            f.close()
+
+
+class _LineWriter:
+    """
+    Write records in the format of JsonStorage._write_data_file. The first `resume_offset` bytes are only counted,
+    they are already in the file of a resumed migration.
+    """
+
+    def __init__(self, f, version: int, resume_offset: int = 0):
+        self.f = f
+        self.position = 0
+        self.resume_offset = resume_offset
+        self.key = None
+        self.first_in_collection = True
+        self._write(f'{{\n"{SCHEMA_VERSION_KEY}": {version}'.encode())
+
+    def _write(self, chunk: bytes):
+        end = self.position + len(chunk)
+        if end > self.resume_offset:
+            self.f.write(chunk[max(self.resume_offset - self.position, 0):])
+        self.position = end
+
+    def write(self, key: str, raw: dict):
+        if key != self.key:
+            if self.key is not None:
+                self._write(b"\n]")
+            self._write(b",\n" + json.dumps(key).encode() + b": [\n")
+            self.key = key
+            self.first_in_collection = True
+
+        if not self.first_in_collection:
+            self._write(b",\n")
+        self._write(json.dumps(raw, separators=(",", ":")).encode())
+        self.first_in_collection = False
+
+    def close(self):
+        self._write(b"\n]\n}\n" if self.key is not None else b"\n}\n")
+
+
+class _DocumentWriter:
+    """Write records as one document encoded by a codec, for the data files that are not JSON text."""
+
+    def __init__(self, f, version: int, codec: storage_codecs.Codec):
+        self.f = f
+        self.codec = codec
+        self.document = {SCHEMA_VERSION_KEY: version}
+        self.position = 0
+
+    def write(self, key: str, raw: dict):
+        self.document.setdefault(key, []).append(raw)
+
+    def close(self):
+        self.f.write(self.codec.encode(self.document))
+
+
+class _NullWriter:
+    position = 0
+
+    def write(self, key: str, raw: dict):
+        pass
+
+    def close(self):
+        pass
+
+
+def _run(migration: Migration, path: str, dry_run: bool, progress: Callable[[str], None] | None,
+         checkpoint_every: int):
+    reader = _RecordReader(path)
+    codec = storage_codecs.codec_for_path(path)
+    tmp_path = path + ".migrating"
+    checkpoint_path = path + ".migration"
+    started = time.perf_counter()
+    records = 0
+
+    def report(step: str, force: bool = False):
+        if progress is not None and (force or records % checkpoint_every == 0):
+            elapsed = time.perf_counter() - started
+            percent = 100 * reader.position / reader.size if reader.size else 100
+            progress(f"Migration {migration.version} ({migration.description}), {step}: {percent:5.1f} %, "
+                     f"{records} records, {records / elapsed if elapsed else 0:.0f} records/s")
+
+    if migration.needs_scan:
+        scanning = True
+        while scanning:
+            for key, raw in reader:
+                migration.scan(key, raw)
+                records += 1
+                report("scan")
+            records = 0
+            scanning = migration.end_scan()
+
+    resume_offset = 0
+    if dry_run:
+        f = None
+        writer = _NullWriter()
+    elif not codec.line_per_object:
+        f = open(tmp_path, "wb")
+        writer = _DocumentWriter(f, migration.version, codec)
+    else:
+        # A checkpoint of this migration: the records up to its offset are already in the file being written
+        if os.path.exists(checkpoint_path) and os.path.exists(tmp_path):
+            checkpoint_file = open(checkpoint_path, "r", encoding="utf-8")
+            checkpoint = json.load(checkpoint_file)
+            checkpoint_file.close()
+            if checkpoint["version"] == migration.version and os.path.getsize(tmp_path) >= checkpoint["offset"]:
+                resume_offset = checkpoint["offset"]
+        f = open(tmp_path, "r+b" if resume_offset else "wb")
+        f.truncate(resume_offset)
+        f.seek(resume_offset)
+        writer = _LineWriter(f, migration.version, resume_offset)
+
+    def checkpoint():
+        if f is None or not isinstance(writer, _LineWriter) or writer.position <= resume_offset:
+            return
+        f.flush()
+        os.fsync(f.fileno())
+        checkpoint_file = open(checkpoint_path + ".tmp", "w", encoding="utf-8")
+        json.dump({"version": migration.version, "offset": writer.position}, checkpoint_file)
+        checkpoint_file.close()
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+    current_key = None
+    for key, raw in reader:
+        if key != current_key:
+            if current_key is not None:
+                for added in migration.end_collection(current_key):
+                    writer.write(current_key, added)
+            current_key = key
+        writer.write(key, migration.apply(key, raw))
+        records += 1
+        if records % checkpoint_every == 0:
+            checkpoint()
+        report("rewrite")
+
+    if current_key is not None:
+        for added in migration.end_collection(current_key):
+            writer.write(current_key, added)
+    for key, added in migration.remaining():
+        writer.write(key, added)
+    writer.close()
+    report("done" if not dry_run else "dry run", force=True)
+
+    if progress is not None:
+        progress(f"Migration {migration.version}: {migration.changed} records changed")
+
+    if f is not None:
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmp_path, path)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+
+def _backup(path: str, backup_path: str):
+    # A hard link costs nothing and the migrations replace the data file instead of writing in it
+    if os.path.exists(backup_path):
+        os.remove(backup_path)
+    try:
+        os.link(path, backup_path)
+    except OSError:
+        shutil.copyfile(path, backup_path)
+
+
+def migrate(path: str, target: int = LATEST_VERSION, dry_run: bool = False,
+            progress: Callable[[str], None] | None = None, checkpoint_every: int = 10000) -> int:
+    """
+    Apply to a data file the migrations up to version `target` and return its version. In dry run mode nothing is
+    written, each migration reports to `progress` what it would change in the file as it is.
+    """
+    version = read_schema_version(path)
+    pending = [migration_class for migration_class in MIGRATIONS if version < migration_class.version <= target]
+    if pending and not dry_run:
+        _backup(path, f"{path}.v{version}.bak")
+    for migration_class in pending:
+        _run(migration_class(), path, dry_run, progress, checkpoint_every)
+        if not dry_run:
+            version = migration_class.version
+    return version
+
+
+class SqliteMigration(ABC):
+    """Change a SqliteStorage database from user_version `version - 1` to `version`, inside a transaction."""
+
+    version: int
+    description: str
+
+    def __init__(self):
+        self.changed = 0
+
+    def apply(self, connection: sqlite3.Connection):
+        pass
+
+
+class SqliteIsoDatesToTimestamps(SqliteMigration):
+    version = 1
+    description = "session dates as INTEGER seconds since the epoch instead of TEXT ISO strings"
+
+    # The table of this version, so that the migration does not change with the schema of SqliteStorage
+    SESSIONS_TABLE = """
+    CREATE TABLE sessions_migrating (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(user_id),
+        program_id TEXT NOT NULL REFERENCES programs(id),
+        date INTEGER
+    )"""
+    SESSIONS_INDEXES = (
+        "CREATE INDEX IF NOT EXISTS sessions_user_date ON sessions(user_id, date)",
+        "CREATE INDEX IF NOT EXISTS sessions_program ON sessions(program_id)",
+    )
+
+    @staticmethod
+    def _timestamp(date: str) -> int | None:
+        if not date.strip():
+            return None
+        try:
+            # A timestamp written in a TEXT column is stored as text
+            return int(date)
+        except ValueError:
+            return datamodel.to_timestamp(date)
+
+    def apply(self, connection: sqlite3.Connection):
+        column_types = {row[1]: row[2] for row in connection.execute("PRAGMA table_info(sessions)")}
+        if column_types.get("date", "").upper() != "INTEGER":
+            # The type of a column cannot be altered, the table is copied into one with an INTEGER column, see
+            # https://www.sqlite.org/lang_altertable.html#otheralter (the copy converts the texts of integers)
+            connection.execute(SqliteIsoDatesToTimestamps.SESSIONS_TABLE)
+            connection.execute("INSERT INTO sessions_migrating (id, user_id, program_id, date) "
+                               "SELECT id, user_id, program_id, date FROM sessions")
+            connection.execute("DROP TABLE sessions")
+            connection.execute("ALTER TABLE sessions_migrating RENAME TO sessions")
+            for index in SqliteIsoDatesToTimestamps.SESSIONS_INDEXES:
+                connection.execute(index)
+
+        rows = connection.execute("SELECT id, date FROM sessions WHERE typeof(date) = 'text'").fetchall()
+        connection.executemany("UPDATE sessions SET date = ? WHERE id = ?",
+                               [(self._timestamp(date), session_id) for session_id, date in rows])
+        self.changed = len(rows)
+
+
+class SqliteUserHistoryVersions(SqliteMigration):
+    version = 2
+    description = "users.history_version, incremented by each write of the sessions of a user"
+
+    def apply(self, connection: sqlite3.Connection):
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(users)")}
+        if "history_version" not in columns:
+            connection.execute("ALTER TABLE users ADD COLUMN history_version INTEGER NOT NULL DEFAULT 0")
+            self.changed = connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+SQLITE_MIGRATIONS: list[type[SqliteMigration]] = [SqliteIsoDatesToTimestamps, SqliteUserHistoryVersions]
+SQLITE_LATEST_VERSION = SQLITE_MIGRATIONS[-1].version
+
+
+def is_sqlite_database(path: str) -> bool:
+    f = open(path, "rb")
+    header = f.read(16)
+    f.close()
+    return header == b"SQLite format 3\x00"
+
+
+def read_sqlite_version(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_sqlite(connection: sqlite3.Connection, target: int = SQLITE_LATEST_VERSION, dry_run: bool = False,
+                   progress: Callable[[str], None] | None = None) -> int:
+    """
+    Apply to a SQLite database the migrations up to version `target` and return its version. Each migration is one
+    transaction, rolled back in dry run mode.
+    """
+    version = read_sqlite_version(connection)
+    connection.commit()
+    # The foreign keys cannot be switched inside a transaction, a table being copied would break them meanwhile
+    foreign_keys = connection.execute("PRAGMA foreign_keys").fetchone()[0]
+    connection.execute("PRAGMA foreign_keys=OFF")
+    try:
+        for migration_class in SQLITE_MIGRATIONS:
+            if not version < migration_class.version <= target:
+                continue
+            migration = migration_class()
+            connection.execute("BEGIN")
+            try:
+                migration.apply(connection)
+                if dry_run:
+                    connection.rollback()
+                else:
+                    connection.execute(f"PRAGMA user_version = {migration.version}")
+                    connection.commit()
+                    version = migration.version
+            except BaseException:
+                connection.rollback()
+                raise
+            if progress is not None:
+                progress(f"SQLite migration {migration.version} ({migration.description}): "
+                         f"{migration.changed} rows changed")
+    finally:
+        connection.execute(f"PRAGMA foreign_keys={'ON' if foreign_keys else 'OFF'}")
+    return version
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Migrate a JsonStorage data file or a SQLite database to the latest "
+                                                 "schema version")
+    parser.add_argument("path", help="Data file or database, e.g. data.json or data.sqlite3")
+    parser.add_argument("--to", type=int, default=LATEST_VERSION, help="Target schema version")
+    parser.add_argument("--dry-run", action="store_true", help="Report the changes without writing them")
+    parser.add_argument("--checkpoint-every", type=int, default=10000, help="Records between two checkpoints")
+    args = parser.parse_args()
+
+    if is_sqlite_database(args.path):
+        sqlite_connection = sqlite3.connect(args.path)
+        print(f"{args.path}: SQLite version {read_sqlite_version(sqlite_connection)}")
+        reached = migrate_sqlite(sqlite_connection, min(args.to, SQLITE_LATEST_VERSION), args.dry_run, progress=print)
+        sqlite_connection.close()
+        print(f"{args.path}: SQLite version {reached}")
+    else:
+        print(f"{args.path}: schema version {read_schema_version(args.path)}")
+        reached = migrate(args.path, args.to, args.dry_run, progress=print, checkpoint_every=args.checkpoint_every)
+        print(f"{args.path}: schema version {reached}")
@@ -0,0 +1,188 @@
+"""
+Personal records of the users by exercise template, kept next to the history.
+
+The records of a user are built from their sessions the first time they are asked for (so after a restart or a
+migration they are computed again from the data), then the storage updates them with each session it saves: every
+result is compared with the current records, in O(1).
+"""
+import copy
+import threading
+from typing import Callable
+
+import datamodel
+
+HEAVIEST_WEIGHT = "heaviest_weight"
+MOST_REPS = "most_reps"
+BEST_E1RM = "best_e1rm"
+BEST_VOLUME = "best_volume"
+
+
+def estimate_1rm(weight: float, reps: int) -> float:
+    """Epley, as analytics.estimate_1rm for a single set."""
+    return weight if reps == 1 else weight * (1 + reps / 30)
+
+
+def session_volumes(session: datamodel.Session) -> dict[str, float]:
+    """Weight lifted during a session (weight x reps), by exercise template id."""
+    volumes: dict[str, float] = {}
+    for exercise in session.results:
+        exercise_template_id = exercise.exerciseProgram.exerciseTemplate.id
+        volumes[exercise_template_id] = volumes.get(exercise_template_id, 0) + exercise.weight * exercise.reps
+    return volumes
+
+
+class PersonalRecords:
+    """
+    Records of one user for one exercise template. The add methods return the records beaten: a first value only sets
+    a record, it does not beat one.
+    """
+
+    __slots__ = ("heaviest_weight", "best_e1rm", "best_volume", "reps_by_weight")
+
+    def __init__(self):
+        self.heaviest_weight: float | None = None
+        self.best_e1rm: float | None = None
+        self.best_volume: float | None = None
+        # Most reps done at each weight
+        self.reps_by_weight: dict[float, int] = {}
+
+    def add_set(self, weight: float, reps: int) -> list[str]:
+        beaten = []
+
+        if self.heaviest_weight is None or weight > self.heaviest_weight:
+            if self.heaviest_weight is not None:
+                beaten.append(HEAVIEST_WEIGHT)
+            self.heaviest_weight = weight
+
+        most_reps = self.reps_by_weight.get(weight)
+        if most_reps is None or reps > most_reps:
+            if most_reps is not None:
+                beaten.append(MOST_REPS)
+            self.reps_by_weight[weight] = reps
+
+        e1rm = estimate_1rm(weight, reps)
+        if self.best_e1rm is None or e1rm > self.best_e1rm:
+            if self.best_e1rm is not None:
+                beaten.append(BEST_E1RM)
+            self.best_e1rm = e1rm
+
+        return beaten
+
+    def add_session_volume(self, volume: float) -> list[str]:
+        if self.best_volume is None or volume > self.best_volume:
+            beaten = [BEST_VOLUME] if self.best_volume is not None else []
+            self.best_volume = volume
+            return beaten
+        return []
+
+    def copy(self) -> 'PersonalRecords':
+        records = copy.copy(self)
+        records.reps_by_weight = dict(self.reps_by_weight)
+        return records
+
+
+def add_session(records_by_template: dict[str, PersonalRecords],
+                session: datamodel.Session) -> dict[str, list[str]]:
+    """Add the results of a session to records, return the records beaten by exercise template id."""
+    beaten: dict[str, list[str]] = {}
+    for exercise in session.results:
+        exercise_template_id = exercise.exerciseProgram.exerciseTemplate.id
+        records = records_by_template.get(exercise_template_id)
+        if records is None:
+            records = records_by_template[exercise_template_id] = PersonalRecords()
+        beaten_by_set = records.add_set(exercise.weight, exercise.reps)
+        if beaten_by_set:
+            beaten.setdefault(exercise_template_id, []).extend(beaten_by_set)
+
+    for exercise_template_id, volume in session_volumes(session).items():
+        beaten_by_session = records_by_template[exercise_template_id].add_session_volume(volume)
+        if beaten_by_session:
+            beaten.setdefault(exercise_template_id, []).extend(beaten_by_session)
+    return beaten
+
+
+class RecordsStore:
+    """Records of the users by exercise template id, built from the storage when first asked for."""
+
+    def __init__(self, get_user: Callable[[int], datamodel.User | None]):
+        self.get_user = get_user
+        self._records: dict[int, dict[str, PersonalRecords]] = {}
+        # Sessions in the records of each user, a session saved again makes them rebuilt: a record cannot be undone
+        self._session_ids: dict[int, set[str]] = {}
+        self._lock = threading.RLock()
+
+    def get_user_records(self, user_id: int) -> dict[str, PersonalRecords]:
+        with self._lock:
+            records_by_template = self._records.get(user_id)
+            if records_by_template is None:
+                records_by_template = self._build(user_id)
+            return records_by_template
+
+    def copy_records(self, user_id: int, exercise_template_ids: list[str]) -> dict[str, PersonalRecords]:
+        with self._lock:
+            records_by_template = self.get_user_records(user_id)
+            return {
+                exercise_template_id: records_by_template[exercise_template_id].copy()
+                for exercise_template_id in exercise_template_ids
+                if exercise_template_id in records_by_template
+            }
+
+    def add_session(self, user_id: int, session: datamodel.Session):
+        with self._lock:
+            records_by_template = self._records.get(user_id)
+            if records_by_template is None:
+                # Not built yet, the session will be read from the storage
+                return
+            if session.id in self._session_ids[user_id]:
+                self.invalidate(user_id)
+                return
+            self._session_ids[user_id].add(session.id)
+            add_session(records_by_template, session)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._records.pop(user_id, None)
+            self._session_ids.pop(user_id, None)
+
+    def _build(self, user_id: int) -> dict[str, PersonalRecords]:
+        records_by_template: dict[str, PersonalRecords] = {}
+        session_ids: set[str] = set()
+        user = self.get_user(user_id)
+        if user is not None:
+            for session in user.sessions:
+                session_ids.add(session.id)
+                add_session(records_by_template, session)
+
+        self._records[user_id] = records_by_template
+        self._session_ids[user_id] = session_ids
+        return records_by_template
+
+
+class SessionRecords:
+    """
+    The records of a user for the exercises of a session in progress, to announce the records beaten as the results
+    are entered.
+    """
+
+    def __init__(self, records_by_template: dict[str, PersonalRecords]):
+        self.records_by_template = records_by_template
+
+    def add_exercise(self, exercise: datamodel.Exercise) -> list[str]:
+        """The records beaten by a result just entered."""
+        exercise_template_id = exercise.exerciseProgram.exerciseTemplate.id
+        records = self.records_by_template.get(exercise_template_id)
+        if records is None:
+            records = self.records_by_template[exercise_template_id] = PersonalRecords()
+        return records.add_set(exercise.weight, exercise.reps)
+
+    def end_session(self, session: datamodel.Session) -> dict[str, list[str]]:
+        """The volume records beaten by a finished session, by exercise template id."""
+        beaten = {}
+        for exercise_template_id, volume in session_volumes(session).items():
+            records = self.records_by_template.get(exercise_template_id)
+            if records is None:
+                records = self.records_by_template[exercise_template_id] = PersonalRecords()
+            beaten_by_session = records.add_session_volume(volume)
+            if beaten_by_session:
+                beaten[exercise_template_id] = beaten_by_session
+        return beaten
@@ -0,0 +1,102 @@
+"""
+Sessions of each user sorted by (date, id), for the range and "last N" queries of StorageInterface.iter_sessions.
+
+The sessions are read by pages: each page is found again by bisecting on the key of the last session read, so a
+session saved during an iteration neither shifts nor repeats the sessions not read yet.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Callable, Iterator
+
+import datamodel
+
+PAGE_SIZE = 256
+
+
+class UserSessions:
+    __slots__ = ("keys", "sessions", "session_ids")
+
+    def __init__(self):
+        self.keys: list[tuple[int, str]] = []
+        self.sessions: list[datamodel.Session] = []
+        self.session_ids: set[str] = set()
+
+    def add(self, session: datamodel.Session):
+        key = (session.date or 0, session.id)
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.sessions.insert(index, session)
+        self.session_ids.add(session.id)
+
+
+class SessionIndex:
+    """The sessions of a user are indexed from the storage the first time they are asked for, then kept up to date."""
+
+    def __init__(self, get_user: Callable[[int], datamodel.User | None]):
+        self.get_user = get_user
+        self._users: dict[int, UserSessions] = {}
+        self._lock = threading.RLock()
+
+    def _get_user_sessions(self, user_id: int) -> UserSessions:
+        user_sessions = self._users.get(user_id)
+        if user_sessions is None:
+            user_sessions = UserSessions()
+            user = self.get_user(user_id)
+            if user is not None:
+                for session in sorted(user.sessions, key=lambda s: (s.date or 0, s.id)):
+                    user_sessions.keys.append((session.date or 0, session.id))
+                    user_sessions.sessions.append(session)
+                    user_sessions.session_ids.add(session.id)
+            self._users[user_id] = user_sessions
+        return user_sessions
+
+    def add_session(self, user_id: int, session: datamodel.Session):
+        with self._lock:
+            user_sessions = self._users.get(user_id)
+            if user_sessions is None:
+                # Not indexed yet, the session will be read from the storage
+                return
+            if session.id in user_sessions.session_ids:
+                # Saved again, maybe with another date or as another instance
+                self.invalidate(user_id)
+                return
+            user_sessions.add(session)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def iter_sessions(self, user_id: int, since: int = None, until: int = None, limit: int = None,
+                      reverse: bool = False) -> Iterator[datamodel.Session]:
+        """The sessions dated from `since` (included) to `until` (excluded), the oldest first unless reverse."""
+        # The smallest key of a date: any id sorts after ""
+        low = (since, "") if since is not None else None
+        high = (until, "") if until is not None else None
+        last_key = None
+        remaining = limit
+
+        while remaining is None or remaining > 0:
+            page_size = PAGE_SIZE if remaining is None else min(PAGE_SIZE, remaining)
+            with self._lock:
+                user_sessions = self._get_user_sessions(user_id)
+                keys = user_sessions.keys
+                start = 0 if low is None else bisect_left(keys, low)
+                end = len(keys) if high is None else bisect_left(keys, high)
+                if not reverse:
+                    if last_key is not None:
+                        start = max(start, bisect_right(keys, last_key))
+                    end = min(end, start + page_size)
+                else:
+                    if last_key is not None:
+                        end = min(end, bisect_left(keys, last_key))
+                    start = max(start, end - page_size)
+                if start >= end:
+                    return
+                page = user_sessions.sessions[start:end]
+                last_key = keys[start] if reverse else keys[end - 1]
+
+            if reverse:
+                page.reverse()
+            yield from page
+            if remaining is not None:
+                remaining -= len(page)
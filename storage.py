@@ -1,12 +1,32 @@
+import asyncio
+import atexit
+import copy
+import functools
+import itertools
 import json
+import mmap
 import os
+import re
+import threading
 from abc import ABC, abstractmethod
-from typing import List
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, NamedTuple
 
 import datamodel
+import history
+import leaderboard
+import migrations
+import records
+import session_index
+import storage_codecs
 
 
 class StorageInterface(ABC):
+    """
+    The objects returned by the get methods are read-only snapshots: a storage may share them between callers, so they
+    must not be mutated. Build a new object (or a copy with X.load(x.dump())) to change data and upcreate it.
+    """
 
     @abstractmethod
     def get_exercises_template(self) -> List[datamodel.ExerciseType]:
@@ -33,6 +53,207 @@ class StorageInterface(ABC):
     def get_user_from_user_id(self, user_id: int) -> datamodel.User:
         pass
 
+    @abstractmethod
+    def iter_user_ids(self) -> Iterator[int]:
+        """The Discord ids of all the users, without loading them."""
+        pass
+
+    def flush(self) -> None:
+        """Persist the writes that are still buffered, for the storages that delay them."""
+        pass
+
+    def upcreate_batch_and_add_to_user(self, user: datamodel.User, exercise_templates: List[datamodel.ExerciseType],
+                                       programs: List[datamodel.Program], sessions: List[datamodel.Session]) -> None:
+        """
+        Upsert many objects of one user at once, for imports. The storages override it to write them in one batch,
+        this default makes one call per object.
+        """
+        for exercise_template in exercise_templates:
+            self.upcreate_exercise_template_and_add_to_user(user, exercise_template)
+        for program in programs:
+            self.upcreate_program_type_and_add_to_user(user, program)
+        for session in sessions:
+            self.upcreate_session_and_add_to_user(user, session)
+
+    # The storages that several processes write to set it (a database server, a database file): what the caches of a
+    # process hold of a user is checked against the history version stored with the user before being read
+    shared = False
+
+    def _read_history_versions(self, user_id: int = None) -> dict[int, int]:
+        """The history versions stored with one user or, without user_id, with every user. For the shared storages."""
+        raise NotImplementedError
+
+    def _sync_caches(self, user_id: int = None):
+        """Forget the cached data of the users whose sessions another process saved, of every user without user_id."""
+        if not self.shared:
+            return
+        cached_versions = getattr(self, "_cached_versions", None)
+        if cached_versions is None:
+            cached_versions = self._cached_versions = {}
+        for synced_user_id, version in self._read_history_versions(user_id).items():
+            if cached_versions.get(synced_user_id) == version:
+                continue
+            for cache in (getattr(self, "_history", None), getattr(self, "_records", None),
+                          getattr(self, "_session_index", None)):
+                if cache is not None:
+                    cache.invalidate(synced_user_id)
+            leaderboards = getattr(self, "_leaderboards", None)
+            if leaderboards is not None:
+                leaderboards.invalidate_user(synced_user_id)
+            cached_versions[synced_user_id] = version
+
+    def get_history(self) -> history.HistoryStore:
+        """Columnar history of the results of the users, kept up to date by upcreate_session_and_add_to_user."""
+        history_store = getattr(self, "_history", None)
+        if history_store is None:
+            history_store = self._history = history.HistoryStore(self.get_user_from_user_id)
+        return history_store
+
+    def get_exercise_history(self, user_id: int, exercise_template_id: str) -> history.ExerciseHistory | None:
+        self._sync_caches(user_id)
+        exercise_history = self.get_history().get(user_id, exercise_template_id)
+        # A copy, the arrays of the store keep growing with the sessions saved
+        return exercise_history.between() if exercise_history is not None else None
+
+    def get_last_session_id(self, user_id: int, exercise_template_id: str) -> str | None:
+        """Id of the most recent session of a user with results for an exercise template."""
+        self._sync_caches(user_id)
+        return self.get_history().get_last_session_id(user_id, exercise_template_id)
+
+    def get_exercise_histories(self, user_id: int) -> dict[str, history.ExerciseHistory]:
+        """Copies of all the histories of a user, by exercise template id."""
+        self._sync_caches(user_id)
+        return self.get_history().copy_user_histories(user_id)
+
+    def get_exercise_program_histories(self, user_id: int, exercise_program_ids: List[str],
+                                       count: int = None) -> dict[str, history.ExerciseHistory]:
+        """The histories of exercise programs of a user (only the `count` most recent results), by id."""
+        self._sync_caches(user_id)
+        user_history = self.get_history().get_user_history(user_id)
+        histories = {}
+        for exercise_program_id in exercise_program_ids:
+            exercise_history = user_history.by_exercise_program.get(exercise_program_id)
+            if exercise_history is not None:
+                histories[exercise_program_id] = (
+                    exercise_history.between() if count is None else exercise_history.last(count))
+        return histories
+
+    def get_history_version(self, user_id: int) -> int:
+        """Changes each time a session of the user is saved."""
+        if self.shared:
+            # Also saved by the other processes
+            return self._read_history_versions(user_id).get(user_id, 0)
+        return self.get_history().get_version(user_id)
+
+    def get_records(self) -> records.RecordsStore:
+        """Personal records of the users, kept up to date by upcreate_session_and_add_to_user."""
+        records_store = getattr(self, "_records", None)
+        if records_store is None:
+            records_store = self._records = records.RecordsStore(self.get_user_from_user_id)
+        return records_store
+
+    def get_personal_records(self, user_id: int,
+                             exercise_template_ids: List[str]) -> dict[str, records.PersonalRecords]:
+        """Copies of the records of a user for exercise templates, by id (none for an exercise never done)."""
+        self._sync_caches(user_id)
+        return self.get_records().copy_records(user_id, exercise_template_ids)
+
+    def get_session_index(self) -> session_index.SessionIndex:
+        """Sessions of the users sorted by date, kept up to date by upcreate_session_and_add_to_user."""
+        index = getattr(self, "_session_index", None)
+        if index is None:
+            index = self._session_index = session_index.SessionIndex(self.get_user_from_user_id)
+        return index
+
+    def iter_sessions(self, user_id: int, since: int = None, until: int = None, limit: int = None,
+                      reverse: bool = False) -> Iterator[datamodel.Session]:
+        """
+        The sessions of a user dated from `since` (included) to `until` (excluded), the oldest first or the most recent
+        first with reverse, at most `limit`. They are read as the iteration goes: the last N sessions are
+        iter_sessions(user_id, limit=N, reverse=True). This default reads them from an index of the user's sessions.
+        """
+        self._sync_caches(user_id)
+        return self.get_session_index().iter_sessions(user_id, since, until, limit, reverse)
+
+    def get_leaderboards(self) -> leaderboard.LeaderboardStore:
+        """Leaderboards of the users by exercise template, kept up to date by upcreate_session_and_add_to_user."""
+        leaderboards = getattr(self, "_leaderboards", None)
+        if leaderboards is None:
+            leaderboards = self._leaderboards = leaderboard.LeaderboardStore(self.get_user_from_user_id,
+                                                                             self.iter_user_ids)
+        return leaderboards
+
+    def get_leaderboard(self, exercise_template_id: str, metric: str, period: str, member_ids: set[int] = None,
+                        count: int = 10) -> list[tuple[int, float]]:
+        """The `count` best (user id, score) of the current week, month or all time, among member_ids if given."""
+        # The boards hold every user, the versions of all of them are read
+        self._sync_caches()
+        return self.get_leaderboards().get_ranking(exercise_template_id, metric, period, member_ids, count)
+
+    def _add_to_history(self, user: datamodel.User, session: datamodel.Session):
+        if self.shared:
+            # The version stored with the user is not known here, another process may have saved a session meanwhile:
+            # the caches of the user are checked again at the next read
+            getattr(self, "_cached_versions", {}).pop(user.userId, None)
+            return
+        # The history, the records, the session index and the leaderboards, nothing to update while not asked for
+        history_store = getattr(self, "_history", None)
+        if history_store is not None:
+            history_store.add_session(user.userId, session)
+        records_store = getattr(self, "_records", None)
+        if records_store is not None:
+            records_store.add_session(user.userId, session)
+        index = getattr(self, "_session_index", None)
+        if index is not None:
+            index.add_session(user.userId, session)
+        leaderboards = getattr(self, "_leaderboards", None)
+        if leaderboards is not None:
+            leaderboards.add_session(user.userId, session)
+
+
+class _LazyEntry(NamedTuple):
+    """Position of an object not loaded yet, in the memory mapped data file."""
+    offset: int
+    length: int
+
+
+class _ObjectsById(MutableMapping):
+    """
+    Identity map of a JsonStorage: every object loaded, nested ones included, by id. The objects of the collections
+    that are not loaded yet are loaded when they are accessed.
+    """
+
+    def __init__(self, json_storage: 'JsonStorage'):
+        self.json_storage = json_storage
+        self.loaded: dict[str, datamodel.JsonSerializable] = {}
+
+    def __getitem__(self, object_id: str) -> datamodel.JsonSerializable:
+        model_object = self.loaded.get(object_id)
+        if model_object is None:
+            model_object = self.json_storage._get(self.json_storage.key_by_id[object_id], object_id)
+        return model_object
+
+    def __setitem__(self, object_id: str, model_object: datamodel.JsonSerializable):
+        self.loaded[object_id] = model_object
+
+    def __delitem__(self, object_id: str):
+        del self.loaded[object_id]
+
+    def __contains__(self, object_id) -> bool:
+        return object_id in self.loaded or object_id in self.json_storage.key_by_id
+
+    def __iter__(self):
+        return iter(self.loaded.keys() | self.json_storage.key_by_id.keys())
+
+    def __len__(self) -> int:
+        return len(self.loaded.keys() | self.json_storage.key_by_id.keys())
+
+
+# Fields read in a data file line without parsing it. An object is dumped with "_class", "_module" and "id" first, so
+# the first match in its line is its own id (and for a user, its own userId).
+_ID_PATTERN = re.compile(rb'"id":"([^"]*)"')
+_USER_ID_PATTERN = re.compile(rb'"userId":(-?\d+)')
+
 
 class JsonStorage(StorageInterface):
 
@@ -42,94 +263,398 @@ class JsonStorage(StorageInterface):
     DB_KEY_PROGRAMS = "programs"
     DB_KEY_USERS = "users"
     DB_KEY_SESSIONS = "sessions"
+    DB_KEY_SCHEMA_VERSION = "schemaVersion"
+
+    # A data file of an older version is migrated when it is opened, see migrations.py
+    SCHEMA_VERSION = migrations.LATEST_VERSION
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self, path="data.json"):
+    def __init__(self, path="data.json", journal: bool = True, compaction_threshold: int = 1000,
+                 flush_delay: float = 0.2, flush_max_pending: int = 50, lazy: bool = True, codec: str = None):
         if getattr(self, "_initialized", False):
             return
+
+        # The codec of the data file comes from the extension of its path. A codec given by name changes that
+        # extension: a data file found with another one is converted at startup.
+        if codec is not None:
+            path = storage_codecs.path_with_codec(path, storage_codecs.CODECS[codec])
         self.path = path
-        self.data: dict = {
-            JsonStorage.DB_KEY_EXERCISE_TYPES: [],
-            JsonStorage.DB_KEY_PROGRAMS: [],
-            JsonStorage.DB_KEY_USERS: [],
-            JsonStorage.DB_KEY_SESSIONS: []
+        self.codec = storage_codecs.codec_for_path(path)
+
+        # In journal mode every upsert appends one compact record to the log file instead of rewriting the whole
+        # data file. The log is folded into the data file once it holds `compaction_threshold` records.
+        self.journal = journal
+        self.journal_path = path + ".log"
+        self.journal_size = 0
+        self.compaction_threshold = compaction_threshold
+        self._journal_file = None
+
+        # Writes are grouped: a mutation only marks the store dirty, and one flush persists every mutation made
+        # during `flush_delay` seconds (or as soon as `flush_max_pending` are waiting). A delay of 0 flushes each write.
+        self.flush_delay = flush_delay
+        self.flush_max_pending = flush_max_pending
+        self._pending_records: list[str] = []
+        self._pending_writes = 0
+        self._flush_timer: threading.Timer | None = None
+        self._lock = threading.RLock()
+
+        # In lazy mode the startup only indexes where each object is in the (memory mapped) data file, an object is
+        # loaded the first time it is accessed. Only a file with one line per object can be indexed.
+        self.lazy = lazy and self.codec.line_per_object
+        self._mmap: mmap.mmap | None = None
+
+        # Each collection is indexed by object id, the insertion order is the order of the data file. A value is
+        # either the object or the _LazyEntry locating it in the data file. The collections are written before the
+        # ones referencing them, so a complete load resolves every id on the first read.
+        self.data: dict[str, dict[str, datamodel.JsonSerializable | _LazyEntry]] = {
+            JsonStorage.DB_KEY_EXERCISE_TYPES: {},
+            JsonStorage.DB_KEY_PROGRAMS: {},
+            JsonStorage.DB_KEY_SESSIONS: {},
+            JsonStorage.DB_KEY_USERS: {}
         }
-        self.db_objects_by_id: dict = {}
+        self.schema_version = 0
+        self.key_by_id: dict[str, str] = {}
+        self.db_objects_by_id = _ObjectsById(self)
+        self.users_by_user_id: dict[int, str] = {}
         self._load()
+        atexit.register(self.flush)
         self._initialized = True
 
     def _init_db(self):
-        file = open(self.path, "w", encoding="utf-8")
-        json.dump(self.data, file)
-        file.close()
+        self._save()
 
     def _load(self):
 
-        # Init DB if file not exist
+        # The data file can exist with another codec, it is then converted
+        source_path = self.path
         if not os.path.exists(self.path):
+            source_path = storage_codecs.find_data_file(self.path) or self.path
+
+        # Init DB if file not exist
+        if not os.path.exists(source_path):
             self._init_db()
+        elif migrations.read_schema_version(source_path) < JsonStorage.SCHEMA_VERSION:
+            migrations.migrate(source_path)
+
+        indexed = source_path == self.path and self.lazy and self._index_data_file()
+        if not indexed:
+            self._load_data_file(source_path)
+
+        if self.journal:
+            self._replay_journal(source_path + ".log")
+
+        if source_path != self.path or (self.lazy and not indexed):
+            # A data file written by an older version has no line per object, rewrite it so the next startup is lazy
+            self.compact()
+
+        if source_path != self.path:
+            # Kept as a backup, a data file next to the converted one would be converted again at the next startup
+            for converted_path in (source_path, source_path + ".log"):
+                if os.path.exists(converted_path):
+                    os.replace(converted_path, converted_path + ".bak")
+
+    def _load_data_file(self, path: str = None):
 
         # Load DB file
-        f = open(self.path, "r", encoding="utf-8")
-        data_file_json = json.load(f)
+        path = path or self.path
+        f = open(path, "rb")
+        data_file_json = storage_codecs.codec_for_path(path).decode(f.read())
+        f.close()
+
+        self.schema_version = data_file_json.pop(JsonStorage.DB_KEY_SCHEMA_VERSION, 0)
+
+        # Create data model objects from json, the referenced collections first
+        keys = [key for key in self.data if key in data_file_json]
+        keys += [key for key in data_file_json if key not in self.data]
+        for key in keys:
+            for json_object in data_file_json[key]:
+                self._replace(self._load_linked(json_object), key)
+
+    def _load_linked(self, json_object: dict) -> datamodel.JsonSerializable:
+        # An object of a collection can already exist as a copy embedded in an object loaded before it (a session in
+        # its user): that instance is updated, so everything stays linked to a single instance per id
+        existing = self.db_objects_by_id.loaded.get(json_object.get("id"))
+        return datamodel.JsonSerializable.load_linked(json_object, self.db_objects_by_id, into=existing)
+
+    def _index_data_file(self) -> bool:
+        """Index the objects of a data file written by _save without parsing them, False for another format."""
+        f = open(self.path, "rb")
+        try:
+            data_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return False
+        finally:
+            f.close()
+
+        if data_file[:3] != b'{\n"':
+            data_file.close()
+            return False
+        self._mmap = data_file
+
+        key = None
+        position = 2
+        size = len(data_file)
+        while position < size:
+            end = data_file.find(b"\n", position)
+            if end == -1:
+                end = size
+
+            first_char = data_file[position:position + 1]
+            if first_char == b'"':
+                # Start of a collection: "key": [ or the schema version: "schemaVersion": 1,
+                header = data_file[position:end]
+                name, _, value = header.partition(b":")
+                key = json.loads(name)
+                if key == JsonStorage.DB_KEY_SCHEMA_VERSION:
+                    self.schema_version = json.loads(value.rstrip(b","))
+                else:
+                    self.data.setdefault(key, {})
+            elif first_char == b"{":
+                object_end = end - 1 if data_file[end - 1:end] == b"," else end
+                object_id = _ID_PATTERN.search(data_file, position, object_end).group(1).decode()
+                self.data[key][object_id] = _LazyEntry(position, object_end - position)
+                self.key_by_id[object_id] = key
+
+                if key == JsonStorage.DB_KEY_USERS:
+                    user_id = _USER_ID_PATTERN.search(data_file, position, object_end).group(1)
+                    self.users_by_user_id[int(user_id)] = object_id
+
+            position = end + 1
+
+        return True
+
+    def _get(self, json_storage_key: str, object_id: str) -> datamodel.JsonSerializable:
+        with self._lock:
+            model_object = self.data[json_storage_key][object_id]
+            if isinstance(model_object, _LazyEntry):
+                raw = self._mmap[model_object.offset:model_object.offset + model_object.length]
+                # The identity map gets the object before its references are resolved, cycles end on it
+                model_object = self._load_linked(json.loads(raw))
+                self.data[json_storage_key][object_id] = model_object
+            return model_object
+
+    def get_all(self, json_storage_key: str) -> list[datamodel.JsonSerializable]:
+        return [self._get(json_storage_key, object_id) for object_id in list(self.data[json_storage_key])]
+
+    def _replay_journal(self, journal_path: str = None):
+        journal_path = journal_path or self.journal_path
+        if not os.path.exists(journal_path):
+            return
+
+        torn_record = False
+        f = open(journal_path, "r", encoding="utf-8")
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last record can be incomplete (crash during an append), everything before it is valid
+                torn_record = True
+                break
+
+            self._replace(self._load_linked(record["object"]), record["key"])
+            self.journal_size += 1
         f.close()
 
-        # Create data model objects from json
-        for key, json_objects in data_file_json.items():
-            for json_object in json_objects:
-                model_object = datamodel.JsonSerializable.load(json_object)
-                model_object.populate(self.db_objects_by_id)
-                self.db_objects_by_id[model_object.id] = model_object
-                self.data[key].append(model_object)
+        # Appending after a torn record would corrupt the next one, so fold the valid part into the data file
+        if torn_record or self.journal_size >= self.compaction_threshold:
+            self.compact()
 
     def _save(self):
-        print(str(self.data))
-        f = open(self.path, "w", encoding="utf-8")
-        json.dump(self.data, f, indent=4, default=lambda o: o.dump())
+        new_entries = self._write_data_file(self.path, self.data)
+        self.schema_version = JsonStorage.SCHEMA_VERSION
+
+        # The mapping of the replaced file is not needed anymore, the objects not loaded yet now point into the new one
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if new_entries:
+            f = open(self.path, "rb")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+            for key, object_id, entry in new_entries:
+                self.data[key][object_id] = entry
+
+    def _write_data_file(self, path: str, collections: dict[str, dict]) -> list[tuple[str, str, _LazyEntry]]:
+        """
+        Atomically write a data file: a JSON document with one line per object, so it can be indexed without being
+        parsed. The objects that are not loaded are copied as is from the current data file, the returned entries
+        locate them in the new one.
+        """
+        if not self.codec.line_per_object:
+            self._write_encoded_data_file(path, collections)
+            return []
+
+        tmp_path = path + ".tmp"
+        f = open(tmp_path, "wb")
+        position = 0
+        new_entries: list[tuple[str, str, _LazyEntry]] = []
+
+        def write(chunk: bytes):
+            nonlocal position
+            f.write(chunk)
+            position += len(chunk)
+
+        keys = list(collections)
+        write(b"{\n")
+        write(f'"{JsonStorage.DB_KEY_SCHEMA_VERSION}": {JsonStorage.SCHEMA_VERSION}'.encode())
+        write(b",\n" if keys else b"\n")
+        for key_index, key in enumerate(keys):
+            write(json.dumps(key).encode() + b": [\n")
+
+            objects = collections[key]
+            for object_index, (object_id, model_object) in enumerate(objects.items()):
+                if isinstance(model_object, _LazyEntry):
+                    line = self._mmap[model_object.offset:model_object.offset + model_object.length]
+                    new_entries.append((key, object_id, _LazyEntry(position, len(line))))
+                else:
+                    line = json.dumps(model_object.dump(by_reference=True), separators=(",", ":")).encode()
+                write(line)
+                write(b",\n" if object_index < len(objects) - 1 else b"\n")
+
+            write(b"],\n" if key_index < len(keys) - 1 else b"]\n")
+        write(b"}\n")
+
+        f.flush()
+        os.fsync(f.fileno())
         f.close()
+        os.replace(tmp_path, path)
+
+        return new_entries
+
+    def _write_encoded_data_file(self, path: str, collections: dict[str, dict]):
+        """Atomically write a data file as a single document encoded by the codec."""
+        document = {JsonStorage.DB_KEY_SCHEMA_VERSION: JsonStorage.SCHEMA_VERSION}
+        for key, objects in collections.items():
+            document[key] = [
+                json.loads(self._mmap[model_object.offset:model_object.offset + model_object.length])
+                if isinstance(model_object, _LazyEntry) else model_object.dump(by_reference=True)
+                for model_object in objects.values()
+            ]
+
+        tmp_path = path + ".tmp"
+        f = open(tmp_path, "wb")
+        f.write(self.codec.encode(document))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmp_path, path)
+
+    def _append_journal(self, records: list[str]):
+        if self._journal_file is None:
+            self._journal_file = open(self.journal_path, "a", encoding="utf-8")
+
+        self._journal_file.write("".join(records))
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+        self.journal_size += len(records)
+
+        if self.journal_size >= self.compaction_threshold:
+            self.compact()
+
+    def compact(self):
+        """Write a snapshot of the whole database in the data file and empty the journal."""
+        with self._lock:
+            self._save()
+
+            # The snapshot already contains the buffered writes
+            self._pending_records.clear()
+            self._pending_writes = 0
+
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.journal_size = 0
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+            if self._pending_writes == 0:
+                return
+            self._pending_writes = 0
+
+            if self.journal:
+                records = self._pending_records
+                self._pending_records = []
+                self._append_journal(records)
+            else:
+                self._save()
+
+    def _persist(self, json_serializable: datamodel.JsonSerializable, json_storage_key: str):
+        if self.journal:
+            # The record is encoded right away, later changes of the object must not leak into it
+            record = {"key": json_storage_key, "object": json_serializable.dump(by_reference=True)}
+            self._pending_records.append(json.dumps(record, separators=(",", ":")) + "\n")
+        self._pending_writes += 1
+
+        if self.flush_delay <= 0 or self._pending_writes >= self.flush_max_pending:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    # The get methods return the stored objects themselves (no copy). They are never modified in place afterwards:
+    # the upcreate methods replace them with updated copies, so a returned object stays a consistent snapshot.
 
     def get_exercises_template(self) -> List[datamodel.ExerciseType]:
-        exercise_types = []
-        for exerciseType in self.data[JsonStorage.DB_KEY_EXERCISE_TYPES]:
-            print(str(exerciseType))
-            assert isinstance(exerciseType, datamodel.ExerciseType)
-            exercise_types.append(datamodel.ExerciseType.load(exerciseType.dump()))
+        exercise_types = self.get_all(JsonStorage.DB_KEY_EXERCISE_TYPES)
         exercise_types.sort()
         return exercise_types
 
     def get_programs(self) -> List[datamodel.Program]:
-        programs = []
-        for program in self.data[JsonStorage.DB_KEY_PROGRAMS]:
-            assert isinstance(program, datamodel.Program)
-            programs.append(datamodel.Program.load(program.dump()))
+        programs = self.get_all(JsonStorage.DB_KEY_PROGRAMS)
         programs.sort()
         return programs
 
-    def get_user_from_user_id(self, user_id: int) -> datamodel.User:
-        user = None
-        for user in self.data[JsonStorage.DB_KEY_USERS]:
-            if user.userId == user_id:
-                return datamodel.User.load(user.dump())
-        return user
-
-    def upcreate_json_serializable(self, json_serializable: datamodel.JsonSerializable, json_storate_key):
+    def get_user_from_user_id(self, user_id: int) -> datamodel.User | None:
+        object_id = self.users_by_user_id.get(user_id)
+        if object_id is None:
+            return None
+        return self._get(JsonStorage.DB_KEY_USERS, object_id)
 
-        object_in_db = None
-        for object_candidate in self.data[json_storate_key]:
-            if object_candidate.id == json_serializable.id:
-                object_in_db = object_candidate
-                break
+    def iter_user_ids(self) -> Iterator[int]:
+        with self._lock:
+            return iter(list(self.users_by_user_id))
 
-        if object_in_db is not None:
-            json_serializable.id = object_in_db.id
-            self.data[JsonStorage.DB_KEY_USERS].remove(object_in_db)
+    def _copy_user_for_update(self, user: datamodel.User) -> datamodel.User:
+        user_in_db = self.get_user_from_user_id(user.userId)
+        if user_in_db is None:
+            return user
+
+        # Copy on write: only the user and its lists are copied, the objects they contain are shared
+        user_copy = copy.copy(user_in_db)
+        user_copy.exerciseTypes = list(user_in_db.exerciseTypes)
+        user_copy.programTypes = list(user_in_db.programTypes)
+        user_copy.sessions = list(user_in_db.sessions)
+        return user_copy
+
+    def _replace(self, json_serializable: datamodel.JsonSerializable, json_storate_key):
+        self.data[json_storate_key][json_serializable.id] = json_serializable
+        self.key_by_id[json_serializable.id] = json_storate_key
+        self.db_objects_by_id[json_serializable.id] = json_serializable
+
+        if isinstance(json_serializable, datamodel.User):
+            previous_id = self.users_by_user_id.get(json_serializable.userId)
+            if previous_id is not None and previous_id != json_serializable.id:
+                del self.data[json_storate_key][previous_id]
+                del self.key_by_id[previous_id]
+                self.db_objects_by_id.loaded.pop(previous_id, None)
+            self.users_by_user_id[json_serializable.userId] = json_serializable.id
 
-        self.data[json_storate_key].append(json_serializable)
-        self._save()
+    def upcreate_json_serializable(self, json_serializable: datamodel.JsonSerializable, json_storate_key):
+        with self._lock:
+            self._replace(json_serializable, json_storate_key)
+            self._persist(json_serializable, json_storate_key)
 
     def upcreate_user(self, user: datamodel.User):
         self.upcreate_json_serializable(user, JsonStorage.DB_KEY_USERS)
@@ -137,34 +662,160 @@ class JsonStorage(StorageInterface):
     def upcreate_exercise_template_and_add_to_user(self, user: datamodel.User, exercise_template: datamodel.ExerciseType):
         self.upcreate_json_serializable(exercise_template, JsonStorage.DB_KEY_EXERCISE_TYPES)
 
-        user_in_db = self.get_user_from_user_id(user.userId)
-        if user_in_db is None:
-            user_in_db = user
-
+        user_in_db = self._copy_user_for_update(user)
         user_in_db.exerciseTypes.append(exercise_template)
         self.upcreate_user(user_in_db)
 
     def upcreate_program_type_and_add_to_user(self, user: datamodel.User, program_type: datamodel.Program) -> None:
         self.upcreate_json_serializable(program_type, JsonStorage.DB_KEY_PROGRAMS)
 
-        user_in_db = self.get_user_from_user_id(user.userId)
-        if user_in_db is None:
-            user_in_db = user
-
+        user_in_db = self._copy_user_for_update(user)
         user_in_db.programTypes.append(program_type)
         self.upcreate_user(user_in_db)
 
     def upcreate_session_and_add_to_user(self, user: datamodel.User, session: datamodel.Session) -> None:
         self.upcreate_json_serializable(session, JsonStorage.DB_KEY_SESSIONS)
 
-        user_in_db = self.get_user_from_user_id(user.userId)
-        if user_in_db is None:
-            user_in_db = user
-
+        user_in_db = self._copy_user_for_update(user)
         user_in_db.sessions.append(session)
         self.upcreate_user(user_in_db)
+        self._add_to_history(user_in_db, session)
+
+    def upcreate_batch_and_add_to_user(self, user: datamodel.User, exercise_templates: List[datamodel.ExerciseType],
+                                       programs: List[datamodel.Program], sessions: List[datamodel.Session]) -> None:
+        with self._lock:
+            for key, model_objects in ((JsonStorage.DB_KEY_EXERCISE_TYPES, exercise_templates),
+                                       (JsonStorage.DB_KEY_PROGRAMS, programs),
+                                       (JsonStorage.DB_KEY_SESSIONS, sessions)):
+                for model_object in model_objects:
+                    self.upcreate_json_serializable(model_object, key)
+
+            # One user write for the whole batch. An object the user already has is replaced, so importing the same
+            # data twice does not duplicate it.
+            user_in_db = self._copy_user_for_update(user)
+            for user_objects, model_objects in ((user_in_db.exerciseTypes, exercise_templates),
+                                                (user_in_db.programTypes, programs),
+                                                (user_in_db.sessions, sessions)):
+                index_by_id = {model_object.id: index for index, model_object in enumerate(user_objects)}
+                for model_object in model_objects:
+                    index = index_by_id.get(model_object.id)
+                    if index is None:
+                        user_objects.append(model_object)
+                    else:
+                        user_objects[index] = model_object
+            self.upcreate_user(user_in_db)
+
+            for session in sessions:
+                self._add_to_history(user_in_db, session)
+
+
+class AsyncStorage:
+    """
+    Async variant of StorageInterface, to be used from coroutines.
+
+    Every call runs on a dedicated worker thread so serialization and file I/O never block the event loop. There is
+    only one worker, which also serializes the accesses to the wrapped storage.
+    """
+
+    def __init__(self, storage: StorageInterface):
+        self.storage = storage
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+
+    async def _run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(method, *args))
+
+    async def get_exercises_template(self) -> List[datamodel.ExerciseType]:
+        return await self._run(self.storage.get_exercises_template)
+
+    async def get_programs(self) -> List[datamodel.Program]:
+        return await self._run(self.storage.get_programs)
+
+    async def upcreate_exercise_template_and_add_to_user(self, user: datamodel.User,
+                                                         exercise: datamodel.ExerciseType) -> None:
+        await self._run(self.storage.upcreate_exercise_template_and_add_to_user, user, exercise)
+
+    async def upcreate_program_type_and_add_to_user(self, user: datamodel.User,
+                                                    program_type: datamodel.Program) -> None:
+        await self._run(self.storage.upcreate_program_type_and_add_to_user, user, program_type)
+
+    async def upcreate_session_and_add_to_user(self, user: datamodel.User, session: datamodel.Session) -> None:
+        await self._run(self.storage.upcreate_session_and_add_to_user, user, session)
+
+    async def get_user_from_user_id(self, user_id: int) -> datamodel.User | None:
+        return await self._run(self.storage.get_user_from_user_id, user_id)
+
+    async def flush(self) -> None:
+        await self._run(self.storage.flush)
+
+    async def upcreate_batch_and_add_to_user(self, user: datamodel.User,
+                                             exercise_templates: List[datamodel.ExerciseType],
+                                             programs: List[datamodel.Program],
+                                             sessions: List[datamodel.Session]) -> None:
+        await self._run(self.storage.upcreate_batch_and_add_to_user, user, exercise_templates, programs, sessions)
+
+    async def get_exercise_history(self, user_id: int, exercise_template_id: str) -> history.ExerciseHistory | None:
+        return await self._run(self.storage.get_exercise_history, user_id, exercise_template_id)
+
+    async def iter_sessions(self, user_id: int, since: int = None, until: int = None, limit: int = None,
+                            reverse: bool = False, page_size: int = 64) -> AsyncIterator[datamodel.Session]:
+        # The sessions are read page by page on the worker thread
+        sessions = self.storage.iter_sessions(user_id, since, until, limit, reverse)
+        while True:
+            page = await self._run(lambda: list(itertools.islice(sessions, page_size)))
+            if not page:
+                return
+            for session in page:
+                yield session
+
+    async def get_personal_records(self, user_id: int,
+                                   exercise_template_ids: List[str]) -> dict[str, records.PersonalRecords]:
+        return await self._run(self.storage.get_personal_records, user_id, exercise_template_ids)
+
+    async def get_last_session_id(self, user_id: int, exercise_template_id: str) -> str | None:
+        return await self._run(self.storage.get_last_session_id, user_id, exercise_template_id)
+
+    async def get_exercise_histories(self, user_id: int) -> dict[str, history.ExerciseHistory]:
+        return await self._run(self.storage.get_exercise_histories, user_id)
+
+    async def get_exercise_program_histories(self, user_id: int, exercise_program_ids: List[str],
+                                             count: int = None) -> dict[str, history.ExerciseHistory]:
+        return await self._run(self.storage.get_exercise_program_histories, user_id, exercise_program_ids, count)
+
+    async def get_history_version(self, user_id: int) -> int:
+        return await self._run(self.storage.get_history_version, user_id)
+
+    async def get_user_ids(self) -> List[int]:
+        return await self._run(lambda: list(self.storage.iter_user_ids()))
+
+    async def get_leaderboard(self, exercise_template_id: str, metric: str, period: str, member_ids: set[int] = None,
+                              count: int = 10) -> list[tuple[int, float]]:
+        return await self._run(self.storage.get_leaderboard, exercise_template_id, metric, period, member_ids, count)
+
+
+# Backend returned by get_storage(), "json", "sharded", "sqlite" or "mongo"
+STORAGE_BACKEND = os.environ.get("TRAININGBOOK_STORAGE", "json")
+# Codec of the JsonStorage (or ShardedJsonStorage) data files, None to keep the one of their extension
+STORAGE_CODEC = os.environ.get("TRAININGBOOK_STORAGE_CODEC")
 
+_async_storage: AsyncStorage | None = None
 
 
 def get_storage() -> StorageInterface:
-    return JsonStorage()
+    if STORAGE_BACKEND == "sharded":
+        import storage_sharded
+        return storage_sharded.ShardedJsonStorage(codec=STORAGE_CODEC)
+    if STORAGE_BACKEND == "sqlite":
+        import storage_sqlite
+        return storage_sqlite.SqliteStorage()
+    if STORAGE_BACKEND == "mongo":
+        import storage_mongo
+        return storage_mongo.MongoStorage()
+    return JsonStorage(codec=STORAGE_CODEC)
+
+
+def get_async_storage() -> AsyncStorage:
+    global _async_storage
+    if _async_storage is None:
+        _async_storage = AsyncStorage(get_storage())
+    return _async_storage
@@ -0,0 +1,125 @@
+"""
+Encodings of the JsonStorage data file, chosen from the extension of its path:
+
+    data.json       JSON text with one line per object, the only one JsonStorage can load lazily
+    data.json.gz    compact JSON compressed with gzip
+    data.json.zst   compact JSON compressed with zstandard (needs the zstandard package)
+    data.bson       BSON document
+"""
+import gzip
+import json
+import os
+from abc import ABC, abstractmethod
+
+import bson
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Codec(ABC):
+    name: str
+    extension: str
+    # Written by JsonStorage with one line per object, which it can index without parsing the file
+    line_per_object = False
+
+    @abstractmethod
+    def encode(self, document: dict) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, data: bytes) -> dict:
+        pass
+
+
+def _encode_json(document: dict) -> bytes:
+    return json.dumps(document, separators=(",", ":")).encode()
+
+
+class JsonCodec(Codec):
+    name = "json"
+    extension = ".json"
+    line_per_object = True
+
+    def encode(self, document: dict) -> bytes:
+        return _encode_json(document)
+
+    def decode(self, data: bytes) -> dict:
+        return json.loads(data)
+
+
+class GzipJsonCodec(Codec):
+    name = "gzip"
+    extension = ".json.gz"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def encode(self, document: dict) -> bytes:
+        # mtime=0 so that the same database always gives the same file
+        return gzip.compress(_encode_json(document), compresslevel=self.level, mtime=0)
+
+    def decode(self, data: bytes) -> dict:
+        return json.loads(gzip.decompress(data))
+
+
+class ZstdJsonCodec(Codec):
+    name = "zstd"
+    extension = ".json.zst"
+
+    def __init__(self, level: int = 3):
+        self.level = level
+
+    def encode(self, document: dict) -> bytes:
+        if zstandard is None:
+            raise RuntimeError("The zstd codec needs the zstandard package")
+        return zstandard.ZstdCompressor(level=self.level).compress(_encode_json(document))
+
+    def decode(self, data: bytes) -> dict:
+        if zstandard is None:
+            raise RuntimeError("The zstd codec needs the zstandard package")
+        return json.loads(zstandard.ZstdDecompressor().decompress(data))
+
+
+class BsonCodec(Codec):
+    name = "bson"
+    extension = ".bson"
+
+    def encode(self, document: dict) -> bytes:
+        return bson.encode(document)
+
+    def decode(self, data: bytes) -> dict:
+        return bson.decode(data)
+
+
+CODECS: dict[str, Codec] = {codec.name: codec for codec in (JsonCodec(), GzipJsonCodec(), ZstdJsonCodec(), BsonCodec())}
+
+# Longest extensions first, ".json.gz" must not be taken for ".json"
+_CODECS_BY_EXTENSION = sorted(CODECS.values(), key=lambda codec: len(codec.extension), reverse=True)
+
+
+def codec_for_path(path: str) -> Codec:
+    """Codec of a data file from its extension, JSON for an unknown one."""
+    for codec in _CODECS_BY_EXTENSION:
+        if path.endswith(codec.extension):
+            return codec
+    return CODECS[JsonCodec.name]
+
+
+def path_with_codec(path: str, codec: Codec) -> str:
+    """The path of the same data file with the extension of another codec: data.json -> data.bson."""
+    current = codec_for_path(path)
+    if path.endswith(current.extension):
+        path = path[:-len(current.extension)]
+    return path + codec.extension
+
+
+def find_data_file(path: str) -> str | None:
+    """An existing data file with the same name as path but the extension of another codec."""
+    for codec in CODECS.values():
+        other_path = path_with_codec(path, codec)
+        if other_path != path and os.path.exists(other_path):
+            return other_path
+    return None
@@ -0,0 +1,228 @@
+import argparse
+import os
+from typing import Iterator, List
+
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReplaceOne, UpdateOne
+
+import datamodel
+import storage
+
+
+class MongoStorage(storage.StorageInterface):
+    """
+    StorageInterface backed by MongoDB, so several bot processes can share one datastore.
+
+    Exercise types and programs are stored as their JsonSerializable dump. A user document only keeps the ids of its
+    exercise types and programs, its sessions live in their own collection with the userId of their owner. Its
+    historyVersion is incremented by each write of its sessions, the caches of every process are checked against it.
+    """
+
+    _instance: 'MongoStorage' = None
+
+    COLLECTION_EXERCISE_TYPES = "exerciseTypes"
+    COLLECTION_PROGRAMS = "programs"
+    COLLECTION_USERS = "users"
+    COLLECTION_SESSIONS = "sessions"
+
+    shared = True
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, uri: str = None, database: str = "trainingbook", client: MongoClient = None,
+                 max_pool_size: int = 20):
+        if getattr(self, "_initialized", False):
+            return
+
+        # One pooled client for the whole process, a stand-in such as mongomock.MongoClient() can be given instead
+        if client is None:
+            uri = uri or os.environ.get("TRAININGBOOK_MONGO_URI", "mongodb://localhost:27017")
+            client = MongoClient(uri, maxPoolSize=max_pool_size)
+        self.client = client
+        self.db = client[database]
+
+        self.exercise_types = self.db[MongoStorage.COLLECTION_EXERCISE_TYPES]
+        self.programs = self.db[MongoStorage.COLLECTION_PROGRAMS]
+        self.users = self.db[MongoStorage.COLLECTION_USERS]
+        self.sessions = self.db[MongoStorage.COLLECTION_SESSIONS]
+
+        self.users.create_index([("userId", ASCENDING)], unique=True)
+        self.sessions.create_index([("userId", ASCENDING), ("date", ASCENDING)])
+        self.sessions.create_index([("date", ASCENDING)])
+        self._initialized = True
+
+    @staticmethod
+    def _to_document(json_serializable: datamodel.JsonSerializable, **fields) -> dict:
+        document = json_serializable.dump()
+        document["_id"] = json_serializable.id
+        document.update(fields)
+        return document
+
+    @staticmethod
+    def _from_document(document: dict, *fields) -> datamodel.JsonSerializable:
+        document = dict(document)
+        for field in ("_id",) + fields:
+            document.pop(field, None)
+        return datamodel.JsonSerializable.load(document)
+
+    @staticmethod
+    def _user_upsert(user: datamodel.User, sessions_written: bool = False, **add_to_set) -> UpdateOne:
+        update = {
+            "$setOnInsert": {"_id": user.id},
+            "$set": {"mention": user.mention},
+        }
+        if sessions_written:
+            update["$inc"] = {"historyVersion": 1}
+        if add_to_set:
+            update["$addToSet"] = add_to_set
+        return UpdateOne({"userId": user.userId}, update, upsert=True)
+
+    def get_exercises_template(self) -> List[datamodel.ExerciseType]:
+        exercise_types = [self._from_document(document) for document in self.exercise_types.find()]
+        exercise_types.sort()
+        return exercise_types
+
+    def get_programs(self) -> List[datamodel.Program]:
+        programs = [self._from_document(document) for document in self.programs.find()]
+        programs.sort()
+        return programs
+
+    def get_user_from_user_id(self, user_id: int) -> datamodel.User | None:
+        document = self.users.find_one({"userId": user_id})
+        if document is None:
+            return None
+
+        user = datamodel.User(user_id, document.get("mention"))
+        user.id = document["_id"]
+        user.exerciseTypes = [
+            self._from_document(exercise_type)
+            for exercise_type in self.exercise_types.find({"_id": {"$in": document.get("exerciseTypeIds", [])}})
+        ]
+        user.programTypes = [
+            self._from_document(program)
+            for program in self.programs.find({"_id": {"$in": document.get("programIds", [])}})
+        ]
+        user.sessions = [
+            self._from_document(session, "userId")
+            for session in self.sessions.find({"userId": user_id}).sort("date", ASCENDING)
+        ]
+        return user
+
+    def _read_history_versions(self, user_id: int = None) -> dict[int, int]:
+        query = {} if user_id is None else {"userId": user_id}
+        return {
+            document["userId"]: document.get("historyVersion", 0)
+            for document in self.users.find(query, {"userId": 1, "historyVersion": 1})
+        }
+
+    def iter_user_ids(self) -> Iterator[int]:
+        for document in self.users.find({}, {"userId": 1}).sort("userId", ASCENDING):
+            yield document["userId"]
+
+    def iter_sessions(self, user_id: int, since: int = None, until: int = None, limit: int = None,
+                      reverse: bool = False) -> Iterator[datamodel.Session]:
+        # A limit of 0 means no limit for MongoDB
+        if limit is not None and limit <= 0:
+            return
+
+        query: dict = {"userId": user_id}
+        if since is not None or until is not None:
+            query["date"] = {}
+            if since is not None:
+                query["date"]["$gte"] = since
+            if until is not None:
+                query["date"]["$lt"] = until
+
+        # The cursor fetches the documents by batches as they are iterated, on the (userId, date) index
+        direction = DESCENDING if reverse else ASCENDING
+        cursor = self.sessions.find(query).sort([("date", direction), ("_id", direction)])
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        for document in cursor:
+            yield self._from_document(document, "userId")
+
+    def upcreate_exercise_template_and_add_to_user(self, user: datamodel.User,
+                                                   exercise_template: datamodel.ExerciseType) -> None:
+        self.exercise_types.bulk_write([
+            ReplaceOne({"_id": exercise_template.id}, self._to_document(exercise_template), upsert=True)
+        ])
+        self.users.bulk_write([self._user_upsert(user, exerciseTypeIds=exercise_template.id)])
+
+    def upcreate_program_type_and_add_to_user(self, user: datamodel.User, program_type: datamodel.Program) -> None:
+        self.programs.bulk_write([
+            ReplaceOne({"_id": program_type.id}, self._to_document(program_type), upsert=True)
+        ])
+        self.users.bulk_write([self._user_upsert(user, programIds=program_type.id)])
+
+    def upcreate_session_and_add_to_user(self, user: datamodel.User, session: datamodel.Session) -> None:
+        # The session is written first: a user document never points to a session that does not exist yet
+        self.sessions.bulk_write([
+            ReplaceOne({"_id": session.id}, self._to_document(session, userId=user.userId), upsert=True)
+        ])
+        self.users.bulk_write([self._user_upsert(user, sessions_written=True)])
+        self._add_to_history(user, session)
+
+    def upcreate_batch_and_add_to_user(self, user: datamodel.User, exercise_templates: List[datamodel.ExerciseType],
+                                       programs: List[datamodel.Program], sessions: List[datamodel.Session]) -> None:
+        # One bulk write per collection, the user last so that it never points to a document that does not exist yet
+        for collection, model_objects, fields in ((self.exercise_types, exercise_templates, {}),
+                                                  (self.programs, programs, {}),
+                                                  (self.sessions, sessions, {"userId": user.userId})):
+            if model_objects:
+                collection.bulk_write([
+                    ReplaceOne({"_id": model_object.id}, self._to_document(model_object, **fields), upsert=True)
+                    for model_object in model_objects
+                ], ordered=False)
+
+        exercise_template_ids = [exercise_template.id for exercise_template in exercise_templates]
+        self.users.bulk_write([
+            self._user_upsert(user, sessions_written=bool(sessions),
+                              exerciseTypeIds={"$each": exercise_template_ids},
+                              programIds={"$each": [program.id for program in programs]})
+        ])
+        for session in sessions:
+            self._add_to_history(user, session)
+
+    def import_json_storage(self, json_storage: storage.JsonStorage, batch_size: int = 1000) -> None:
+        """Copy every object of a JsonStorage in this database, with one bulk write per batch of documents."""
+
+        def write_in_batches(collection, operations):
+            for start in range(0, len(operations), batch_size):
+                collection.bulk_write(operations[start:start + batch_size], ordered=False)
+
+        write_in_batches(self.exercise_types, [
+            ReplaceOne({"_id": exercise_type.id}, self._to_document(exercise_type), upsert=True)
+            for exercise_type in json_storage.get_all(storage.JsonStorage.DB_KEY_EXERCISE_TYPES)
+        ])
+        write_in_batches(self.programs, [
+            ReplaceOne({"_id": program.id}, self._to_document(program), upsert=True)
+            for program in json_storage.get_all(storage.JsonStorage.DB_KEY_PROGRAMS)
+        ])
+
+        users = list(json_storage.get_all(storage.JsonStorage.DB_KEY_USERS))
+        write_in_batches(self.sessions, [
+            ReplaceOne({"_id": session.id}, self._to_document(session, userId=user.userId), upsert=True)
+            for user in users
+            for session in user.sessions
+        ])
+        write_in_batches(self.users, [
+            self._user_upsert(user, sessions_written=bool(user.sessions),
+                              exerciseTypeIds={"$each": [exercise_type.id for exercise_type in user.exerciseTypes]},
+                              programIds={"$each": [program.id for program in user.programTypes]})
+            for user in users
+        ])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Import a JsonStorage data file into MongoDB")
+    parser.add_argument("json_path", help="JsonStorage data file, e.g. data.json")
+    parser.add_argument("--uri", default=None, help="MongoDB connection string")
+    args = parser.parse_args()
+
+    source = storage.JsonStorage(args.json_path, flush_delay=0)
+    MongoStorage(args.uri).import_json_storage(source)
+
+    print(f"Imported {args.json_path} into MongoDB")
@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+from typing import Iterator
+
+import datamodel
+import migrations
+import storage_codecs
+from storage import JsonStorage
+
+
+class ShardedJsonStorage(JsonStorage):
+    """
+    JsonStorage keeping each user, with its sessions, in its own file.
+
+    The shared catalogs (exercise types and programs) are in `<directory>/catalog.json` and the user files in
+    `<directory>/users/<bucket>/<userId>.json`. A user file is only read the first time the user is accessed.
+
+    Each user has a journal next to its file, `<userId>.json.log`: saving a session appends only that session to the
+    journal of its user (loading the journal adds it to the user), so a save does not depend on the history of the
+    user. The journal is folded into the user file once it holds `compaction_threshold` records.
+
+    The catalog and the user files are data files like the one of JsonStorage: they are encoded by the codec of the
+    storage (which changes their extension) and migrated when they are opened. A file found with another codec is
+    converted, the catalog at startup and a user file the first time it is read.
+    """
+
+    _instance: 'ShardedJsonStorage' = None
+
+    CATALOG_FILE = "catalog.json"
+    USERS_DIRECTORY = "users"
+
+    def __init__(self, directory="data", shard_buckets: int = 256, compaction_threshold: int = 1000,
+                 flush_delay: float = 0.2, flush_max_pending: int = 50, codec: str = None):
+        if getattr(self, "_initialized", False):
+            return
+        self.directory = directory
+        self.shard_buckets = shard_buckets
+
+        self._unloaded_shards: dict[int, str] = {}
+        self._catalog_dirty = False
+        # Sessions that no user references, kept in the catalog
+        self._orphan_session_ids: set[str] = set()
+
+        # Records in the journal of each loaded user
+        self._journal_sizes: dict[int, int] = {}
+        # Encoded records of each user waiting for the next flush
+        self._pending_user_records: dict[int, list[str]] = {}
+        # User of the sessions being saved, and whether the only change of the user is that they are added to it
+        self._session_owner: int | None = None
+        self._only_sessions_added = False
+
+        # The catalog changes rarely and is rewritten as a whole, the journals are those of the users
+        super().__init__(os.path.join(directory, ShardedJsonStorage.CATALOG_FILE), journal=False,
+                         compaction_threshold=compaction_threshold, flush_delay=flush_delay,
+                         flush_max_pending=flush_max_pending, lazy=False, codec=codec)
+
+    def _shard_path(self, user_id: int) -> str:
+        bucket = f"{user_id % self.shard_buckets:02x}"
+        return os.path.join(self.directory, ShardedJsonStorage.USERS_DIRECTORY, bucket,
+                            f"{user_id}{self.codec.extension}")
+
+    def _load(self):
+        os.makedirs(os.path.join(self.directory, ShardedJsonStorage.USERS_DIRECTORY), exist_ok=True)
+
+        # The catalog is created, converted and migrated like the data file of JsonStorage
+        super()._load()
+        self._orphan_session_ids = set(self.data[JsonStorage.DB_KEY_SESSIONS])
+
+        # Only the file names are read at startup. A user saved since the last compaction can only have a journal.
+        for root, _, files in os.walk(os.path.join(self.directory, ShardedJsonStorage.USERS_DIRECTORY)):
+            for file_name in files:
+                if file_name.endswith(".log"):
+                    file_name = file_name[:-len(".log")]
+                codec = storage_codecs.codec_for_path(file_name)
+                user_id = file_name[:-len(codec.extension)]
+                if not file_name.endswith(codec.extension) or not user_id.isdigit():
+                    # Temporary files and backups
+                    continue
+                # After a crash during a conversion both files exist, the converted one is the latest
+                if int(user_id) not in self._unloaded_shards or codec is self.codec:
+                    self._unloaded_shards[int(user_id)] = os.path.join(root, file_name)
+
+    def _load_shard(self, user_id: int, path: str):
+        if os.path.exists(path):
+            if migrations.read_schema_version(path) < JsonStorage.SCHEMA_VERSION:
+                migrations.migrate(path)
+
+            f = open(path, "rb")
+            shard_json = storage_codecs.codec_for_path(path).decode(f.read())
+            f.close()
+
+            # The referenced collections first, so the user references the loaded sessions. A migration can move
+            # objects of the catalog into a user file, they are written back to the catalog.
+            for key in self.data:
+                for json_object in shard_json.get(key, []):
+                    self._replace(self._load_linked(json_object), key)
+                    if key not in (JsonStorage.DB_KEY_SESSIONS, JsonStorage.DB_KEY_USERS):
+                        self._catalog_dirty = True
+
+        self._journal_sizes[user_id] = 0
+        torn_record = self._replay_shard_journal(user_id, path + ".log")
+
+        if path != self._shard_path(user_id):
+            # Converted to the codec of the storage, the old files are kept as a backup
+            self._write_shard(user_id)
+            for converted_path in (path, path + ".log"):
+                if os.path.exists(converted_path):
+                    os.replace(converted_path, converted_path + ".bak")
+        elif torn_record or self._journal_sizes[user_id] >= self.compaction_threshold:
+            # Appending after a torn record would corrupt the next one
+            self._write_shard(user_id)
+
+    def _replay_shard_journal(self, user_id: int, journal_path: str) -> bool:
+        """Apply the records of the journal of a user, True if the last one is torn."""
+        if not os.path.exists(journal_path):
+            return False
+
+        user = None
+        session_ids = set()
+        f = open(journal_path, "r", encoding="utf-8")
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                f.close()
+                return True
+
+            model_object = self._load_linked(record["object"])
+            self._replace(model_object, record["key"])
+            self._journal_sizes[user_id] += 1
+
+            if record["key"] == JsonStorage.DB_KEY_USERS:
+                user = model_object
+                session_ids = {session.id for session in user.sessions}
+            elif record["key"] == JsonStorage.DB_KEY_SESSIONS:
+                # The user record is not written again when a session is added to it, the session is added here.
+                # The user is not returned to anyone before it is loaded, it can still be changed in place.
+                if user is None:
+                    user = self.get_user_from_user_id(user_id)
+                    session_ids = {session.id for session in user.sessions} if user is not None else set()
+                if user is not None and model_object.id not in session_ids:
+                    user.sessions.append(model_object)
+                    session_ids.add(model_object.id)
+        f.close()
+        return False
+
+    def _load_all_shards(self):
+        with self._lock:
+            for user_id in list(self._unloaded_shards):
+                self._load_shard(user_id, self._unloaded_shards.pop(user_id))
+
+    def get_user_from_user_id(self, user_id: int) -> datamodel.User | None:
+        with self._lock:
+            shard_path = self._unloaded_shards.pop(user_id, None)
+            if shard_path is not None:
+                self._load_shard(user_id, shard_path)
+        return super().get_user_from_user_id(user_id)
+
+    def iter_user_ids(self) -> Iterator[int]:
+        # The users not loaded yet are known by the names of their files
+        with self._lock:
+            return iter(sorted(set(self.users_by_user_id) | set(self._unloaded_shards)))
+
+    def get_all(self, json_storage_key: str) -> list[datamodel.JsonSerializable]:
+        if json_storage_key in (JsonStorage.DB_KEY_USERS, JsonStorage.DB_KEY_SESSIONS):
+            self._load_all_shards()
+        return super().get_all(json_storage_key)
+
+    def upcreate_session_and_add_to_user(self, user: datamodel.User, session: datamodel.Session) -> None:
+        with self._lock:
+            self._session_owner = user.userId
+            # A new user is written with its first session
+            self._only_sessions_added = self.get_user_from_user_id(user.userId) is not None
+            try:
+                super().upcreate_session_and_add_to_user(user, session)
+            finally:
+                self._session_owner = None
+                self._only_sessions_added = False
+
+    def upcreate_batch_and_add_to_user(self, user: datamodel.User, exercise_templates: list[datamodel.ExerciseType],
+                                       programs: list[datamodel.Program], sessions: list[datamodel.Session]) -> None:
+        with self._lock:
+            self._session_owner = user.userId
+            try:
+                super().upcreate_batch_and_add_to_user(user, exercise_templates, programs, sessions)
+            finally:
+                self._session_owner = None
+
+    def _persist(self, json_serializable: datamodel.JsonSerializable, json_storage_key: str):
+        if json_storage_key == JsonStorage.DB_KEY_USERS:
+            # Its list of sessions is the only part of a user that grows with the history, a user already saved is not
+            # written again for a session added to it
+            if not self._only_sessions_added:
+                self._add_user_record(json_serializable.userId, json_storage_key, json_serializable)
+        elif json_storage_key == JsonStorage.DB_KEY_SESSIONS:
+            # A session is written in the journal of its user, which it is always saved with. It is flushed with the
+            # write of the user that follows: a compaction in between would write the user without the session.
+            if self._session_owner is not None:
+                self._add_user_record(self._session_owner, json_storage_key, json_serializable)
+            return
+        else:
+            self._catalog_dirty = True
+        super()._persist(json_serializable, json_storage_key)
+
+    def _add_user_record(self, user_id: int, json_storage_key: str, json_serializable: datamodel.JsonSerializable):
+        # The record is encoded right away, later changes of the object must not leak into it
+        record = {"key": json_storage_key, "object": json_serializable.dump(by_reference=True)}
+        self._pending_user_records.setdefault(user_id, []).append(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _save(self):
+        # The catalog is also written when it does not exist yet: created, or converted from another codec
+        if self._catalog_dirty or not os.path.exists(self.path):
+            self._write_data_file(self.path, {
+                JsonStorage.DB_KEY_EXERCISE_TYPES: self.data[JsonStorage.DB_KEY_EXERCISE_TYPES],
+                JsonStorage.DB_KEY_PROGRAMS: self.data[JsonStorage.DB_KEY_PROGRAMS],
+                JsonStorage.DB_KEY_SESSIONS: {
+                    session_id: self.data[JsonStorage.DB_KEY_SESSIONS][session_id]
+                    for session_id in self._orphan_session_ids
+                },
+            })
+            self._catalog_dirty = False
+
+        for user_id, records in self._pending_user_records.items():
+            if self._journal_sizes.get(user_id, 0) + len(records) >= self.compaction_threshold:
+                self._write_shard(user_id)
+            else:
+                self._append_shard_journal(user_id, records)
+        self._pending_user_records.clear()
+
+    def _append_shard_journal(self, user_id: int, records: list[str]):
+        journal_path = self._shard_path(user_id) + ".log"
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        f = open(journal_path, "a", encoding="utf-8")
+        f.write("".join(records))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        self._journal_sizes[user_id] = self._journal_sizes.get(user_id, 0) + len(records)
+
+    def _write_shard(self, user_id: int):
+        """Write the whole user file and empty the journal of the user."""
+        user = self.get_user_from_user_id(user_id)
+        shard_path = self._shard_path(user_id)
+        os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+        # Without user (only sessions before a torn user record) the file is written empty
+        users, sessions = {}, {}
+        if user is not None:
+            users[user.id] = user
+            sessions = {session.id: session for session in user.sessions}
+        self._write_data_file(shard_path, {JsonStorage.DB_KEY_USERS: users, JsonStorage.DB_KEY_SESSIONS: sessions})
+
+        if os.path.exists(shard_path + ".log"):
+            os.remove(shard_path + ".log")
+        self._journal_sizes[user_id] = 0
+
+    def import_json_storage(self, json_storage: JsonStorage):
+        """Copy every object of a single file JsonStorage in this sharded storage."""
+        with self._lock:
+            for key in (JsonStorage.DB_KEY_EXERCISE_TYPES, JsonStorage.DB_KEY_PROGRAMS):
+                for model_object in json_storage.get_all(key):
+                    self._replace(model_object, key)
+
+            sessions_with_user = set()
+            for user in json_storage.get_all(JsonStorage.DB_KEY_USERS):
+                for session in user.sessions:
+                    self._replace(session, JsonStorage.DB_KEY_SESSIONS)
+                    sessions_with_user.add(session.id)
+                self._replace(user, JsonStorage.DB_KEY_USERS)
+                self._write_shard(user.userId)
+
+            for session in json_storage.get_all(JsonStorage.DB_KEY_SESSIONS):
+                if session.id not in sessions_with_user:
+                    self._replace(session, JsonStorage.DB_KEY_SESSIONS)
+                    self._orphan_session_ids.add(session.id)
+
+            self._catalog_dirty = True
+            self._save()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Split a single file JsonStorage into a sharded one")
+    parser.add_argument("json_path", help="JsonStorage data file, e.g. data.json")
+    parser.add_argument("directory", help="Directory of the sharded storage, e.g. data")
+    args = parser.parse_args()
+
+    source = JsonStorage(args.json_path, flush_delay=0)
+    ShardedJsonStorage(args.directory, flush_delay=0).import_json_storage(source)
+
+    print(f"Split {args.json_path} into {args.directory}")
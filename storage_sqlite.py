@@ -0,0 +1,463 @@
+import argparse
+import sqlite3
+import threading
+from typing import Iterator, List
+
+import datamodel
+import history
+import migrations
+import storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exercise_types (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS programs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS exercise_programs (
+    id TEXT PRIMARY KEY,
+    program_id TEXT NOT NULL REFERENCES programs(id),
+    position INTEGER NOT NULL,
+    exercise_type_id TEXT NOT NULL REFERENCES exercise_types(id),
+    rest_time_seconds INTEGER
+);
+CREATE INDEX IF NOT EXISTS exercise_programs_program ON exercise_programs(program_id, position);
+
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL UNIQUE,
+    mention TEXT,
+    history_version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_exercise_types (
+    user_id INTEGER NOT NULL REFERENCES users(user_id),
+    exercise_type_id TEXT NOT NULL REFERENCES exercise_types(id),
+    PRIMARY KEY (user_id, exercise_type_id)
+);
+
+CREATE TABLE IF NOT EXISTS user_programs (
+    user_id INTEGER NOT NULL REFERENCES users(user_id),
+    program_id TEXT NOT NULL REFERENCES programs(id),
+    PRIMARY KEY (user_id, program_id)
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(user_id),
+    program_id TEXT NOT NULL REFERENCES programs(id),
+    date INTEGER
+);
+CREATE INDEX IF NOT EXISTS sessions_user_date ON sessions(user_id, date);
+CREATE INDEX IF NOT EXISTS sessions_program ON sessions(program_id);
+
+CREATE TABLE IF NOT EXISTS exercise_results (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(id),
+    position INTEGER NOT NULL,
+    exercise_program_id TEXT NOT NULL REFERENCES exercise_programs(id),
+    weight REAL,
+    reps INTEGER
+);
+CREATE INDEX IF NOT EXISTS exercise_results_session ON exercise_results(session_id, position);
+CREATE INDEX IF NOT EXISTS exercise_results_exercise_program ON exercise_results(exercise_program_id);
+"""
+
+
+class SqliteStorage(storage.StorageInterface):
+
+    _instance: 'SqliteStorage' = None
+
+    # The database file can be opened by several bot processes, users.history_version is incremented by each write of
+    # the sessions of a user
+    shared = True
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, path="data.sqlite3"):
+        if getattr(self, "_initialized", False):
+            return
+        self.path = path
+
+        # The connection is shared by the storage worker thread and the importer, accesses are serialized by the lock
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        # Declared in the schema but only enforced when enabled, on each connection
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+        # A database created by an older version is migrated, see migrations.py
+        migrations.migrate_sqlite(self.connection)
+        self._initialized = True
+
+    # Reading
+
+    def _load_exercise_types(self, ids: set[str] | None = None) -> dict[str, datamodel.ExerciseType]:
+        if ids is None:
+            rows = self.connection.execute("SELECT id, name FROM exercise_types").fetchall()
+        elif not ids:
+            return {}
+        else:
+            ids = list(ids)
+            placeholders = ",".join("?" * len(ids))
+            rows = self.connection.execute(
+                f"SELECT id, name FROM exercise_types WHERE id IN ({placeholders})", ids).fetchall()
+        exercise_types = {}
+        for exercise_type_id, name in rows:
+            exercise_type = datamodel.ExerciseType(name)
+            exercise_type.id = exercise_type_id
+            exercise_types[exercise_type_id] = exercise_type
+        return exercise_types
+
+    def _load_programs(self, program_ids: list[str] | None = None) -> dict[str, datamodel.Program]:
+        if program_ids is None:
+            program_rows = self.connection.execute("SELECT id, name FROM programs").fetchall()
+            exercise_program_rows = self.connection.execute(
+                "SELECT id, program_id, exercise_type_id, rest_time_seconds FROM exercise_programs "
+                "ORDER BY program_id, position").fetchall()
+        else:
+            placeholders = ",".join("?" * len(program_ids))
+            program_rows = self.connection.execute(
+                f"SELECT id, name FROM programs WHERE id IN ({placeholders})", program_ids).fetchall()
+            exercise_program_rows = self.connection.execute(
+                "SELECT id, program_id, exercise_type_id, rest_time_seconds FROM exercise_programs "
+                f"WHERE program_id IN ({placeholders}) ORDER BY program_id, position", program_ids).fetchall()
+
+        # All the programs reference most exercise types, they are all read without a list of ids
+        exercise_types = self._load_exercise_types(
+            {row[2] for row in exercise_program_rows} if program_ids is not None else None)
+
+        programs = {}
+        for program_id, name in program_rows:
+            program = datamodel.Program(name)
+            program.id = program_id
+            programs[program_id] = program
+
+        for exercise_program_id, program_id, exercise_type_id, rest_time_seconds in exercise_program_rows:
+            exercise_program = datamodel.ExerciseProgram(exercise_types.get(exercise_type_id), rest_time_seconds)
+            exercise_program.id = exercise_program_id
+            programs[program_id].add_exercise_program(exercise_program)
+
+        return programs
+
+    def _load_sessions(self, session_rows: list[tuple]) -> list[datamodel.Session]:
+        programs = self._load_programs(list({row[1] for row in session_rows}))
+        exercise_programs = {
+            exercise_program.id: exercise_program
+            for program in programs.values()
+            for exercise_program in program.exercisePrograms
+        }
+
+        sessions = {}
+        for session_id, program_id, date in session_rows:
+            session = datamodel.Session(programs.get(program_id), date)
+            session.id = session_id
+            sessions[session_id] = session
+
+        if sessions:
+            placeholders = ",".join("?" * len(sessions))
+            result_rows = self.connection.execute(
+                "SELECT id, session_id, exercise_program_id, weight, reps FROM exercise_results "
+                f"WHERE session_id IN ({placeholders}) ORDER BY session_id, position", list(sessions)).fetchall()
+            for result_id, session_id, exercise_program_id, weight, reps in result_rows:
+                exercise = datamodel.Exercise(exercise_programs.get(exercise_program_id), weight, reps)
+                exercise.id = result_id
+                sessions[session_id].results.append(exercise)
+
+        return list(sessions.values())
+
+    def get_exercises_template(self) -> List[datamodel.ExerciseType]:
+        with self._lock:
+            exercise_types = list(self._load_exercise_types().values())
+        exercise_types.sort()
+        return exercise_types
+
+    def get_programs(self) -> List[datamodel.Program]:
+        with self._lock:
+            programs = list(self._load_programs().values())
+        programs.sort()
+        return programs
+
+    def get_user_from_user_id(self, user_id: int) -> datamodel.User | None:
+        with self._lock:
+            row = self.connection.execute("SELECT id, mention FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+
+            user = datamodel.User(user_id, row[1])
+            user.id = row[0]
+
+            exercise_type_ids = {exercise_type_id for (exercise_type_id,) in self.connection.execute(
+                "SELECT exercise_type_id FROM user_exercise_types WHERE user_id = ?", (user_id,))}
+            user.exerciseTypes = list(self._load_exercise_types(exercise_type_ids).values())
+
+            program_ids = [program_id for (program_id,) in self.connection.execute(
+                "SELECT program_id FROM user_programs WHERE user_id = ?", (user_id,))]
+            user.programTypes = list(self._load_programs(program_ids).values())
+
+            session_rows = self.connection.execute(
+                "SELECT id, program_id, date FROM sessions WHERE user_id = ? ORDER BY date", (user_id,)).fetchall()
+            user.sessions = self._load_sessions(session_rows)
+
+        return user
+
+    def _read_history_versions(self, user_id: int = None) -> dict[int, int]:
+        with self._lock:
+            if user_id is None:
+                rows = self.connection.execute("SELECT user_id, history_version FROM users").fetchall()
+            else:
+                rows = self.connection.execute(
+                    "SELECT user_id, history_version FROM users WHERE user_id = ?", (user_id,)).fetchall()
+        return dict(rows)
+
+    def iter_user_ids(self) -> Iterator[int]:
+        with self._lock:
+            rows = self.connection.execute("SELECT user_id FROM users ORDER BY user_id").fetchall()
+        return (user_id for (user_id,) in rows)
+
+    def iter_sessions(self, user_id: int, since: int = None, until: int = None, limit: int = None,
+                      reverse: bool = False, page_size: int = 100) -> Iterator[datamodel.Session]:
+        # Read by pages of the (user_id, date) index, each page starting after the (date, id) of the last session read
+        conditions = ["user_id = ?"]
+        parameters: list = [user_id]
+        if since is not None:
+            conditions.append("date >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("date < ?")
+            parameters.append(until)
+        order = "DESC" if reverse else "ASC"
+
+        last = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_limit = page_size if remaining is None else min(page_size, remaining)
+            page_conditions = list(conditions)
+            page_parameters = list(parameters)
+            if last is not None:
+                # The undated sessions sort first, a comparison with NULL is never true
+                last_date, last_id = last
+                if last_date is None and not reverse:
+                    page_conditions.append("(date IS NOT NULL OR id > ?)")
+                    page_parameters.append(last_id)
+                elif last_date is None:
+                    page_conditions.append("(date IS NULL AND id < ?)")
+                    page_parameters.append(last_id)
+                elif not reverse:
+                    page_conditions.append("(date, id) > (?, ?)")
+                    page_parameters.extend(last)
+                else:
+                    page_conditions.append("((date, id) < (?, ?) OR date IS NULL)")
+                    page_parameters.extend(last)
+
+            with self._lock:
+                session_rows = self.connection.execute(
+                    f"SELECT id, program_id, date FROM sessions WHERE {' AND '.join(page_conditions)} "
+                    f"ORDER BY date {order}, id {order} LIMIT ?", page_parameters + [page_limit]).fetchall()
+                sessions = self._load_sessions(session_rows)
+
+            yield from sessions
+            if len(session_rows) < page_limit:
+                return
+            last = (session_rows[-1][2], session_rows[-1][0])
+            if remaining is not None:
+                remaining -= len(session_rows)
+
+    def _read_history(self, user_id: int, condition: str, parameters: list,
+                      count: int = None) -> history.ExerciseHistory | None:
+        # The `count` most recent results, read backwards on the indexes of the results then put back in date order.
+        # The undated sessions are dated 0 as in the HistoryStore
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT COALESCE(sessions.date, 0), sessions.id, exercise_results.weight, exercise_results.reps "
+                "FROM exercise_results JOIN sessions ON sessions.id = exercise_results.session_id "
+                f"WHERE {condition} AND sessions.user_id = ? "
+                "ORDER BY COALESCE(sessions.date, 0) DESC, sessions.id DESC, exercise_results.position DESC LIMIT ?",
+                parameters + [user_id, -1 if count is None else count]).fetchall()
+        if not rows:
+            return None
+
+        exercise_history = history.ExerciseHistory()
+        session_numbers: dict[str, int] = {}
+        for date, session_id, weight, reps in reversed(rows):
+            session_number = session_numbers.setdefault(session_id, len(session_numbers) + 1)
+            exercise_history.append(date, session_number, weight, reps)
+        return exercise_history
+
+    def get_exercise_history(self, user_id: int, exercise_template_id: str) -> history.ExerciseHistory | None:
+        return self._read_history(
+            user_id, "exercise_results.exercise_program_id IN "
+                     "(SELECT id FROM exercise_programs WHERE exercise_type_id = ?)", [exercise_template_id])
+
+    def get_exercise_program_histories(self, user_id: int, exercise_program_ids: List[str],
+                                       count: int = None) -> dict[str, history.ExerciseHistory]:
+        # One query per exercise program, on the exercise_results_exercise_program index
+        histories = {}
+        for exercise_program_id in exercise_program_ids:
+            exercise_history = self._read_history(
+                user_id, "exercise_results.exercise_program_id = ?", [exercise_program_id], count)
+            if exercise_history is not None:
+                histories[exercise_program_id] = exercise_history
+        return histories
+
+    # Writing
+
+    def _upcreate_user(self, user: datamodel.User):
+        self.connection.execute(
+            "INSERT INTO users (id, user_id, mention) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET mention = excluded.mention",
+            (user.id, user.userId, user.mention))
+
+    def _increment_history_version(self, user_id: int):
+        self.connection.execute("UPDATE users SET history_version = history_version + 1 WHERE user_id = ?", (user_id,))
+
+    # The rows are upserted rather than replaced: INSERT OR REPLACE deletes the row first, which the foreign keys of the
+    # rows referencing it forbid
+
+    def _upcreate_exercise_template(self, exercise_template: datamodel.ExerciseType):
+        self.connection.execute(
+            "INSERT INTO exercise_types (id, name) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET name = excluded.name",
+            (exercise_template.id, exercise_template.name))
+
+    def _upcreate_program(self, program: datamodel.Program):
+        self.connection.execute(
+            "INSERT INTO programs (id, name) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET name = excluded.name",
+            (program.id, program.name))
+        self.connection.executemany(
+            "INSERT INTO exercise_programs (id, program_id, position, exercise_type_id, rest_time_seconds) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET program_id = excluded.program_id, "
+            "position = excluded.position, exercise_type_id = excluded.exercise_type_id, "
+            "rest_time_seconds = excluded.rest_time_seconds",
+            [
+                (exercise_program.id, program.id, position, exercise_program.exerciseTemplate.id,
+                 exercise_program.restTimeSeconds)
+                for position, exercise_program in enumerate(program.exercisePrograms)
+            ])
+        # The exercise programs removed from the program, an exercise program with results cannot be removed
+        exercise_program_ids = [exercise_program.id for exercise_program in program.exercisePrograms]
+        placeholders = ",".join("?" * len(exercise_program_ids))
+        self.connection.execute(
+            f"DELETE FROM exercise_programs WHERE program_id = ? AND id NOT IN ({placeholders})",
+            [program.id] + exercise_program_ids)
+
+    def _upcreate_session(self, user_id: int, session: datamodel.Session):
+        self.connection.execute(
+            "INSERT INTO sessions (id, user_id, program_id, date) VALUES (?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+            "user_id = excluded.user_id, program_id = excluded.program_id, date = excluded.date",
+            (session.id, user_id, session.template.id, session.date))
+        self.connection.execute("DELETE FROM exercise_results WHERE session_id = ?", (session.id,))
+        self.connection.executemany(
+            "INSERT INTO exercise_results (id, session_id, position, exercise_program_id, weight, reps) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (exercise.id, session.id, position, exercise.exerciseProgram.id, exercise.weight, exercise.reps)
+                for position, exercise in enumerate(session.results)
+            ])
+
+    def upcreate_exercise_template_and_add_to_user(self, user: datamodel.User,
+                                                   exercise_template: datamodel.ExerciseType) -> None:
+        with self._lock, self.connection:
+            self._upcreate_exercise_template(exercise_template)
+            self._upcreate_user(user)
+            self.connection.execute(
+                "INSERT OR IGNORE INTO user_exercise_types (user_id, exercise_type_id) VALUES (?, ?)",
+                (user.userId, exercise_template.id))
+
+    def upcreate_program_type_and_add_to_user(self, user: datamodel.User, program_type: datamodel.Program) -> None:
+        with self._lock, self.connection:
+            self._upcreate_program(program_type)
+            self._upcreate_user(user)
+            self.connection.execute(
+                "INSERT OR IGNORE INTO user_programs (user_id, program_id) VALUES (?, ?)",
+                (user.userId, program_type.id))
+
+    def upcreate_session_and_add_to_user(self, user: datamodel.User, session: datamodel.Session) -> None:
+        with self._lock, self.connection:
+            self._upcreate_user(user)
+            self._upcreate_session(user.userId, session)
+            self._increment_history_version(user.userId)
+        self._add_to_history(user, session)
+
+    def upcreate_batch_and_add_to_user(self, user: datamodel.User, exercise_templates: List[datamodel.ExerciseType],
+                                       programs: List[datamodel.Program], sessions: List[datamodel.Session]) -> None:
+        with self._lock, self.connection:
+            self._upcreate_user(user)
+            for exercise_template in exercise_templates:
+                self._upcreate_exercise_template(exercise_template)
+            for program in programs:
+                self._upcreate_program(program)
+            for session in sessions:
+                self._upcreate_session(user.userId, session)
+            if sessions:
+                self._increment_history_version(user.userId)
+
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO user_exercise_types (user_id, exercise_type_id) VALUES (?, ?)",
+                [(user.userId, exercise_template.id) for exercise_template in exercise_templates])
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO user_programs (user_id, program_id) VALUES (?, ?)",
+                [(user.userId, program.id) for program in programs])
+
+        for session in sessions:
+            self._add_to_history(user, session)
+
+    # Import
+
+    def import_json_storage(self, json_storage: storage.JsonStorage) -> int:
+        """Copy every object of a JsonStorage in this database and return the number of skipped orphan sessions."""
+        sessions_with_user = set()
+
+        with self._lock, self.connection:
+            for exercise_template in json_storage.get_all(storage.JsonStorage.DB_KEY_EXERCISE_TYPES):
+                self._upcreate_exercise_template(exercise_template)
+
+            for program in json_storage.get_all(storage.JsonStorage.DB_KEY_PROGRAMS):
+                self._upcreate_program(program)
+
+            for user in json_storage.get_all(storage.JsonStorage.DB_KEY_USERS):
+                self._upcreate_user(user)
+
+                for exercise_template in user.exerciseTypes:
+                    self._upcreate_exercise_template(exercise_template)
+                    self.connection.execute(
+                        "INSERT OR IGNORE INTO user_exercise_types (user_id, exercise_type_id) VALUES (?, ?)",
+                        (user.userId, exercise_template.id))
+
+                for program in user.programTypes:
+                    self._upcreate_program(program)
+                    self.connection.execute(
+                        "INSERT OR IGNORE INTO user_programs (user_id, program_id) VALUES (?, ?)",
+                        (user.userId, program.id))
+
+                for session in user.sessions:
+                    self._upcreate_session(user.userId, session)
+                    sessions_with_user.add(session.id)
+                if user.sessions:
+                    self._increment_history_version(user.userId)
+
+        # Sessions that no user references cannot be stored since a session belongs to a user in the schema
+        return len(set(json_storage.data[storage.JsonStorage.DB_KEY_SESSIONS]) - sessions_with_user)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Import a JsonStorage data file into a SQLite database")
+    parser.add_argument("json_path", help="JsonStorage data file, e.g. data.json")
+    parser.add_argument("sqlite_path", help="SQLite database to fill, e.g. data.sqlite3")
+    args = parser.parse_args()
+
+    source = storage.JsonStorage(args.json_path, flush_delay=0)
+    skipped = SqliteStorage(args.sqlite_path).import_json_storage(source)
+
+    print(f"Imported {args.json_path} into {args.sqlite_path}")
+    if skipped:
+        print(f"Warning : {skipped} session(s) not referenced by any user were skipped.")
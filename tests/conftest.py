@@ -0,0 +1,15 @@
+import pytest
+
+from storage import JsonStorage
+
+
+@pytest.fixture
+def open_json_storage(tmp_path):
+    """Open the JsonStorage of a data file in tmp_path, again at each call as a restart of the bot would."""
+
+    def open_storage(**kwargs) -> JsonStorage:
+        JsonStorage._instance = None
+        return JsonStorage(str(tmp_path / "data.json"), flush_delay=0, **kwargs)
+
+    yield open_storage
+    JsonStorage._instance = None
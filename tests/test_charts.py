@@ -0,0 +1,19 @@
+import charts
+
+
+def test_older_charts_of_the_same_formula_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(charts, "CHART_DIRECTORY", str(tmp_path))
+    names = [
+        "1-squat-s1-10-epley.png",
+        "1-squat-s1-10-brzycki.png",
+        "1-bench-s1-10-epley.png",
+        "2-squat-s1-10-epley.png",
+    ]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+    new_path = charts.chart_path(1, "squat", "s2", 11, "epley")
+    open(new_path, "wb").close()
+
+    charts._remove_older_charts(new_path, 1, "squat", "epley")
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(names[1:] + ["1-squat-s2-11-epley.png"])
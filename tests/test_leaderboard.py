@@ -0,0 +1,137 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import datamodel
+import leaderboard
+import records
+from leaderboard import ALL_TIME, BEST_E1RM, MONTH, SESSIONS, VOLUME, WEEK, LeaderboardStore
+
+DAY = 24 * 3600
+
+SQUAT = datamodel.ExerciseType("squat")
+SQUAT_PROGRAM = datamodel.ExerciseProgram(SQUAT, 90)
+LEGS = datamodel.Program("legs")
+LEGS.add_exercise_program(SQUAT_PROGRAM)
+
+
+def squat_session(date: int, weight: float, reps: int, session_id: str = None) -> datamodel.Session:
+    session = datamodel.Session(LEGS, date)
+    if session_id is not None:
+        session.id = session_id
+    session.add_exercise_result(datamodel.Exercise(SQUAT_PROGRAM, weight, reps))
+    return session
+
+
+class Users:
+    """The users of a storage, counting the reads of the leaderboard store."""
+
+    def __init__(self):
+        self.users: dict[int, datamodel.User] = {}
+        self.reads = 0
+
+    def add_session(self, user_id: int, session: datamodel.Session):
+        user = self.users.setdefault(user_id, datamodel.User(user_id, f"<@{user_id}>"))
+        user.sessions = [saved for saved in user.sessions if saved.id != session.id] + [session]
+
+    def get_user(self, user_id: int) -> datamodel.User | None:
+        self.reads += 1
+        return self.users.get(user_id)
+
+    def store(self) -> LeaderboardStore:
+        return LeaderboardStore(self.get_user, lambda: iter(sorted(self.users)))
+
+
+def timestamp(*date) -> int:
+    return int(datetime(*date, tzinfo=timezone.utc).timestamp())
+
+
+def test_bucket_start():
+    wednesday = timestamp(2025, 1, 15, 18, 30)
+    assert leaderboard.bucket_start(WEEK, wednesday) == timestamp(2025, 1, 13)
+    assert leaderboard.bucket_start(MONTH, wednesday) == timestamp(2025, 1, 1)
+    assert leaderboard.bucket_start(ALL_TIME, wednesday) == 0
+    assert leaderboard.bucket_start(WEEK, None) == 0
+
+
+def test_rankings_of_each_metric():
+    now = int(time.time())
+    users = Users()
+    users.add_session(1, squat_session(now, 100, 5))
+    users.add_session(1, squat_session(now, 110, 3))
+    users.add_session(2, squat_session(now, 120, 1))
+    store = users.store()
+
+    best_of_1 = max(records.estimate_1rm(100, 5), records.estimate_1rm(110, 3))
+    assert store.get_ranking(SQUAT.id, BEST_E1RM, ALL_TIME, now=now) == [(1, best_of_1), (2, 120)]
+    assert store.get_ranking(SQUAT.id, VOLUME, ALL_TIME, now=now) == [(1, 830), (2, 120)]
+    assert store.get_ranking(SQUAT.id, SESSIONS, ALL_TIME, now=now) == [(1, 2), (2, 1)]
+    assert store.get_ranking(SQUAT.id, VOLUME, ALL_TIME, member_ids={2}, now=now) == [(2, 120)]
+    assert store.get_ranking(SQUAT.id, VOLUME, ALL_TIME, count=1, now=now) == [(1, 830)]
+    assert store.get_ranking("unknown", VOLUME, ALL_TIME, now=now) == []
+
+
+def test_week_rollover_drops_the_previous_week():
+    now = int(time.time())
+    this_week = leaderboard.bucket_start(WEEK, now)
+    last_week = this_week - 7 * DAY
+    users = Users()
+    users.add_session(1, squat_session(last_week + DAY, 100, 5))
+    store = users.store()
+
+    assert store.get_ranking(SQUAT.id, VOLUME, WEEK, now=last_week + 2 * DAY) == [(1, 500)]
+    assert last_week in store._boards[WEEK]
+
+    # The week is over: its boards are dropped, the all time ones keep the session
+    assert store.get_ranking(SQUAT.id, VOLUME, WEEK, now=now) == []
+    assert last_week not in store._boards[WEEK]
+    assert store.get_ranking(SQUAT.id, VOLUME, ALL_TIME, now=now) == [(1, 500)]
+
+
+def test_sessions_of_the_next_bucket_fill_its_boards_before_the_rollover():
+    now = int(time.time())
+    next_week = leaderboard.bucket_start(WEEK, now) + 7 * DAY
+    users = Users()
+    users.add_session(1, squat_session(now, 100, 5))
+    store = users.store()
+    assert store.get_ranking(SQUAT.id, VOLUME, WEEK, now=now) == [(1, 500)]
+    reads = users.reads
+
+    session = squat_session(next_week + DAY, 80, 10)
+    users.add_session(2, session)
+    store.add_session(2, session)
+    assert store.get_ranking(SQUAT.id, VOLUME, WEEK, now=now) == [(1, 500)]
+
+    # Nothing is read again when the week rolls over
+    assert store.get_ranking(SQUAT.id, VOLUME, WEEK, now=next_week) == [(2, 800)]
+    assert users.reads == reads
+
+
+def test_session_saved_again_rebuilds_its_user():
+    now = int(time.time())
+    users = Users()
+    users.add_session(1, squat_session(now, 100, 5, session_id="session"))
+    users.add_session(2, squat_session(now, 90, 5))
+    store = users.store()
+    assert store.get_ranking(SQUAT.id, BEST_E1RM, ALL_TIME, now=now)[0][0] == 1
+
+    # A score is never lowered in place, the corrected session replaces the wrong one
+    corrected = squat_session(now, 60, 5, session_id="session")
+    users.add_session(1, corrected)
+    store.add_session(1, corrected)
+    assert store.get_ranking(SQUAT.id, BEST_E1RM, ALL_TIME, now=now) == [
+        (2, pytest.approx(records.estimate_1rm(90, 5))), (1, pytest.approx(records.estimate_1rm(60, 5)))]
+    assert store.get_ranking(SQUAT.id, SESSIONS, ALL_TIME, now=now) == [(1, 1), (2, 1)]
+
+
+def test_top_is_completed_from_the_scores_when_members_are_missing(monkeypatch):
+    monkeypatch.setattr(leaderboard, "TOP_SIZE", 2)
+    now = int(time.time())
+    users = Users()
+    for user_id, weight in ((1, 100), (2, 90), (3, 80), (4, 70)):
+        users.add_session(user_id, squat_session(now, weight, 1))
+    store = users.store()
+
+    assert store.get_ranking(SQUAT.id, VOLUME, ALL_TIME, member_ids={3, 4}, now=now) == [(3, 80), (4, 70)]
+    assert len(store._boards[ALL_TIME][0][(SQUAT.id, VOLUME)].top) == 2
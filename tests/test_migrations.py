@@ -0,0 +1,128 @@
+import json
+import shutil
+
+import pytest
+
+import datamodel
+import migrations
+from storage import JsonStorage
+
+
+class Crash(Exception):
+    pass
+
+
+def make_user(user_id: int, dates: list[int]) -> datamodel.User:
+    squat = datamodel.ExerciseType("squat")
+    bench = datamodel.ExerciseType("bench")
+    program = datamodel.Program("full body")
+    for exercise_type in (squat, bench):
+        program.add_exercise_program(datamodel.ExerciseProgram(exercise_type, 90))
+
+    user = datamodel.User(user_id, f"<@{user_id}>")
+    user.exerciseTypes = [squat, bench]
+    user.programTypes = [program]
+    for date in dates:
+        session = datamodel.Session(program, date)
+        for position, exercise_program in enumerate(program.exercisePrograms):
+            session.add_exercise_result(datamodel.Exercise(exercise_program, 100 + position, 5))
+        user.sessions.append(session)
+    return user
+
+
+def write_v0_data_file(path: str, users: list[datamodel.User]):
+    """A data file of schema version 0: the linked objects embedded and the session dates as ISO strings."""
+
+    def legacy_dump(model_object: datamodel.JsonSerializable) -> str:
+        raw = model_object.dump()
+        for session in raw.get("sessions", [raw]):
+            if session["_class"] == "Session":
+                session["date"] = datamodel.from_timestamp(session["date"]).isoformat()
+        return json.dumps(raw, separators=(",", ":"))
+
+    collections = {
+        JsonStorage.DB_KEY_EXERCISE_TYPES: [exercise_type for user in users for exercise_type in user.exerciseTypes],
+        JsonStorage.DB_KEY_PROGRAMS: [program for user in users for program in user.programTypes],
+        JsonStorage.DB_KEY_USERS: users,
+        JsonStorage.DB_KEY_SESSIONS: [session for user in users for session in user.sessions],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        f.write(",\n".join(
+            json.dumps(key) + ": [\n" + ",\n".join(legacy_dump(model_object) for model_object in model_objects) + "\n]"
+            for key, model_objects in collections.items()
+        ))
+        f.write("\n}\n")
+
+
+@pytest.fixture
+def v0_users() -> list[datamodel.User]:
+    return [make_user(user_id, [1_700_000_000 + day * 86400 for day in range(6)]) for user_id in (1, 2)]
+
+
+def test_v0_data_file_is_migrated_to_the_latest_version(tmp_path, v0_users, open_json_storage):
+    path = str(tmp_path / "data.json")
+    write_v0_data_file(path, v0_users)
+    original = (tmp_path / "data.json").read_bytes()
+
+    assert migrations.migrate(path) == migrations.LATEST_VERSION
+    assert migrations.read_schema_version(path) == migrations.LATEST_VERSION
+    assert (tmp_path / "data.json.v0.bak").read_bytes() == original
+
+    json_storage = open_json_storage()
+    for user in v0_users:
+        stored = json_storage.get_user_from_user_id(user.userId)
+        assert stored.id == user.id
+        assert [exercise_type.id for exercise_type in stored.exerciseTypes] == [t.id for t in user.exerciseTypes]
+        assert [program.id for program in stored.programTypes] == [program.id for program in user.programTypes]
+        assert [session.id for session in stored.sessions] == [session.id for session in user.sessions]
+        assert [session.date for session in stored.sessions] == [session.date for session in user.sessions]
+        stored_results = [(e.exerciseProgram.id, e.weight, e.reps) for s in stored.sessions for e in s.results]
+        assert stored_results == [(e.exerciseProgram.id, e.weight, e.reps) for s in user.sessions for e in s.results]
+        # The embedded copies became references to the objects of the store
+        assert stored.sessions[0].template is stored.programTypes[0]
+
+
+@pytest.mark.parametrize("crashing_migration", migrations.MIGRATIONS)
+def test_interrupted_migration_resumes_to_the_same_file(tmp_path, v0_users, monkeypatch, crashing_migration):
+    uninterrupted_path = str(tmp_path / "uninterrupted.json")
+    path = str(tmp_path / "data.json")
+    write_v0_data_file(uninterrupted_path, v0_users)
+    shutil.copyfile(uninterrupted_path, path)
+    migrations.migrate(uninterrupted_path, checkpoint_every=3)
+
+    # The process dies in the middle of the rewrite of crashing_migration, after a few checkpoints
+    apply = crashing_migration.apply
+    applied = 0
+
+    def crashing_apply(self, key: str, raw: dict) -> dict:
+        nonlocal applied
+        applied += 1
+        if applied == 10:
+            raise Crash()
+        return apply(self, key, raw)
+
+    monkeypatch.setattr(crashing_migration, "apply", crashing_apply)
+    with pytest.raises(Crash):
+        migrations.migrate(path, checkpoint_every=3)
+    monkeypatch.setattr(crashing_migration, "apply", apply)
+
+    checkpoint = json.loads((tmp_path / "data.json.migration").read_text(encoding="utf-8"))
+    assert checkpoint["version"] == crashing_migration.version
+    assert checkpoint["offset"] > 0
+    assert migrations.read_schema_version(path) == crashing_migration.version - 1
+
+    # Run again, the records up to the checkpoint are not written again
+    resume_offsets = []
+
+    class LineWriter(migrations._LineWriter):
+        def __init__(self, f, version: int, resume_offset: int = 0):
+            super().__init__(f, version, resume_offset)
+            resume_offsets.append(resume_offset)
+
+    monkeypatch.setattr(migrations, "_LineWriter", LineWriter)
+    assert migrations.migrate(path, checkpoint_every=3) == migrations.LATEST_VERSION
+    assert resume_offsets[0] == checkpoint["offset"]
+    assert (tmp_path / "data.json").read_bytes() == (tmp_path / "uninterrupted.json").read_bytes()
+    assert not (tmp_path / "data.json.migration").exists()
+    assert not (tmp_path / "data.json.migrating").exists()
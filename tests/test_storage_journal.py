@@ -0,0 +1,114 @@
+import copy
+import json
+import os
+
+import datamodel
+from storage import JsonStorage
+
+
+def read_journal(storage: JsonStorage) -> list[dict]:
+    with open(storage.journal_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def exercise_names(storage: JsonStorage) -> list[str]:
+    return [exercise_type.name for exercise_type in storage.get_exercises_template()]
+
+
+def add_exercise(storage: JsonStorage, user_id: int, name: str) -> datamodel.ExerciseType:
+    user = storage.get_user_from_user_id(user_id) or datamodel.User(user_id, f"<@{user_id}>")
+    exercise_type = datamodel.ExerciseType(name)
+    storage.upcreate_exercise_template_and_add_to_user(user, exercise_type)
+    return exercise_type
+
+
+def test_writes_are_appended_to_the_journal(open_json_storage):
+    storage = open_json_storage()
+    data_file_size = os.path.getsize(storage.path)
+
+    add_exercise(storage, 1, "squat")
+
+    keys = [record["key"] for record in read_journal(storage)]
+    assert keys == [JsonStorage.DB_KEY_EXERCISE_TYPES, JsonStorage.DB_KEY_USERS]
+    assert os.path.getsize(storage.path) == data_file_size
+
+
+def test_replay_applies_the_records_in_order(open_json_storage):
+    storage = open_json_storage()
+    squat = add_exercise(storage, 1, "squat")
+    renamed = copy.copy(squat)
+    renamed.name = "front squat"
+    storage.upcreate_json_serializable(renamed, JsonStorage.DB_KEY_EXERCISE_TYPES)
+
+    program = datamodel.Program("legs")
+    program.add_exercise_program(datamodel.ExerciseProgram(renamed, 90))
+    storage.upcreate_program_type_and_add_to_user(storage.get_user_from_user_id(1), program)
+    storage.upcreate_session_and_add_to_user(storage.get_user_from_user_id(1), datamodel.Session(program, 1000))
+
+    storage = open_json_storage()
+
+    # The later record of an object wins, and every reference is linked to the replayed instance
+    assert exercise_names(storage) == ["front squat"]
+    user = storage.get_user_from_user_id(1)
+    assert user.exerciseTypes[0] is storage.get_exercises_template()[0]
+    assert user.sessions[0].template is user.programTypes[0]
+    assert user.programTypes[0].exercisePrograms[0].exerciseTemplate is user.exerciseTypes[0]
+
+
+def test_torn_last_record_is_dropped_and_compacted(open_json_storage):
+    storage = open_json_storage()
+    add_exercise(storage, 1, "squat")
+    # Crash during an append
+    with open(storage.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"key":"exerciseTypes","object":{"_class":"Exerc')
+
+    storage = open_json_storage()
+    assert exercise_names(storage) == ["squat"]
+    assert not os.path.exists(storage.journal_path)
+    assert storage.journal_size == 0
+
+    # The next records go to a clean journal
+    add_exercise(storage, 1, "bench")
+    storage = open_json_storage()
+    assert exercise_names(storage) == ["bench", "squat"]
+
+
+def test_journal_is_compacted_at_the_threshold(open_json_storage):
+    storage = open_json_storage(compaction_threshold=4)
+    add_exercise(storage, 1, "squat")
+    assert storage.journal_size == 2
+    assert len(read_journal(storage)) == 2
+
+    add_exercise(storage, 1, "bench")
+    assert storage.journal_size == 0
+    assert not os.path.exists(storage.journal_path)
+
+    storage = open_json_storage(compaction_threshold=4)
+    assert exercise_names(storage) == ["bench", "squat"]
+    user = storage.get_user_from_user_id(1)
+    assert [exercise_type.name for exercise_type in user.exerciseTypes] == ["squat", "bench"]
+
+
+def test_replay_compacts_a_journal_over_the_threshold(open_json_storage):
+    storage = open_json_storage()
+    for name in ("squat", "bench", "deadlift"):
+        add_exercise(storage, 1, name)
+    assert storage.journal_size == 6
+
+    storage = open_json_storage(compaction_threshold=4)
+    assert not os.path.exists(storage.journal_path)
+    assert exercise_names(storage) == ["bench", "deadlift", "squat"]
+
+
+def test_group_commit_appends_the_pending_records_at_once(tmp_path):
+    JsonStorage._instance = None
+    storage = JsonStorage(str(tmp_path / "data.json"), flush_delay=60, flush_max_pending=50)
+    try:
+        add_exercise(storage, 1, "squat")
+        assert not os.path.exists(storage.journal_path)
+
+        storage.flush()
+        assert len(read_journal(storage)) == 2
+    finally:
+        storage.flush()
+        JsonStorage._instance = None
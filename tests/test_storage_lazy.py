@@ -0,0 +1,96 @@
+import json
+
+import datamodel
+from storage import _ID_PATTERN, _USER_ID_PATTERN, JsonStorage, _LazyEntry
+
+
+def save_user(storage: JsonStorage, user_id: int, exercise_name: str) -> datamodel.User:
+    user = datamodel.User(user_id, f"<@{user_id}>")
+    exercise_type = datamodel.ExerciseType(exercise_name)
+    program = datamodel.Program(f"{exercise_name} day")
+    exercise_program = datamodel.ExerciseProgram(exercise_type, 90)
+    program.add_exercise_program(exercise_program)
+    session = datamodel.Session(program, 1000)
+    session.add_exercise_result(datamodel.Exercise(exercise_program, 100, 5))
+    storage.upcreate_batch_and_add_to_user(user, [exercise_type], [program], [session])
+    return storage.get_user_from_user_id(user_id)
+
+
+def test_id_patterns_match_the_object_of_the_line():
+    exercise_type = datamodel.ExerciseType("squat")
+    program = datamodel.Program("legs")
+    exercise_program = datamodel.ExerciseProgram(exercise_type, 90)
+    program.add_exercise_program(exercise_program)
+    session = datamodel.Session(program, 1000)
+    session.add_exercise_result(datamodel.Exercise(exercise_program, 100, 5))
+    user = datamodel.User(-42, "<@-42>")
+    user.sessions.append(session)
+
+    # The nested objects have ids too, the first one of a line is the id of its object
+    for model_object in (program, session, user):
+        line = json.dumps(model_object.dump(by_reference=True), separators=(",", ":")).encode()
+        assert _ID_PATTERN.search(line).group(1).decode() == model_object.id
+    user_line = json.dumps(user.dump(by_reference=True), separators=(",", ":")).encode()
+    assert int(_USER_ID_PATTERN.search(user_line).group(1)) == -42
+
+
+def test_objects_are_loaded_when_first_accessed(open_json_storage):
+    storage = open_json_storage()
+    saved = save_user(storage, 1, "squat")
+    storage.compact()
+
+    storage = open_json_storage()
+    user_object_id = storage.users_by_user_id[1]
+    assert isinstance(storage.data[JsonStorage.DB_KEY_USERS][user_object_id], _LazyEntry)
+    assert isinstance(storage.data[JsonStorage.DB_KEY_SESSIONS][saved.sessions[0].id], _LazyEntry)
+
+    user = storage.get_user_from_user_id(1)
+    assert storage.data[JsonStorage.DB_KEY_USERS][user_object_id] is user
+    # Its references are loaded with it, as the objects of their collections
+    assert user.sessions[0] is storage.data[JsonStorage.DB_KEY_SESSIONS][saved.sessions[0].id]
+    assert user.sessions[0].results[0].weight == 100
+    assert user.sessions[0].template is user.programTypes[0]
+
+
+def test_lazy_entries_are_reloaded_after_compaction(open_json_storage):
+    storage = open_json_storage()
+    save_user(storage, 1, "squat")
+    save_user(storage, 2, "bench")
+    storage.compact()
+
+    storage = open_json_storage()
+    # User 2 is saved again while user 1 is left unloaded: the compaction copies its line and moves its entry
+    user = storage.get_user_from_user_id(2)
+    storage.upcreate_exercise_template_and_add_to_user(user, datamodel.ExerciseType("dips"))
+    old_entry = storage.data[JsonStorage.DB_KEY_USERS][storage.users_by_user_id[1]]
+    storage.compact()
+
+    new_entry = storage.data[JsonStorage.DB_KEY_USERS][storage.users_by_user_id[1]]
+    assert isinstance(new_entry, _LazyEntry)
+    assert new_entry != old_entry
+
+    user = storage.get_user_from_user_id(1)
+    assert user.userId == 1
+    assert [exercise_type.name for exercise_type in user.exerciseTypes] == ["squat"]
+    assert user.sessions[0].results[0].exerciseProgram.exerciseTemplate is user.exerciseTypes[0]
+
+    storage = open_json_storage()
+    user = storage.get_user_from_user_id(2)
+    assert [exercise_type.name for exercise_type in user.exerciseTypes] == ["bench", "dips"]
+
+
+def test_data_file_of_another_format_is_loaded_then_rewritten(open_json_storage):
+    storage = open_json_storage()
+    saved = save_user(storage, 1, "squat")
+    storage.compact()
+    # Same document, not one line per object
+    with open(storage.path, "r", encoding="utf-8") as f:
+        document = json.load(f)
+    with open(storage.path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2)
+
+    storage = open_json_storage()
+    assert storage.get_user_from_user_id(1).sessions[0].id == saved.sessions[0].id
+
+    storage = open_json_storage()
+    assert isinstance(storage.data[JsonStorage.DB_KEY_USERS][storage.users_by_user_id[1]], _LazyEntry)
@@ -0,0 +1,134 @@
+import mongomock
+import pymongo
+import pytest
+
+import datamodel
+from storage_mongo import MongoStorage, ReplaceOne
+
+
+@pytest.fixture
+def mongo_storage():
+    client = mongomock.MongoClient()
+    try:
+        client.probe.probe.bulk_write([ReplaceOne({"_id": 0}, {}, upsert=True)])
+    except TypeError:
+        # mongomock 4.3 predates the sort option of the bulk operations of pymongo 4.11, see the pins of pyproject.toml
+        pytest.fail(f"mongomock {mongomock.__version__} does not support the bulk operations of pymongo "
+                    f"{pymongo.version}, install the versions pinned in pyproject.toml")
+    client.drop_database("probe")
+
+    MongoStorage._instance = None
+    yield MongoStorage(client=client)
+    MongoStorage._instance = None
+
+
+def make_batch(dates: list[int]) -> tuple[list, list, list]:
+    squat = datamodel.ExerciseType("squat")
+    exercise_program = datamodel.ExerciseProgram(squat, 90)
+    program = datamodel.Program("legs")
+    program.add_exercise_program(exercise_program)
+    sessions = []
+    for date in dates:
+        session = datamodel.Session(program, date)
+        session.add_exercise_result(datamodel.Exercise(exercise_program, 100, 5))
+        sessions.append(session)
+    return [squat], [program], sessions
+
+
+def test_batch_is_upserted_once(mongo_storage):
+    user = datamodel.User(1, "<@1>")
+    exercise_types, programs, sessions = make_batch([3000, 1000, 2000])
+
+    mongo_storage.upcreate_batch_and_add_to_user(user, exercise_types, programs, sessions)
+    # Imported again: every document is replaced, the user lists get no duplicate
+    mongo_storage.upcreate_batch_and_add_to_user(user, exercise_types, programs, sessions)
+
+    assert mongo_storage.users.count_documents({}) == 1
+    assert mongo_storage.sessions.count_documents({"userId": 1}) == 3
+    user_document = mongo_storage.users.find_one({"userId": 1})
+    assert user_document["exerciseTypeIds"] == [exercise_types[0].id]
+    assert user_document["programIds"] == [programs[0].id]
+
+    stored = mongo_storage.get_user_from_user_id(1)
+    assert stored.id == user.id
+    assert [exercise_type.name for exercise_type in stored.exerciseTypes] == ["squat"]
+    assert [session.date for session in stored.sessions] == [1000, 2000, 3000]
+    assert stored.sessions[0].results[0].weight == 100
+    assert [program.name for program in mongo_storage.get_programs()] == ["legs"]
+
+
+def test_session_is_added_to_its_user(mongo_storage):
+    user = datamodel.User(1, "<@1>")
+    exercise_types, programs, sessions = make_batch([1000, 2000])
+    mongo_storage.upcreate_exercise_template_and_add_to_user(user, exercise_types[0])
+    mongo_storage.upcreate_program_type_and_add_to_user(user, programs[0])
+    for session in sessions:
+        mongo_storage.upcreate_session_and_add_to_user(user, session)
+    mongo_storage.upcreate_session_and_add_to_user(user, sessions[0])
+
+    stored = mongo_storage.get_user_from_user_id(1)
+    assert [session.id for session in stored.sessions] == [session.id for session in sessions]
+    assert list(mongo_storage.iter_user_ids()) == [1]
+    assert mongo_storage.get_user_from_user_id(2) is None
+
+
+def test_iter_sessions(mongo_storage):
+    user = datamodel.User(1, "<@1>")
+    _, _, sessions = make_batch([1000, 2000, 2000, 3000, 4000])
+    mongo_storage.upcreate_batch_and_add_to_user(user, [], [], sessions)
+    mongo_storage.upcreate_batch_and_add_to_user(datamodel.User(2, "<@2>"), [], [], make_batch([2500])[2])
+
+    def dates(**kwargs) -> list[int]:
+        return [session.date for session in mongo_storage.iter_sessions(1, **kwargs)]
+
+    assert dates() == [1000, 2000, 2000, 3000, 4000]
+    assert dates(since=2000, until=4000) == [2000, 2000, 3000]
+    assert dates(limit=2, reverse=True) == [4000, 3000]
+    assert dates(since=2000, limit=2) == [2000, 2000]
+    assert dates(limit=0) == []
+
+    # Sessions of the same date come by id, in both directions
+    same_date = [session.id for session in mongo_storage.iter_sessions(1, since=2000, until=3000)]
+    assert same_date == sorted(same_date)
+    reversed_same_date = mongo_storage.iter_sessions(1, since=2000, until=3000, reverse=True)
+    assert [session.id for session in reversed_same_date] == same_date[::-1]
+
+
+def test_import_json_storage(mongo_storage, open_json_storage):
+    json_storage = open_json_storage()
+    exercise_types, programs, sessions = make_batch([1000, 2000])
+    json_storage.upcreate_batch_and_add_to_user(datamodel.User(1, "<@1>"), exercise_types, programs, sessions)
+
+    mongo_storage.import_json_storage(json_storage, batch_size=1)
+
+    stored = mongo_storage.get_user_from_user_id(1)
+    assert [session.id for session in stored.sessions] == [session.id for session in sessions]
+    assert [program.id for program in stored.programTypes] == [programs[0].id]
+    assert [exercise_type.id for exercise_type in stored.exerciseTypes] == [exercise_types[0].id]
+
+
+def test_caches_see_the_sessions_of_other_processes(mongo_storage):
+    user = datamodel.User(1, "<@1>")
+    exercise_types, programs, sessions = make_batch([1000, 2000])
+    squat_id = exercise_types[0].id
+    sessions[1].results[0].weight = 120
+    mongo_storage.upcreate_batch_and_add_to_user(user, exercise_types, programs, sessions[:1])
+    # Every cache is built by this process
+    assert len(mongo_storage.get_exercise_history(1, squat_id)) == 1
+    assert mongo_storage.get_personal_records(1, [squat_id])[squat_id].heaviest_weight == 100
+    assert mongo_storage.get_leaderboard(squat_id, "sessions", "all_time") == [(1, 1)]
+    version = mongo_storage.get_history_version(1)
+
+    # Another bot process sharing the database saves a session, then a new user
+    MongoStorage._instance = None
+    other_process = MongoStorage(client=mongo_storage.client)
+    other_process.upcreate_session_and_add_to_user(user, sessions[1])
+    new_user_session = datamodel.Session(programs[0], 3000)
+    new_user_session.add_exercise_result(datamodel.Exercise(programs[0].exercisePrograms[0], 100, 5))
+    other_process.upcreate_session_and_add_to_user(datamodel.User(2, "<@2>"), new_user_session)
+
+    assert mongo_storage.get_history_version(1) != version
+    assert len(mongo_storage.get_exercise_history(1, squat_id)) == 2
+    assert mongo_storage.get_last_session_id(1, squat_id) == sessions[1].id
+    assert mongo_storage.get_personal_records(1, [squat_id])[squat_id].heaviest_weight == 120
+    assert mongo_storage.get_leaderboard(squat_id, "sessions", "all_time") == [(1, 2), (2, 1)]
@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+
+import datamodel
+import migrations
+import storage
+from storage_sqlite import SqliteStorage
+
+
+@pytest.fixture
+def open_sqlite_storage(tmp_path):
+    """Open the SqliteStorage of a database in tmp_path, again at each call as another bot process would."""
+    connections = []
+
+    def open_storage() -> SqliteStorage:
+        SqliteStorage._instance = None
+        sqlite_storage = SqliteStorage(str(tmp_path / "data.sqlite3"))
+        connections.append(sqlite_storage.connection)
+        return sqlite_storage
+
+    yield open_storage
+    SqliteStorage._instance = None
+    for connection in connections:
+        connection.close()
+
+
+def make_sessions(dates: list[int]) -> tuple[datamodel.ExerciseType, datamodel.Program, list[datamodel.Session]]:
+    squat = datamodel.ExerciseType("squat")
+    exercise_program = datamodel.ExerciseProgram(squat, 90)
+    program = datamodel.Program("legs")
+    program.add_exercise_program(exercise_program)
+    sessions = []
+    for date in dates:
+        session = datamodel.Session(program, date)
+        session.add_exercise_result(datamodel.Exercise(exercise_program, 100, 5))
+        sessions.append(session)
+    return squat, program, sessions
+
+
+def test_caches_see_the_sessions_of_other_processes(open_sqlite_storage):
+    sqlite_storage = open_sqlite_storage()
+    user = datamodel.User(1, "<@1>")
+    squat, program, sessions = make_sessions([1000, 2000])
+    sessions[1].results[0].weight = 120
+    sqlite_storage.upcreate_batch_and_add_to_user(user, [squat], [program], sessions[:1])
+    assert len(sqlite_storage.get_exercise_histories(1)[squat.id]) == 1
+    assert sqlite_storage.get_personal_records(1, [squat.id])[squat.id].heaviest_weight == 100
+    assert sqlite_storage.get_leaderboard(squat.id, "sessions", "all_time") == [(1, 1)]
+    version = sqlite_storage.get_history_version(1)
+
+    other_process = open_sqlite_storage()
+    other_process.upcreate_session_and_add_to_user(user, sessions[1])
+
+    assert sqlite_storage.get_history_version(1) != version
+    assert len(sqlite_storage.get_exercise_histories(1)[squat.id]) == 2
+    assert sqlite_storage.get_last_session_id(1, squat.id) == sessions[1].id
+    assert sqlite_storage.get_personal_records(1, [squat.id])[squat.id].heaviest_weight == 120
+    assert sqlite_storage.get_leaderboard(squat.id, "sessions", "all_time") == [(1, 2)]
+
+
+def test_history_versions_are_added_to_an_older_database(tmp_path):
+    path = str(tmp_path / "data.sqlite3")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE users (id TEXT PRIMARY KEY, user_id INTEGER NOT NULL UNIQUE, mention TEXT)")
+    connection.execute("INSERT INTO users (id, user_id, mention) VALUES ('u1', 1, '<@1>')")
+    connection.execute("PRAGMA user_version = 1")
+    connection.commit()
+
+    assert migrations.migrate_sqlite(connection) == migrations.SQLITE_LATEST_VERSION
+    assert connection.execute("SELECT user_id, history_version FROM users").fetchall() == [(1, 0)]
+    connection.close()
+
+
+def test_histories_are_read_with_sql(open_sqlite_storage):
+    sqlite_storage = open_sqlite_storage()
+    user = datamodel.User(1, "<@1>")
+    squat, program, sessions = make_sessions([3000, 1000, 2000, 4000])
+    exercise_program = program.exercisePrograms[0]
+    for position, session in enumerate(sessions):
+        session.results[0].weight = 110 + position
+    sqlite_storage.upcreate_batch_and_add_to_user(user, [squat], [program], sessions)
+    # Results of another user for the same exercise program
+    other_session = datamodel.Session(program, 2500)
+    other_session.add_exercise_result(datamodel.Exercise(exercise_program, 200, 1))
+    sqlite_storage.upcreate_session_and_add_to_user(datamodel.User(2, "<@2>"), other_session)
+
+    exercise_history = sqlite_storage.get_exercise_history(1, squat.id)
+    assert list(exercise_history.timestamps) == [1000, 2000, 3000, 4000]
+    assert list(exercise_history.weights) == [111, 112, 110, 113]
+    assert list(exercise_history.sessions) == [1, 2, 3, 4]
+    assert sqlite_storage.get_exercise_history(1, "unknown") is None
+
+    histories = sqlite_storage.get_exercise_program_histories(1, [exercise_program.id, "unknown"], 3)
+    assert list(histories) == [exercise_program.id]
+    assert list(histories[exercise_program.id].timestamps) == [2000, 3000, 4000]
+    assert list(histories[exercise_program.id].weights) == [112, 110, 113]
+    # The same as the history built from the user by the HistoryStore
+    built = storage.StorageInterface.get_exercise_program_histories(sqlite_storage, 1, [exercise_program.id])
+    read = sqlite_storage.get_exercise_program_histories(1, [exercise_program.id])
+    assert list(read[exercise_program.id].weights) == list(built[exercise_program.id].weights)